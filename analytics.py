@@ -0,0 +1,222 @@
+"""投资组合绩效分析：每笔成交、每个资金快照只做 O(1) 的增量更新，查询耗时与历史长度无关
+
+- 夏普比率/波动率：日收益率的均值和方差用 Welford 算法累计，当天尚未结束的收益率只在查询时临时并入
+- 最大回撤：资金曲线的历史最高点和最大回撤随快照更新
+- 换手率、胜率、各股票已实现盈亏：成交时更新计数器
+"""
+import math
+import datetime
+from common import DATETIME_FORMAT
+
+# 年化使用的交易日数
+TRADING_DAYS_PER_YEAR = 252
+
+
+class RunningStats:
+    """Welford 在线均值和方差"""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def copy(self):
+        return RunningStats(self.count, self.mean, self.m2)
+
+    def std(self):
+        """样本标准差，少于两个值时为0"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+def _new_symbol():
+    return {"buy_amount": 0.0, "sell_amount": 0.0, "commission": 0.0, "realized_profit": 0.0,
+            "buys": 0, "sells": 0, "wins": 0, "losses": 0}
+
+
+class PerformanceAnalytics:
+    """一个账户的绩效汇总（调用方需持有 TradingAPI.lock）"""
+
+    def __init__(self, initial_equity):
+        self.initial_equity = initial_equity
+        self.daily_returns = RunningStats()
+        self.daily_equity = RunningStats()  # 各日收盘资产，用于平均资产（换手率）
+        self.day = None  # 最近一个资金快照所在日期（date.toordinal）
+        self.prev_close = initial_equity  # 上一个交易日的收盘资产
+        self.last_equity = initial_equity
+        self.peak = initial_equity
+        self.max_drawdown = 0.0
+        self.max_drawdown_at = None  # 最大回撤出现的时间（epoch秒）
+        self.buy_amount = 0.0
+        self.sell_amount = 0.0
+        self.commission = 0.0
+        self.wins = 0
+        self.losses = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.symbols = {}  # {股票代码: 成交金额、费用、已实现盈亏、胜负次数}
+
+    # ---- 增量更新 ----
+
+    def record_equity(self, ts, equity):
+        """记录一个资金快照：跨日时结算上一日收益率，并更新最高点和回撤"""
+        day = datetime.date.fromtimestamp(ts).toordinal()
+        if self.day is None:
+            self.day = day
+        elif day > self.day:
+            self._close_day()
+            self.day = day
+        elif day < self.day:
+            # 时间倒退（如系统时间调整）的快照不参与统计
+            return
+        self.last_equity = equity
+        if equity > self.peak:
+            self.peak = equity
+        elif self.peak > 0:
+            drawdown = 1 - equity / self.peak
+            if drawdown > self.max_drawdown:
+                self.max_drawdown = drawdown
+                self.max_drawdown_at = ts
+
+    def _close_day(self):
+        """以最后一个快照作为当日收盘资产"""
+        if self.prev_close > 0:
+            self.daily_returns.add(self.last_equity / self.prev_close - 1)
+        self.daily_equity.add(self.last_equity)
+        self.prev_close = self.last_equity
+
+    def record_fill(self, stock, is_buy, amount, commission, profit=0.0):
+        """记录一笔成交（卖出时 profit 为整笔成交扣除费用后的已实现盈亏）"""
+        symbol = self.symbols.get(stock)
+        if symbol is None:
+            symbol = self.symbols[stock] = _new_symbol()
+        symbol["commission"] += commission
+        self.commission += commission
+        if is_buy:
+            symbol["buy_amount"] += amount
+            symbol["buys"] += 1
+            self.buy_amount += amount
+            return
+        symbol["sell_amount"] += amount
+        symbol["sells"] += 1
+        symbol["realized_profit"] += profit
+        self.sell_amount += amount
+        if profit > 0:
+            symbol["wins"] += 1
+            self.wins += 1
+            self.gross_profit += profit
+        else:
+            symbol["losses"] += 1
+            self.losses += 1
+            self.gross_loss -= profit
+
+    # ---- 查询 ----
+
+    def report(self, stock=None):
+        """绩效指标（收益率、回撤为小数）；stock 不为空时只返回该股票的明细"""
+        returns = self.daily_returns.copy()
+        equity = self.daily_equity.copy()
+        if self.day is not None:
+            # 当天尚未结束，临时并入当前收益率
+            if self.prev_close > 0:
+                returns.add(self.last_equity / self.prev_close - 1)
+            equity.add(self.last_equity)
+        std = returns.std()
+        symbols = self.symbols if stock is None else {stock: self.symbols.get(stock) or _new_symbol()}
+        closed = self.wins + self.losses
+        return {
+            "total_return": self.last_equity / self.initial_equity - 1 if self.initial_equity else None,
+            "trading_days": returns.count,
+            "daily_return_mean": returns.mean,
+            "volatility": std * math.sqrt(TRADING_DAYS_PER_YEAR),
+            "sharpe_ratio": returns.mean / std * math.sqrt(TRADING_DAYS_PER_YEAR) if std > 0 else None,
+            "max_drawdown": self.max_drawdown,
+            "max_drawdown_at": (datetime.datetime.fromtimestamp(self.max_drawdown_at).strftime(DATETIME_FORMAT)
+                                if self.max_drawdown_at is not None else None),
+            "current_drawdown": 1 - self.last_equity / self.peak if self.peak > 0 else 0.0,
+            "peak_equity": self.peak,
+            "buy_amount": self.buy_amount,
+            "sell_amount": self.sell_amount,
+            "commission": self.commission,
+            # 换手率：(买入额 + 卖出额) / 2 / 平均日收盘资产
+            "turnover": (self.buy_amount + self.sell_amount) / 2 / equity.mean if equity.mean > 0 else None,
+            "win_rate": self.wins / closed if closed else None,
+            "wins": self.wins,
+            "losses": self.losses,
+            "profit_factor": self.gross_profit / self.gross_loss if self.gross_loss > 0 else None,
+            "realized_profit": self.gross_profit - self.gross_loss,
+            "symbols": {
+                code: dict(values, win_rate=values["wins"] / (values["wins"] + values["losses"])
+                           if values["wins"] + values["losses"] else None)
+                for code, values in symbols.items()
+            },
+        }
+
+    # ---- 持久化 ----
+
+    def to_dict(self):
+        """保存到状态文件的汇总量"""
+        return {
+            "initial_equity": self.initial_equity,
+            "daily_returns": [self.daily_returns.count, self.daily_returns.mean, self.daily_returns.m2],
+            "daily_equity": [self.daily_equity.count, self.daily_equity.mean, self.daily_equity.m2],
+            "day": self.day,
+            "prev_close": self.prev_close,
+            "last_equity": self.last_equity,
+            "peak": self.peak,
+            "max_drawdown": self.max_drawdown,
+            "max_drawdown_at": self.max_drawdown_at,
+            "buy_amount": self.buy_amount,
+            "sell_amount": self.sell_amount,
+            "commission": self.commission,
+            "wins": self.wins,
+            "losses": self.losses,
+            "gross_profit": self.gross_profit,
+            "gross_loss": self.gross_loss,
+            "symbols": self.symbols,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        analytics = cls(data["initial_equity"])
+        analytics.daily_returns = RunningStats(*data["daily_returns"])
+        analytics.daily_equity = RunningStats(*data["daily_equity"])
+        for name in ("day", "prev_close", "last_equity", "peak", "max_drawdown", "max_drawdown_at",
+                     "buy_amount", "sell_amount", "commission", "wins", "losses", "gross_profit", "gross_loss"):
+            setattr(analytics, name, data[name])
+        analytics.symbols = {code: dict(_new_symbol(), **values) for code, values in data["symbols"].items()}
+        return analytics
+
+    @classmethod
+    def rebuild(cls, initial_equity, trade_history, equity_points):
+        """从成交记录和资金曲线重建（旧版本状态文件没有保存汇总量时使用）
+
+        trade_history 中同一订单的多条卖出记录（按批次拆分）合并为一笔成交；
+        equity_points 为 [(epoch秒, 总资产)]
+        """
+        analytics = cls(initial_equity)
+        fill = None  # 正在合并的卖出成交 [订单ID, 股票, 金额, 费用, 盈亏]
+        for trade in trade_history:
+            if trade["type"] == "买入":
+                analytics.record_fill(trade["stock"], True, trade["amount"], trade["commission"])
+                continue
+            if fill is not None and fill[0] == trade["order_id"]:
+                fill[2] += trade["amount"]
+                fill[3] += trade["commission"]
+                fill[4] += trade["profit"]
+                continue
+            if fill is not None:
+                analytics.record_fill(fill[1], False, *fill[2:])
+            fill = [trade["order_id"], trade["stock"], trade["amount"], trade["commission"], trade["profit"]]
+        if fill is not None:
+            analytics.record_fill(fill[1], False, *fill[2:])
+        for ts, equity in equity_points:
+            analytics.record_equity(ts, equity)
+        return analytics
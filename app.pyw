@@ -1,21 +1,76 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, g, Response
 from flask_cors import CORS
 from trading_api import TradingAPI
+from common import ORDER_SIDES, DATE_FORMAT, DATETIME_FORMAT
+from metrics import API_LATENCY, ENGINE_TICK_LAG, render_metrics
+from profiler import PROFILER
+from data_source import create_data_source
+from watchlist import WatchlistManager
+from kline import KlineStore, parse_indicators
+from risk import RiskEngine
+from fees import FeeSchedule
+from cluster import EngineService, EngineClient, EngineUnavailable, RemoteTradingAPI, RemoteWatchlists, parse_address, load_authkey
+import fast_json
 import threading
 import datetime
+import time
 import os
 import sys
 import atexit
-import tkinter as tk
-from tkinter import messagebox
-import webbrowser
 
 
 app = Flask(__name__)
 CORS(app)
+# 安装了 orjson 时用它编码 /api/* 的JSON响应
+fast_json.install(app)
 
-# 创建交易API实例
-trading_api = TradingAPI(initial_cash=100000.0)
+# 行情数据源：MARKET_DATA=live（默认）/ record（实时并录制）/ replay（离线回放录制数据）
+data_source = create_data_source(
+    os.environ.get('MARKET_DATA', 'live'),
+    directory=os.environ.get('MARKET_DATA_DIR', 'data/quotes'),
+    speed=float(os.environ.get('REPLAY_SPEED', '1'))
+)
+
+# 下单前风控限额（默认均为 0，即不限制），运行中可通过 /api/admin/risk 修改
+risk = RiskEngine(
+    max_order_value=float(os.environ.get('RISK_MAX_ORDER_VALUE', '0')),
+    max_position_quantity=int(os.environ.get('RISK_MAX_POSITION', '0')),
+    max_concentration=float(os.environ.get('RISK_MAX_CONCENTRATION', '0')),
+    max_orders_per_second=int(os.environ.get('RISK_MAX_ORDERS_PER_SECOND', '0'))
+)
+
+# 交易费率表：FEE_SCHEDULE 指定JSON费率文件（格式见 fees.DEFAULT_CONFIG），FEE_BROKER 选择券商
+fees = FeeSchedule.load(os.environ['FEE_SCHEDULE'], os.environ.get('FEE_BROKER')) if os.environ.get('FEE_SCHEDULE') else FeeSchedule()
+
+# 服务端口
+PORT = int(os.environ.get('PORT', '5000'))
+
+# 订单和成交记录分页查询的默认每页条数
+DEFAULT_PAGE_SIZE = 100
+
+# 多节点部署：设置 ENGINE_ADDRESS 时本进程是无状态API节点，命令转发给该地址的引擎服务，读请求使用复制的快照
+ENGINE_ADDRESS = os.environ.get('ENGINE_ADDRESS')
+
+if ENGINE_ADDRESS:
+    engine_client = EngineClient(parse_address(ENGINE_ADDRESS), load_authkey())
+    trading_api = RemoteTradingAPI(engine_client)
+    watchlists = RemoteWatchlists(engine_client)
+else:
+    # 创建交易API实例（MATCH_WORKERS>0 时按股票分片到多个工作进程撮合）
+    trading_api = TradingAPI(
+        initial_cash=100000.0,
+        data_source=data_source,
+        match_workers=int(os.environ.get('MATCH_WORKERS', '0')),
+        risk=risk,
+        fees=fees
+    )
+
+    # 自选股（后台按 WATCHLIST_INTERVAL 秒批量刷新行情）
+    watchlists = WatchlistManager(data_source, interval=float(os.environ.get('WATCHLIST_INTERVAL', '3')))
+
+# 历史K线缓存（本地文件，增量同步，盘中最多每 KLINE_REFRESH 秒请求一次上游；同一台机器上的API节点各用一个目录）
+klines = KlineStore(data_source, directory=os.environ.get('KLINE_DIR', f'data/kline_{PORT}' if ENGINE_ADDRESS else 'data/kline'),
+                    refresh=float(os.environ.get('KLINE_REFRESH', '60')))
 
 # 全局变量，用于控制服务器状态
 server_running = True
@@ -23,7 +78,13 @@ server_thread = None
 
 def run_trading_engine():
     """运行交易引擎，定期处理挂单"""
+    last_start = None
     while True:
+        start = time.monotonic()
+        if last_start is not None:
+            # 比1秒节拍晚了多少：上一轮撮合耗时加线程调度延迟
+            ENGINE_TICK_LAG.observe(max(0.0, start - last_start - 1))
+        last_start = start
         trading_api.process_pending_orders()
         # 每1秒处理一次挂单
         threading.Event().wait(1)
@@ -31,10 +92,15 @@ def run_trading_engine():
 def run_server():
     """运行服务器"""
     app.name = "StockApp"
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host='0.0.0.0', port=PORT, debug=False)
 
 def create_control_window():
     """创建控制窗口"""
+    # tkinter 只有控制面板用到，无界面运行时不导入
+    import tkinter as tk
+    from tkinter import messagebox
+    import webbrowser
+    
     def on_closing():
         """关闭服务器和窗口"""
         global server_running
@@ -46,7 +112,7 @@ def create_control_window():
     
     def open_browser():
         """在浏览器中打开应用"""
-        webbrowser.open('http://127.0.0.1:5000')
+        webbrowser.open(f'http://127.0.0.1:{PORT}')
     
     # 创建主窗口
     root = tk.Tk()
@@ -140,7 +206,7 @@ def create_control_window():
     # 状态信息
     info_label = tk.Label(
         status_frame, 
-        text=f"服务地址: http://127.0.0.1:5000\n启动时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        text=f"服务地址: http://127.0.0.1:{PORT}\n启动时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
         font=("黑体", 8),
         fg="#383838",
         justify="left"
@@ -158,6 +224,90 @@ def create_control_window():
     # 启动Tkinter主循环
     root.mainloop()
 
+def parse_datetime_arg(value, end_of_day=False):
+    """解析查询参数中的日期（YYYY-MM-DD）或日期时间（YYYY-MM-DD HH:MM:SS）"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    except ValueError:
+        pass
+    try:
+        day = datetime.datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise ValueError(f"日期格式错误: {value}")
+    if end_of_day:
+        return day.replace(hour=23, minute=59, second=59)
+    return day
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间"""
+    g.request_start = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    PROFILER.begin(f"{request.method} {route}")
+
+@app.after_request
+def record_request_latency(response):
+    """统计各接口处理耗时"""
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        API_LATENCY.observe(time.perf_counter() - start,
+                            route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    """结束请求的性能追踪"""
+    PROFILER.end()
+
+@app.errorhandler(EngineUnavailable)
+def engine_unavailable(e):
+    """API节点连不上交易引擎时返回503"""
+    return jsonify({'success': False, 'message': str(e)}), 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """运行指标（Prometheus 文本格式）"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def profiling():
+    """查看或修改慢撮合/慢请求追踪配置（无需重启）"""
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            threshold = float(data['threshold']) if 'threshold' in data else None
+            max_files = int(data['max_files']) if 'max_files' in data else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': '参数格式错误'}), 400
+        success, message = PROFILER.configure(
+            enabled=data.get('enabled'),
+            threshold=threshold,
+            mode=data.get('mode') if 'mode' in data else False,
+            max_files=max_files
+        )
+        return jsonify({'success': success, 'message': message, 'status': PROFILER.status()}), 200 if success else 400
+    return jsonify(PROFILER.status())
+
+@app.route('/api/admin/risk', methods=['GET', 'POST'])
+def risk_limits():
+    """查看风控限额和当前敞口，或修改限额（0 表示不限制）"""
+    if request.method == 'POST':
+        data = request.json or {}
+        types = {'max_order_value': float, 'max_position_quantity': int,
+                 'max_concentration': float, 'max_orders_per_second': int}
+        try:
+            limits = {name: types[name](value) if value is not None else None for name, value in data.items()}
+        except KeyError as e:
+            return jsonify({'success': False, 'message': f"未知的风控限额: {e.args[0]}"}), 400
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': '参数格式错误'}), 400
+        success, message = trading_api.set_risk_limits(**limits)
+        return jsonify({'success': success, 'message': message, **trading_api.get_risk_status()}), 200 if success else 400
+    return jsonify(trading_api.get_risk_status())
+
 @app.route('/')
 def index():
     """主页面"""
@@ -169,12 +319,39 @@ def get_portfolio():
     portfolio = trading_api.generate_report()
     return jsonify(portfolio)
 
+@app.route('/api/analytics', methods=['GET'])
+def get_analytics():
+    """绩效指标（增量维护的汇总量，耗时与成交记录数量无关）；stock 参数只返回该股票的明细"""
+    return jsonify(trading_api.get_analytics(request.args.get('stock') or None))
+
 @app.route('/api/stock/<stock_code>', methods=['GET'])
 def get_stock_data(stock_code):
     """获取股票数据"""
     data = trading_api.get_stock_data(stock_code)
     return jsonify(data)
 
+@app.route('/api/kline/<stock_code>', methods=['GET'])
+def get_kline(stock_code):
+    """历史K线和技术指标
+    
+    参数: period=1m/5m/15m/30m/60m/day, start/end=日期或日期时间, limit=条数,
+          indicators=逗号分隔的指标（如 ma5,ema12,vwap,vwap20,vol20）
+    """
+    period = request.args.get('period', 'day')
+    try:
+        start = parse_datetime_arg(request.args.get('start'))
+        end = parse_datetime_arg(request.args.get('end'), end_of_day=True)
+        bars = klines.query(
+            stock_code, period,
+            start=start.timestamp() if start else None,
+            end=end.timestamp() if end else None,
+            limit=request.args.get('limit', type=int),
+            indicators=parse_indicators(request.args.get('indicators'))
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'code': stock_code, 'period': period, 'bars': bars})
+
 @app.route('/api/buy', methods=['POST'])
 def buy_stock():
     """买入股票"""
@@ -206,17 +383,124 @@ def cancel_order():
     success, message = trading_api.cancel_order(order_id, datetime.datetime.now())
     return jsonify({'success': success, 'message': message})
 
+@app.route('/api/orders/batch', methods=['POST'])
+def batch_orders():
+    """批量下单"""
+    data = request.json or {}
+    orders = []
+    for item in data.get('orders', []):
+        orders.append({
+            'type': ORDER_SIDES.get(item.get('side') or item.get('type')),
+            'stock': item.get('stock'),
+            'price': item.get('price'),
+            'quantity': item.get('quantity')
+        })
+    
+    if not orders:
+        return jsonify({'success': False, 'message': '订单列表为空', 'results': []})
+    
+    results = trading_api.place_orders_batch(orders, datetime.datetime.now())
+    succeeded = sum(1 for r in results if r['success'])
+    return jsonify({
+        'success': succeeded > 0,
+        'message': f"成功{succeeded}笔，失败{len(results) - succeeded}笔",
+        'results': results
+    })
+
+@app.route('/api/cancel_all', methods=['POST'])
+def cancel_all():
+    """一键撤单（可按股票代码或买卖方向过滤）"""
+    data = request.json or {}
+    side = data.get('side')
+    order_type = ORDER_SIDES.get(side) if side else None
+    if side and not order_type:
+        return jsonify({'success': False, 'message': '买卖方向错误', 'canceled': []})
+    
+    success, message, canceled = trading_api.cancel_all_orders(
+        datetime.datetime.now(), stock_code=data.get('stock'), order_type=order_type)
+    return jsonify({'success': success, 'message': message, 'canceled': canceled})
+
+@app.route('/api/watchlists', methods=['GET'])
+def get_watchlists():
+    """获取所有自选股列表"""
+    return jsonify(watchlists.get_watchlists())
+
+@app.route('/api/watchlists', methods=['POST'])
+def set_watchlist():
+    """创建或替换自选股列表"""
+    data = request.json or {}
+    success, message = watchlists.set_watchlist(data.get('name'), data.get('stocks', []))
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/watchlists/<name>', methods=['DELETE'])
+def delete_watchlist(name):
+    """删除自选股列表"""
+    success, message = watchlists.delete_watchlist(name)
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/watchlists/<name>/quotes', methods=['GET'])
+def get_watchlist_quotes(name):
+    """获取自选股的最新行情"""
+    quotes = watchlists.get_watchlist_quotes(name)
+    if quotes is None:
+        return jsonify({'success': False, 'message': '自选股不存在'}), 404
+    return jsonify(quotes)
+
+@app.route('/api/scanner', methods=['GET'])
+def scan_market():
+    """自选股行情扫描（type=gainers/losers/movers/limit_up/limit_down/volume_spike）"""
+    try:
+        result = watchlists.scan(
+            request.args.get('type', 'movers'),
+            limit=request.args.get('limit', 20, type=int),
+            threshold=request.args.get('threshold', type=float)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(result)
+
+def query_filters():
+    """订单和成交记录的分页查询参数：stock, side, start, end, limit, cursor, fields"""
+    return {
+        'stock': request.args.get('stock') or None,
+        'side': request.args.get('side') or None,
+        'start': parse_datetime_arg(request.args.get('start')),
+        'end': parse_datetime_arg(request.args.get('end'), end_of_day=True),
+        'limit': request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+        'cursor': request.args.get('cursor') or None,
+        'fields': request.args.get('fields') or None
+    }
+
 @app.route('/api/orders', methods=['GET'])
 def get_orders():
-    """获取所有订单"""
-    orders = trading_api.get_all_orders()
-    return jsonify(orders)
+    """获取订单
+
+    不带参数时返回全部订单；带参数时从新到旧分页返回 {'results': [...], 'next_cursor': ...}
+    参数: status=pending/filled/canceled/expired（可逗号分隔多个）、order_id=订单号或其前缀，
+    及 query_filters 中的参数
+    """
+    if not request.args:
+        return jsonify(trading_api.get_all_orders())
+    try:
+        page = trading_api.query_orders(status=request.args.get('status') or None,
+                                        order_id=request.args.get('order_id') or None, **query_filters())
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(page)
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """获取交易历史"""
-    history = trading_api.get_trade_history()
-    return jsonify(history)
+    """获取交易历史
+
+    不带参数时返回全部成交记录；带参数时从新到旧分页返回，参数见 query_filters
+    """
+    if not request.args:
+        return jsonify(trading_api.get_trade_history())
+    try:
+        page = trading_api.query_trades(**query_filters())
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(page)
 
 @app.route('/api/save_state', methods=['POST'])
 def save_state():
@@ -239,21 +523,69 @@ def get_trading_phase():
 
 @app.route('/api/equity_history', methods=['GET'])
 def get_equity_history():
-    """获取资金曲线历史数据"""
-    history = trading_api.get_equity_history()
+    """获取资金曲线历史数据
+    
+    参数: resolution=tick/minute/day, start/end=日期或日期时间, limit=条数
+    """
+    resolution = request.args.get('resolution', 'tick')
+    try:
+        start = parse_datetime_arg(request.args.get('start'))
+        end = parse_datetime_arg(request.args.get('end'), end_of_day=True)
+        limit = request.args.get('limit', type=int)
+        history = trading_api.get_equity_history(resolution, start, end, limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     return jsonify(history)
 
+@app.route('/api/statements', methods=['GET'])
+def get_statements():
+    """已生成日结单的日期列表（从新到旧）"""
+    return jsonify(trading_api.get_statements())
+
+@app.route('/api/statements/<day>', methods=['GET'])
+def get_statement(day):
+    """某日的日结单，day 格式为 YYYY-MM-DD"""
+    try:
+        statement = trading_api.get_statement(datetime.datetime.strptime(day, DATE_FORMAT).date())
+    except ValueError:
+        return jsonify({'success': False, 'message': '日期格式错误'}), 400
+    if statement is None:
+        return jsonify({'success': False, 'message': '该日没有日结单'}), 404
+    return jsonify(statement)
+
+@app.route('/api/admin/settle', methods=['POST'])
+def settle():
+    """立即执行日终结算（正常情况下收盘后自动执行）"""
+    statement = trading_api.check_daily_roll()
+    if statement is None:
+        return jsonify({'success': False, 'message': '没有需要结算的交易日'})
+    return jsonify({'success': True, 'message': f"{statement['date']} 日终结算完成", 'statement': statement})
+
 if __name__ == '__main__':
     # 确保数据目录存在
     os.makedirs('data', exist_ok=True)
 
-    # 启动交易引擎线程
-    engine_thread = threading.Thread(target=run_trading_engine, daemon=True)
-    engine_thread.start()
+    if not ENGINE_ADDRESS:
+        # 启动交易引擎线程
+        engine_thread = threading.Thread(target=run_trading_engine, daemon=True)
+        engine_thread.start()
+
+        # 启动自选股行情刷新线程
+        watchlists.start()
+
+        # 设置 ENGINE_LISTEN 时同时作为引擎服务，供其他API节点连接（host:port 或 Unix 套接字路径）
+        if os.environ.get('ENGINE_LISTEN'):
+            engine_service = EngineService(trading_api, watchlists, parse_address(os.environ['ENGINE_LISTEN']),
+                                           load_authkey(create=True)).start()
+            print(f"引擎服务监听 {engine_service.address}")
 
-    # 启动服务器线程
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
+    if os.environ.get('HEADLESS') == '1':
+        # 无界面模式：不创建控制面板，直接在主线程运行服务器
+        run_server()
+    else:
+        # 启动服务器线程
+        server_thread = threading.Thread(target=run_server, daemon=True)
+        server_thread.start()
 
-    create_control_window()
+        create_control_window()
 
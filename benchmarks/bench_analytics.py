@@ -0,0 +1,60 @@
+"""绩效分析的基准测试
+
+用法: python benchmarks/bench_analytics.py [成交笔数]
+
+对比增量维护的 PerformanceAnalytics.report() 与每次请求都遍历全部成交记录和资金曲线重新计算的耗时。
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import PerformanceAnalytics
+
+
+def make_history(count):
+    """随机成交记录和每日资金曲线"""
+    random.seed(0)
+    stocks = [f"sh6{i:05d}" for i in range(200)]
+    trades = []
+    for i in range(count):
+        is_buy = i % 2 == 0
+        amount = random.randint(100, 5000) * 10.0
+        trades.append({
+            "order_id": str(i), "type": "买入" if is_buy else "卖出", "stock": random.choice(stocks),
+            "amount": amount, "commission": max(5.0, amount * 0.00025),
+            "profit": 0 if is_buy else random.uniform(-500, 500),
+        })
+    start = time.time() - count * 600
+    equity = []
+    value = 100000.0
+    for day in range(count // 40 + 1):
+        value *= 1 + random.gauss(0.0005, 0.01)
+        equity.append((start + day * 86400, value))
+    return trades, equity
+
+
+def best_of(func, repeat=5):
+    """多次运行取最短耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - begin)
+    return best * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    trades, equity = make_history(count)
+    analytics = PerformanceAnalytics.rebuild(100000.0, trades, equity)
+    print(f"成交笔数: {count}，资金曲线: {len(equity)} 天")
+    print(f"增量汇总 report():   {best_of(analytics.report):8.3f} ms")
+    print(f"每次全量重新计算:    {best_of(lambda: PerformanceAnalytics.rebuild(100000.0, trades, equity).report()):8.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""交易费用计算的基准测试
+
+用法: python benchmarks/bench_fees.py [成交笔数]
+
+对比逐笔调用 FeeSchedule.fee() 与 NumPy 批量计算 FeeSchedule.fee_batch() 的耗时，
+并核对两者结果完全一致。
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fees import FeeSchedule
+
+
+def make_fills(count):
+    """随机成交：沪深北股票、买卖方向、成交金额（分）"""
+    random.seed(0)
+    stocks = [f"sh6{i:05d}" for i in range(100)] + [f"sz00{i:04d}" for i in range(100)] + ["bj830799"]
+    codes = [random.choice(stocks) for _ in range(count)]
+    is_buy = [random.random() < 0.5 for _ in range(count)]
+    amounts = [random.randint(100, 5000) * random.randint(500, 5000) for _ in range(count)]
+    return codes, is_buy, amounts
+
+
+def best_of(func, repeat=5):
+    """多次运行取最短耗时（毫秒）"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    codes, is_buy, amounts = make_fills(count)
+    fees = FeeSchedule()
+
+    scalar_ms, scalar = best_of(lambda: [fees.fee(c, b, a) for c, b, a in zip(codes, is_buy, amounts)])
+    batch_ms, batch = best_of(lambda: fees.fee_batch(codes, is_buy, amounts))
+
+    if list(batch) != scalar:
+        print("错误: fee_batch 与 fee 结果不一致")
+        return 1
+    print(f"成交笔数: {count}")
+    print(f"逐笔 fee():      {scalar_ms:8.1f} ms")
+    print(f"批量 fee_batch(): {batch_ms:8.1f} ms  ({scalar_ms / batch_ms:.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
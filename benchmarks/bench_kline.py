@@ -0,0 +1,96 @@
+"""K线查询和指标计算的基准测试
+
+用法: python benchmarks/bench_kline.py [K线数量]
+
+在临时目录生成一个分钟线文件，测量从本地 memmap 存储查询最近 240 根 / 全部K线
+（带 ma5,ma20,ema12,vwap,vol20 指标）的耗时，以及逐根 Python 循环计算同样指标的耗时。
+"""
+import os
+import sys
+import math
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kline import KlineStore, parse_indicators
+
+INDICATORS = "ma5,ma20,ema12,vwap,vol20"
+
+
+class BarsSource:
+    """只提供K线的离线数据源"""
+
+    def __init__(self, bars):
+        self.bars = bars
+
+    def get_klines(self, stock_code, klt, begin="0"):
+        return self.bars
+
+
+def make_bars(count):
+    """随机游走的1分钟K线"""
+    random.seed(0)
+    ts = time.time() - count * 60
+    price = 10.0
+    bars = []
+    for i in range(count):
+        open_price = price
+        price = max(1.0, price * math.exp(random.gauss(0, 0.002)))
+        volume = random.randint(100, 10000) * 100
+        bars.append((ts + i * 60, open_price, max(open_price, price), min(open_price, price), price,
+                     volume, volume * (open_price + price) / 2))
+    return bars
+
+
+def python_indicators(bars):
+    """逐根循环计算同样的指标（对照组）"""
+    closes = [bar[4] for bar in bars]
+    result = []
+    ema12 = closes[0]
+    amount_sum = volume_sum = 0.0
+    day = None
+    for i, bar in enumerate(bars):
+        ema12 = ema12 + (closes[i] - ema12) * 2 / 13
+        if day != int(bar[0] // 86400):
+            day, amount_sum, volume_sum = int(bar[0] // 86400), 0.0, 0.0
+        amount_sum += bar[6]
+        volume_sum += bar[5]
+        row = {"ema12": ema12, "vwap": amount_sum / volume_sum}
+        for n in (5, 20):
+            row[f"ma{n}"] = sum(closes[i - n + 1:i + 1]) / n if i >= n - 1 else None
+        if i >= 20:
+            returns = [math.log(closes[j] / closes[j - 1]) for j in range(i - 19, i + 1)]
+            mean = sum(returns) / 20
+            row["vol20"] = math.sqrt(sum((r - mean) ** 2 for r in returns) / 19 * 252 * 240)
+        result.append(row)
+    return result
+
+
+def best_of(func, repeat=5):
+    """多次运行取最短耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bars = make_bars(count)
+    indicators = parse_indicators(INDICATORS)
+    with tempfile.TemporaryDirectory(prefix="bench-kline-") as directory:
+        store = KlineStore(BarsSource(bars), directory=directory, refresh=1e9)
+        store.sync("sh600000", "1m")
+        print(f"K线数量: {count}，指标: {INDICATORS}")
+        print(f"查询最近240根:        {best_of(lambda: store.query('sh600000', '1m', limit=240, indicators=indicators)):8.1f} ms")
+        print(f"查询全部:             {best_of(lambda: store.query('sh600000', '1m', indicators=indicators), 3):8.1f} ms")
+        print(f"Python 循环计算全部:  {best_of(lambda: python_indicators(bars), 1):8.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""订单和成交记录分页查询的基准测试
+
+用法: python benchmarks/bench_orders.py [订单数]
+
+对比二级索引分页查询与返回全部记录后再过滤（原 /api/orders、/api/history 的做法）的耗时：
+挂单、某只股票的订单、当天某只股票的成交，以及不带条件的最近一页。
+"""
+import os
+import sys
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger_index import OrderIndex, TradeIndex
+from common import DATETIME_FORMAT
+
+
+def make_records(count):
+    """30天的随机订单（绝大多数已结束）和对应的成交记录"""
+    random.seed(0)
+    stocks = [f"sh6{i:05d}" for i in range(500)]
+    start = datetime.datetime.now() - datetime.timedelta(days=30)
+    step = 30 * 86400 / count
+    orders, trades = [], []
+    for i in range(count):
+        created = (start + datetime.timedelta(seconds=i * step)).strftime(DATETIME_FORMAT)
+        status = "pending" if i >= count - 50 else random.choice(("filled", "filled", "canceled", "expired"))
+        order = {"order_id": f"{i:08d}", "type": random.choice(("买入", "卖出")), "stock": random.choice(stocks),
+                 "price": 10.0, "quantity": 100, "status": status, "created_at": created, "updated_at": created,
+                 "attempts": 0, "expiry": created, "frozen": 0}
+        orders.append(order)
+        if status == "filled":
+            trades.append({"order_id": order["order_id"], "type": order["type"], "stock": order["stock"],
+                           "price": 10.0, "quantity": 100, "amount": 1000.0, "commission": 5.0, "profit": 0.0,
+                           "datetime": created})
+    return orders, trades
+
+
+def best_of(func, repeat=5):
+    """多次运行取最短耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - begin)
+    return best * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    orders, trades = make_records(count)
+    order_book = {order["order_id"]: order for order in orders}
+    order_index = OrderIndex(orders)
+    trade_index = TradeIndex(trades)
+    stock = orders[-1]["stock"]
+    today = datetime.date.today().strftime("%Y-%m-%d")
+
+    def scan_orders(match):
+        return [order for order in list(order_book.values()) if match(order)][::-1][:100]
+
+    print(f"订单数: {count}，成交记录: {len(trades)}")
+    print(f"建立索引:              {best_of(lambda: (OrderIndex(orders), TradeIndex(trades)), 1):8.1f} ms")
+    cases = [
+        ("挂单", lambda: order_index.query(status="pending", limit=100),
+         lambda: scan_orders(lambda o: o["status"] == "pending")),
+        ("某只股票的订单", lambda: order_index.query(stock=stock, limit=100),
+         lambda: scan_orders(lambda o: o["stock"] == stock)),
+        ("当天某只股票的成交", lambda: trade_index.query(stock=stock, start=today + " 00:00:00", limit=100),
+         lambda: [t for t in trades if t["stock"] == stock and t["datetime"][:10] == today][::-1][:100]),
+        ("最近一页订单", lambda: order_index.query(limit=100, fields="order_id,status"),
+         lambda: scan_orders(lambda o: True)),
+    ]
+    for name, indexed, scan in cases:
+        print(f"{name}: 索引 {best_of(indexed):8.3f} ms   全量过滤 {best_of(scan):8.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""多节点快照复制的基准测试
+
+用法: TRADING_PHASE=continuous_am python benchmarks/bench_replication.py [订单数]
+
+对比每次状态变化时复制全部订单和成交记录（原来的做法）与只复制挂单和新增/结束记录的增量：
+引擎持有锁的时间、编码后的大小，以及节点应用一个版本的耗时。最后核对节点副本的查询结果与引擎一致。
+"""
+import os
+import sys
+import time
+import pickle
+import datetime
+import tempfile
+
+from bench_serialization import make_state
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_codec import encode_state
+from data_source import MarketDataSource
+from trading_api import TradingAPI
+from cluster import EngineService, EngineClient, Replica
+from metrics import InstrumentedLock
+
+
+class HoldTimer(InstrumentedLock):
+    """记录每次持有锁的时间"""
+
+    holds = []
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self._acquired_at)
+        super().release()
+
+
+def lock_time(func):
+    """运行 func，返回 (结果, 期间最长一次持有锁的毫秒数)"""
+    HoldTimer.holds.clear()
+    result = func()
+    return result, max(HoldTimer.holds) * 1000
+
+
+class OfflineSource(MarketDataSource):
+    def get_current_price(self, stock_code):
+        return 10.0
+
+    def get_stock_limit_prices(self, stock_code):
+        return 11.0, 9.0
+
+    def get_stock_data(self, stock_code):
+        return None
+
+
+def main():
+    num_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    workdir = tempfile.mkdtemp()
+    filename = os.path.join(workdir, "trading.dat")
+    with open(filename, "wb") as f:
+        f.write(encode_state(make_state(num_orders)))
+    api = TradingAPI(data_source=OfflineSource(), filename=filename, lazy_history=False)
+    api.lock = HoldTimer("trading_api")
+    # 测试数据是过去的日期，不让后台线程做日终结算
+    api.settlement_retry_at = float("inf")
+    service = EngineService(api, None, os.path.join(workdir, "engine.sock"), b"bench")
+    # 连接不上引擎，后台同步线程一直等待，这里直接调用 _apply
+    replica = Replica(EngineClient(os.path.join(workdir, "missing.sock"), b"bench"))
+    print(f"订单 {len(api.order_book)}，成交记录 {len(api.trade_history)}")
+
+    def copy_all():
+        with api.lock:
+            return [dict(order) for order in api.order_book.values()], list(api.trade_history)
+
+    (update, full), held = lock_time(lambda: service.build_update(full=True))
+    payload = pickle.dumps(((service.started, 1), full), protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"完整快照: 持有锁 {held:8.1f} ms   大小 {len(payload) / 1e6:6.1f} MB")
+    begin = time.perf_counter()
+    replica._apply(*pickle.loads(payload))
+    print(f"节点应用完整快照:     {(time.perf_counter() - begin) * 1000:8.1f} ms")
+
+    old, held = lock_time(copy_all)
+    old = pickle.dumps(old, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"原做法（每个版本）: 持有锁 {held:8.1f} ms   大小 {len(old) / 1e6:6.1f} MB")
+
+    # 撤一笔挂单后的增量
+    order_id = api.order_index.records[next(iter(api.order_index.by_status["pending"]))]["order_id"]
+    api.cancel_order(order_id, datetime.datetime.now())
+    (update, _), held = lock_time(service.build_update)
+    payload = pickle.dumps(((service.started, 2), update), protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"增量（撤一笔挂单）: 持有锁 {held:8.3f} ms   大小 {len(payload) / 1e3:6.1f} KB")
+    begin = time.perf_counter()
+    replica._apply(*pickle.loads(payload))
+    print(f"节点应用增量:         {(time.perf_counter() - begin) * 1000:8.3f} ms")
+
+    for status in ("pending", "canceled", "filled"):
+        engine = api.query_orders(status=status, limit=100)["results"]
+        local = replica.query("orders", status=status, limit=100)["results"]
+        assert [o["order_id"] for o in engine] == [o["order_id"] for o in local], status
+    assert len(replica.trades) == len(api.trade_history)
+    print("节点副本与引擎查询结果一致")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
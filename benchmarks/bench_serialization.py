@@ -0,0 +1,104 @@
+"""状态文件和API响应编码的基准测试
+
+用法: python benchmarks/bench_serialization.py [订单数]
+
+对比 pickle 与 state_codec 的保存/加载耗时和文件大小（延迟加载为启动时只解码实时部分的耗时），
+以及标准库 json 与 orjson（如已安装）编码订单列表的耗时。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import pickle
+import random
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import DATETIME_FORMAT
+from state_codec import encode_state, decode_state
+from analytics import PerformanceAnalytics
+import fast_json
+
+
+def make_state(num_orders):
+    """生成与 TradingAPI.save_state 结构相同的测试状态"""
+    random.seed(0)
+    stocks = [f"sh6{i:05d}" for i in range(200)]
+    now = datetime.datetime(2024, 1, 2, 10, 0, 0)
+    order_book = {}
+    trade_history = []
+    for i in range(num_orders):
+        dt = (now + datetime.timedelta(seconds=i)).strftime(DATETIME_FORMAT)
+        order_id = str(uuid.UUID(int=random.getrandbits(128)))
+        order_type = random.choice(["买入", "卖出"])
+        stock = random.choice(stocks)
+        price = round(random.uniform(5, 50), 2)
+        # 只有最近的少量订单仍在挂单
+        status = "pending" if i >= num_orders - 50 else random.choice(["filled", "filled", "canceled"])
+        order_book[order_id] = {
+            "order_id": order_id, "type": order_type, "stock": stock, "price": price,
+            "quantity": 100 * random.randint(1, 50), "status": status,
+            "created_at": dt, "updated_at": dt, "attempts": random.randint(0, 10), "expiry": dt,
+            "frozen": 0,
+        }
+        if status == "filled":
+            amount = price * order_book[order_id]["quantity"]
+            trade_history.append({
+                "order_id": order_id, "type": order_type, "stock": stock, "price": price,
+                "quantity": order_book[order_id]["quantity"], "amount": amount,
+                "commission": round(max(5.0, amount * 0.00025), 2),
+                "profit": round(random.uniform(-500, 500), 2), "datetime": dt,
+            })
+    positions = {
+        stock: [[100 * random.randint(1, 10), round(random.uniform(5, 50), 2), now.date()]]
+        for stock in stocks[:50]
+    }
+    return {
+        "cash": 100000.0, "positions": positions, "frozen_positions": {stocks[0]: 100},
+        "frozen_cash": 0.0, "t_plus": 1, "trade_history": trade_history,
+        "pending_orders": [oid for oid, order in order_book.items() if order["status"] == "pending"],
+        "order_book": order_book, "initial_cash": 100000.0, "today_profit": 0.0,
+        "last_trading_day": now.date(), "analytics": PerformanceAnalytics(100000.0).to_dict(),
+    }
+
+
+def best_of(func, repeat=5):
+    """多次运行取最短耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    num_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    state = make_state(num_orders)
+    print(f"订单 {num_orders}，成交记录 {len(state['trade_history'])}")
+
+    pickled = pickle.dumps(state)
+    encoded = encode_state(state)
+    assert decode_state(encoded) == state, "编码后解码结果不一致"
+
+    print(f"{'格式':<12}{'保存(ms)':>10}{'加载(ms)':>10}{'大小(KB)':>10}")
+    print(f"{'pickle':<12}{best_of(lambda: pickle.dumps(state)):>10.1f}"
+          f"{best_of(lambda: pickle.loads(pickled)):>10.1f}{len(pickled) / 1024:>10.0f}")
+    print(f"{'state_codec':<12}{best_of(lambda: encode_state(state)):>10.1f}"
+          f"{best_of(lambda: decode_state(encoded)):>10.1f}{len(encoded) / 1024:>10.0f}")
+    print(f"{'  延迟加载':<10}{'':>10}{best_of(lambda: decode_state(encoded, lazy_history=True)):>10.1f}")
+
+    # /api/orders 的响应体
+    orders = list(state["order_book"].values())
+    print(f"\n{'JSON编码':<12}{'耗时(ms)':>10}")
+    print(f"{'json':<12}{best_of(lambda: json.dumps(orders, ensure_ascii=False)):>10.1f}")
+    if fast_json.orjson is not None:
+        print(f"{'orjson':<12}{best_of(lambda: fast_json.orjson.dumps(orders)):>10.1f}")
+    else:
+        print("orjson 未安装，跳过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""启动耗时基准测试
+
+用法: python benchmarks/bench_startup.py [订单数]
+
+在全新的子进程中分别测量两种启动方式：
+    eager  启动时导入 holidays / requests / tkinter 并解码全部历史（原来的启动方式）
+    lazy   延迟导入，启动时只加载资金、持仓和挂单，历史订单在首次访问时加载
+每种方式输出：导入模块、创建 TradingAPI、首次生成投资组合报告、首次获取全部订单 的耗时。
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+from bench_serialization import make_state
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from state_codec import encode_state
+
+CHILD = r"""
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {repo!r})
+if {eager!r}:
+    import holidays, requests, tkinter
+    holidays.CountryHoliday('CN')
+import flask, fast_json, watchlist
+from trading_api import TradingAPI
+from data_source import MarketDataSource
+
+class OfflineSource(MarketDataSource):
+    def get_current_price(self, stock_code):
+        return 10.0
+    def get_stock_limit_prices(self, stock_code):
+        return 11.0, 9.0
+    def get_stock_data(self, stock_code):
+        return None
+
+timings = {{}}
+timings["import"] = time.perf_counter() - start
+t = time.perf_counter()
+api = TradingAPI(data_source=OfflineSource(), filename={filename!r}, lazy_history=not {eager!r})
+timings["construct"] = time.perf_counter() - t
+t = time.perf_counter()
+api.generate_report()
+timings["portfolio"] = time.perf_counter() - t
+t = time.perf_counter()
+api.get_all_orders()
+timings["orders"] = time.perf_counter() - t
+timings["ready"] = timings["import"] + timings["construct"] + timings["portfolio"]
+print(json.dumps(timings))
+"""
+
+
+def run(filename, eager, repeat=3):
+    """多次启动取各项最短耗时（毫秒）"""
+    best = {}
+    for _ in range(repeat):
+        code = CHILD.format(repo=REPO, eager=eager, filename=filename)
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        for key, value in timings.items():
+            best[key] = min(best.get(key, float("inf")), value * 1000)
+    return best
+
+
+def main():
+    num_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "trading.dat")
+        with open(filename, "wb") as f:
+            f.write(encode_state(make_state(num_orders)))
+        print(f"订单 {num_orders}，状态文件 {os.path.getsize(filename) / 1024:.0f} KB")
+
+        print(f"{'方式':<8}{'导入':>10}{'创建':>10}{'组合报告':>10}{'可服务':>10}{'全部订单':>10}  (ms)")
+        for name, eager in (("eager", True), ("lazy", False)):
+            t = run(filename, eager)
+            print(f"{name:<8}{t['import']:>10.1f}{t['construct']:>10.1f}{t['portfolio']:>10.1f}"
+                  f"{t['ready']:>10.1f}{t['orders']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""本地模拟行情服务，代替东方财富接口用于压测和离线调试
+
+用法: python benchmarks/fake_quotes.py [--port 18080] [--latency 0.02]
+然后以 QUOTE_HOST=http://127.0.0.1:18080 启动 app.pyw。
+
+支持单只行情 /api/qt/stock/get、批量行情 /api/qt/ulist.np/get 和历史K线 /api/qt/stock/kline/get，
+返回字段与东方财富一致。
+价格是时间的确定函数（围绕昨收价正弦波动，不超过涨跌停），压测客户端用 quote_price()
+就能算出与服务端相同的价格，不需要再请求行情。
+"""
+import sys
+import json
+import math
+import time
+import zlib
+import argparse
+import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 价格波动幅度和周期（秒）
+AMPLITUDE = 0.03
+PERIOD = 60.0
+
+# 历史日线数量
+KLINE_DAYS = 500
+
+
+def stock_codes(count):
+    """压测使用的股票代码：沪市 sh600000 起"""
+    return [f"sh{600000 + i}" for i in range(count)]
+
+
+def prev_close(stock_code):
+    """昨收价：由股票代码确定，5~50元"""
+    return round(5 + zlib.crc32(stock_code.encode()) % 4500 / 100, 2)
+
+
+def quote_price(stock_code, ts=None):
+    """ts 时刻的最新价"""
+    ts = time.time() if ts is None else ts
+    base = prev_close(stock_code)
+    phase = zlib.crc32(stock_code.encode()) % 1000 / 1000 * 2 * math.pi
+    return round(base * (1 + AMPLITUDE * math.sin(2 * math.pi * ts / PERIOD + phase)), 2)
+
+
+def quote_fields(stock_code):
+    """一只股票的完整行情（小数价格）"""
+    base = prev_close(stock_code)
+    price = quote_price(stock_code)
+    return {
+        "name": f"模拟{stock_code[-4:]}",
+        "current": price,
+        "prev_close": base,
+        "open": base,
+        "high": round(base * (1 + AMPLITUDE), 2),
+        "low": round(base * (1 - AMPLITUDE), 2),
+        "upper_limit": round(base * 1.1, 2),
+        "lower_limit": round(base * 0.9, 2),
+        "volume": 100000,
+        "amount": round(price * 100000 * 100, 2),
+    }
+
+
+def code_of(secid):
+    """东方财富证券ID转股票代码：1.600000 -> sh600000"""
+    market, _, number = secid.partition(".")
+    return ("sh" if market == "1" else "sz") + number
+
+
+def stock_get(secid):
+    """单只行情（fltt=1，价格为乘以10^f59的整数）"""
+    q = quote_fields(code_of(secid))
+    scaled = lambda value: int(round(value * 100))
+    data = {
+        "f43": scaled(q["current"]), "f44": scaled(q["high"]), "f45": scaled(q["low"]),
+        "f46": scaled(q["open"]), "f47": q["volume"], "f48": q["amount"],
+        "f51": scaled(q["upper_limit"]), "f52": scaled(q["lower_limit"]),
+        "f58": q["name"], "f59": 2, "f60": scaled(q["prev_close"]),
+    }
+    # 五档：买价依次低一分，卖价依次高一分
+    for i, (bid, bid_vol, ask, ask_vol) in enumerate(zip(
+            ("f19", "f17", "f15", "f13", "f11"), ("f20", "f18", "f16", "f14", "f12"),
+            ("f39", "f37", "f35", "f33", "f31"), ("f40", "f38", "f36", "f34", "f32"))):
+        data[bid] = data["f43"] - i - 1
+        data[ask] = data["f43"] + i + 1
+        data[bid_vol] = data[ask_vol] = 100 * (i + 1)
+    return {"rc": 0, "data": data}
+
+
+def ulist_get(secids):
+    """批量行情（fltt=2，直接返回小数价格）"""
+    diff = []
+    for secid in secids.split(","):
+        code = code_of(secid)
+        q = quote_fields(code)
+        change = round(q["current"] - q["prev_close"], 2)
+        diff.append({
+            "f2": q["current"], "f3": round(change / q["prev_close"] * 100, 2), "f4": change,
+            "f5": q["volume"], "f6": q["amount"], "f12": code[2:], "f13": 1 if code.startswith("sh") else 0,
+            "f14": q["name"], "f15": q["high"], "f16": q["low"], "f17": q["open"], "f18": q["prev_close"],
+            "f350": q["upper_limit"], "f351": q["lower_limit"],
+        })
+    return {"rc": 0, "data": {"total": len(diff), "diff": diff}}
+
+
+def kline_get(secid, klt, begin):
+    """历史K线：日线为最近 KLINE_DAYS 个工作日，分钟线为今天已走完的交易时段（fltt=2 小数价格）"""
+    code = code_of(secid)
+    klt = int(klt)
+    today = datetime.date.today()
+    begin_day = datetime.datetime.strptime(begin, "%Y%m%d").date() if begin.isdigit() and len(begin) == 8 else None
+    times = []
+    if klt == 101:
+        day = today
+        while len(times) < KLINE_DAYS:
+            if day.weekday() < 5:
+                times.append(datetime.datetime.combine(day, datetime.time(15, 0)))
+            day -= datetime.timedelta(days=1)
+        times.reverse()
+    else:
+        now = datetime.datetime.now()
+        for start, end in ((datetime.time(9, 30), datetime.time(11, 30)), (datetime.time(13, 0), datetime.time(15, 0))):
+            bar_time = datetime.datetime.combine(today, start) + datetime.timedelta(minutes=klt)
+            while bar_time.time() <= end and bar_time <= now:
+                times.append(bar_time)
+                bar_time += datetime.timedelta(minutes=klt)
+    klines = []
+    for bar_time in times:
+        if begin_day and bar_time.date() < begin_day:
+            continue
+        ts = bar_time.timestamp()
+        # 日线价格在一个价格周期内取样，避免所有日线收盘价相同
+        close = quote_price(code, ts + (ts // 86400) * PERIOD / 7 if klt == 101 else ts)
+        open_price = quote_price(code, ts - PERIOD / 4)
+        high, low = round(max(open_price, close) * 1.005, 2), round(min(open_price, close) * 0.995, 2)
+        volume = 1000 + zlib.crc32(f"{code}{ts}".encode()) % 9000
+        label = bar_time.strftime("%Y-%m-%d" if klt == 101 else "%Y-%m-%d %H:%M")
+        klines.append(f"{label},{open_price},{close},{high},{low},{volume},{round(volume * 100 * close, 2)}")
+    return {"rc": 0, "data": {"code": code[2:], "name": f"模拟{code[-4:]}", "klines": klines}}
+
+
+class QuoteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0  # 模拟的上游响应延迟（秒）
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/api/qt/stock/get" and "secid" in params:
+            body = stock_get(params["secid"])
+        elif url.path == "/api/qt/ulist.np/get" and "secids" in params:
+            body = ulist_get(params["secids"])
+        elif url.path == "/api/qt/stock/kline/get" and "secid" in params:
+            body = kline_get(params["secid"], params.get("klt", "101"), params.get("beg", "0"))
+        else:
+            body = {"rc": 102, "data": None}
+        if self.latency:
+            time.sleep(self.latency)
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟东方财富行情服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.02, help="每个请求的模拟延迟（秒）")
+    args = parser.parse_args(argv)
+
+    QuoteHandler.latency = args.latency
+    server = ThreadingHTTPServer((args.host, args.port), QuoteHandler)
+    server.daemon_threads = True
+    print(f"模拟行情服务: http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,682 @@
+"""交易服务压测工具：大量并发模拟用户通过真实的 Flask 接口下单、撤单、查询
+
+用法:
+    python benchmarks/loadtest.py run [--clients 200] [--duration 60] [--mix buy=25,sell=15,...] [-o 结果.json]
+    python benchmarks/loadtest.py compare 基准.json 新版本.json ...
+    python benchmarks/loadtest.py versions <git版本> <git版本> ... [run 的参数]
+
+run 会启动本地模拟行情服务（benchmarks/fake_quotes.py）和一个无界面的 app.pyw，
+在临时目录里写入有足够资金和已交收持仓的初始状态，然后用 asyncio 模拟 --clients 个用户，
+每个用户一条 keep-alive 连接，按 --mix 的比例随机访问：
+    buy / sell    /api/buy、/api/sell（价格在最新价上下 --spread 范围内，每次100股）
+    cancel        /api/cancel_order（撤销自己之前转为挂单的订单，没有时改为买入）
+    portfolio     /api/portfolio
+    orders        /api/orders
+两次请求之间按指数分布等待 --think 秒（0 表示不等待，测最大吞吐）。
+--phase 固定服务端的交易阶段：pre_open 时所有订单进入撮合引擎，continuous_am 时立即成交。
+
+输出各接口的吞吐、延迟分位数、错误率（连接失败/超时/HTTP错误）、业务拒绝率，
+以及从 /metrics 读取的撮合轮次延迟（engine_tick_lag_seconds）和撮合耗时。
+-o 保存结果，compare 对比多次结果；versions 用 git worktree 检出各版本依次压测后直接对比
+（只能对比已支持 QUOTE_HOST / PORT / TRADING_PHASE 环境变量的版本，否则会请求真实行情）。
+--url 可以压测已经在运行的服务，此时不启动模拟行情和 app.pyw。
+--api-nodes N 按多节点方式部署：app.pyw 作为引擎服务（ENGINE_LISTEN），另启动 N 个无状态API节点
+（ENGINE_ADDRESS），模拟用户平均分配到各节点，用来观察读请求随节点数扩展的情况。
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import datetime
+import tempfile
+import subprocess
+import unicodedata
+from collections import Counter
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_quotes import stock_codes, quote_price
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ACTIONS = ("buy", "sell", "cancel", "portfolio", "orders")
+DEFAULT_MIX = "buy=25,sell=15,cancel=10,portfolio=30,orders=20"
+
+# 转为挂单时返回的提示信息中带有订单号
+ORDER_ID_PATTERN = re.compile(r"订单号: ([0-9a-f-]{36})")
+
+# 写入初始状态（用被测版本自己的 state_codec，保证能被它读取）
+SEED = r"""
+import sys, datetime
+sys.path.insert(0, {repo!r})
+from state_codec import encode_state
+bought = datetime.date.today() - datetime.timedelta(days=10)
+positions = {{code: [[{quantity}, price, bought]] for code, price in {prices!r}.items()}}
+state = {{
+    "cash": {cash!r}, "positions": positions, "frozen_positions": {{}}, "frozen_cash": 0.0,
+    "t_plus": 1, "trade_history": [], "pending_orders": [], "order_book": {{}},
+    "initial_cash": {cash!r}, "today_profit": 0.0, "last_trading_day": datetime.date.today(),
+}}
+with open({filename!r}, "wb") as f:
+    f.write(encode_state(state))
+"""
+
+
+def parse_mix(text):
+    """解析请求比例，如 buy=25,sell=15,portfolio=60"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"未知的请求类型: {name}（可选 {', '.join(ACTIONS)}）")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"比例格式错误: {item}")
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("比例之和必须大于0")
+    return mix
+
+
+def free_port():
+    """取一个空闲的本地端口"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def raise_fd_limit():
+    """大量并发连接需要更多文件描述符，把软限制提高到硬限制"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def percentile(sorted_values, q):
+    """已排序列表的分位数"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class HttpConnection:
+    """最简单的 HTTP/1.1 keep-alive 客户端（每个模拟用户一条连接）"""
+
+    def __init__(self, host, port, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        """发送请求，返回 (状态码, 响应体)；连接失败或超时抛出异常"""
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Length: {len(body)}\r\n"
+        if payload is not None:
+            head += "Content-Type: application/json\r\n"
+        data = head.encode("latin-1") + b"\r\n" + body
+        # 复用的连接可能已被服务端关闭，此时重连重试一次
+        for attempt in range(2):
+            reused = self.writer is not None
+            try:
+                return await asyncio.wait_for(self._send(data), self.timeout)
+            except ConnectionError:
+                self.close()
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                self.close()
+                raise
+
+    async def _send(self, data):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(data)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("连接已被服务端关闭")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b"".join(chunks)
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection") == "close" or status_line.startswith(b"HTTP/1.0"):
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Stats:
+    """各类请求在统计窗口内的结果"""
+
+    def __init__(self):
+        self.latencies = {action: [] for action in ACTIONS}
+        self.ok = Counter()
+        self.rejected = Counter()
+        self.errors = Counter()
+        self.error_messages = Counter()
+
+    def record(self, action, latency, outcome, message=None):
+        self.latencies[action].append(latency)
+        if outcome == "ok":
+            self.ok[action] += 1
+        elif outcome == "rejected":
+            self.rejected[action] += 1
+        else:
+            self.errors[action] += 1
+            self.error_messages[message] += 1
+
+
+def latency_summary(values):
+    """延迟分位数（毫秒）"""
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None, "mean": None}
+    return {
+        "p50": percentile(values, 0.50) * 1000,
+        "p90": percentile(values, 0.90) * 1000,
+        "p99": percentile(values, 0.99) * 1000,
+        "max": values[-1] * 1000,
+        "mean": sum(values) / len(values) * 1000,
+    }
+
+
+def parse_histogram(text, name):
+    """从 Prometheus 文本中取无标签直方图 ([(上界, 累计数)], 总和, 总数)，不存在返回None"""
+    buckets, total, count = [], None, None
+    bucket_pattern = re.compile(rf'^{name}_bucket\{{le="([^"]+)"\}} (\S+)$')
+    for line in text.splitlines():
+        match = bucket_pattern.match(line)
+        if match:
+            buckets.append((float(match.group(1)), float(match.group(2))))
+        elif line.startswith(f"{name}_sum "):
+            total = float(line.split()[1])
+        elif line.startswith(f"{name}_count "):
+            count = float(line.split()[1])
+    if count is None:
+        return None
+    return buckets, total, count
+
+
+def histogram_delta(before, after):
+    """两次采样之间的直方图统计（毫秒）：次数、平均、p50/p95/p99（取所在分桶上界）"""
+    if after is None:
+        return None
+    if before is None:
+        before = ([(bound, 0.0) for bound, _ in after[0]], 0.0, 0.0)
+    count = after[2] - before[2]
+    if count <= 0:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+    buckets = [(bound, a - b) for (bound, a), (_, b) in zip(after[0], before[0])]
+
+    def quantile(q):
+        for bound, cumulative in buckets:
+            if cumulative >= q * count:
+                return bound * 1000 if bound != float("inf") else float("inf")
+        return None
+
+    return {
+        "count": int(count),
+        "mean": (after[1] - before[1]) / count * 1000,
+        "p50": quantile(0.50),
+        "p95": quantile(0.95),
+        "p99": quantile(0.99),
+    }
+
+
+async def scrape_metrics(host, port):
+    """读取 /metrics（旧版本没有该接口时返回空文本）"""
+    connection = HttpConnection(host, port)
+    try:
+        status, body = await connection.request("GET", "/metrics")
+        return body.decode("utf-8") if status == 200 else ""
+    except Exception:
+        return ""
+    finally:
+        connection.close()
+
+
+async def run_client(index, host, port, options, stocks, stats, measure_start, deadline):
+    """一个模拟用户：按比例随机发请求，直到压测结束"""
+    rng = random.Random(options.seed * 100003 + index)
+    actions = list(options.mix)
+    weights = [options.mix[action] for action in actions]
+    connection = HttpConnection(host, port, options.timeout)
+    my_orders = []  # 自己转为挂单、可以撤销的订单号
+
+    # 在预热时间内陆续上线
+    if options.warmup > 0:
+        await asyncio.sleep(options.warmup * index / options.clients)
+
+    try:
+        while time.perf_counter() < deadline:
+            action = rng.choices(actions, weights)[0]
+            if action == "cancel" and not my_orders:
+                action = "buy"
+
+            if action in ("buy", "sell"):
+                stock = rng.choice(stocks)
+                price = round(quote_price(stock) * (1 + rng.uniform(-options.spread, options.spread)), 2)
+                request = ("POST", f"/api/{action}", {"stock": stock, "price": price, "quantity": 100})
+            elif action == "cancel":
+                request = ("POST", "/api/cancel_order", {"order_id": my_orders.pop(rng.randrange(len(my_orders)))})
+            else:
+                request = ("GET", f"/api/{action}", None)
+
+            start = time.perf_counter()
+            try:
+                status, body = await connection.request(*request)
+            except asyncio.TimeoutError:
+                outcome, message = "error", "超时"
+            except Exception as e:
+                outcome, message = "error", type(e).__name__
+            else:
+                if status >= 400:
+                    outcome, message = "error", f"HTTP {status}"
+                elif request[0] == "POST":
+                    result = json.loads(body)
+                    outcome, message = ("ok" if result.get("success") else "rejected"), None
+                    match = ORDER_ID_PATTERN.search(result.get("message") or "")
+                    if match:
+                        my_orders.append(match.group(1))
+                else:
+                    outcome, message = "ok", None
+            end = time.perf_counter()
+
+            if measure_start <= start < deadline:
+                stats.record(action, end - start, outcome, message)
+
+            if options.think > 0:
+                await asyncio.sleep(rng.expovariate(1 / options.think))
+    finally:
+        connection.close()
+
+
+async def drive(host, port, options, stocks, client_ports=None):
+    """运行全部模拟用户，返回 (统计, 统计窗口前后的 /metrics 文本)
+
+    client_ports 不为空时模拟用户轮流连接这些端口（多个API节点），/metrics 仍从 port 读取
+    """
+    stats = Stats()
+    start = time.perf_counter()
+    measure_start = start + options.warmup
+    deadline = measure_start + options.duration
+
+    client_ports = client_ports or [port]
+    clients = [
+        asyncio.ensure_future(run_client(i, host, client_ports[i % len(client_ports)], options, stocks, stats,
+                                         measure_start, deadline))
+        for i in range(options.clients)
+    ]
+    await asyncio.sleep(options.warmup)
+    metrics_before = await scrape_metrics(host, port)
+    await asyncio.gather(*clients)
+    metrics_after = await scrape_metrics(host, port)
+    return stats, metrics_before, metrics_after
+
+
+def summarize(stats, metrics_before, metrics_after, options):
+    """汇总成可保存、可对比的结果"""
+    duration = options.duration
+    all_latencies = [value for values in stats.latencies.values() for value in values]
+    total = len(all_latencies)
+    errors = sum(stats.errors.values())
+    rejected = sum(stats.rejected.values())
+
+    actions = {}
+    for action in ACTIONS:
+        count = len(stats.latencies[action])
+        if not count:
+            continue
+        actions[action] = {
+            "count": count,
+            "throughput": count / duration,
+            "ok": stats.ok[action],
+            "rejected": stats.rejected[action],
+            "errors": stats.errors[action],
+            "error_rate": stats.errors[action] / count,
+            **latency_summary(stats.latencies[action]),
+        }
+
+    engine = {}
+    for key, metric in (("tick_lag", "engine_tick_lag_seconds"), ("tick_duration", "matching_tick_seconds")):
+        engine[key] = histogram_delta(parse_histogram(metrics_before, metric),
+                                      parse_histogram(metrics_after, metric))
+
+    return {
+        "requests": total,
+        "throughput": total / duration,
+        "error_rate": errors / total if total else 0.0,
+        "reject_rate": rejected / total if total else 0.0,
+        "latency": latency_summary(all_latencies),
+        "actions": actions,
+        "errors": dict(stats.error_messages.most_common(10)),
+        "engine": engine,
+    }
+
+
+def git_version(repo):
+    """被测代码的版本（git describe）"""
+    try:
+        return subprocess.run(["git", "-C", repo, "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def seed_state(repo, directory, stocks):
+    """写入有充足资金和已交收持仓的初始状态，返回是否成功"""
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    code = SEED.format(
+        repo=repo, filename=os.path.join(directory, "data", "trading.dat"),
+        quantity=100000, cash=1e9, prices={stock: quote_price(stock) for stock in stocks}
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"写入初始状态失败，使用默认资金启动: {result.stderr.strip().splitlines()[-1]}")
+        return False
+    return True
+
+
+def wait_until_ready(host, port, process, log_path, timeout=60.0):
+    """等待被测服务可以响应请求"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"被测服务启动失败（退出码 {process.returncode}）:\n{tail}")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"被测服务 {timeout:.0f} 秒内没有启动，日志: {log_path}")
+
+
+def stop_process(process):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_load(options, repo=REPO, label=None):
+    """压测一个版本（或 --url 指定的服务），返回结果"""
+    raise_fd_limit()
+    stocks = stock_codes(options.stocks)
+    config = {key: value for key, value in vars(options).items() if key not in ("func", "output", "revs", "files")}
+    result = {
+        "label": label or options.label or (options.url or git_version(repo)),
+        "version": git_version(repo) if not options.url else None,
+        "started_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "config": config,
+    }
+
+    if options.url:
+        url = urlsplit(options.url)
+        host, port = url.hostname, url.port or 80
+        stats, before, after = asyncio.run(drive(host, port, options, stocks))
+        result.update(summarize(stats, before, after, options))
+        return result
+
+    quotes = app = None
+    nodes = []
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as directory:
+        try:
+            quote_port = free_port()
+            quotes = subprocess.Popen(
+                [sys.executable, os.path.join(REPO, "benchmarks", "fake_quotes.py"),
+                 "--port", str(quote_port), "--latency", str(options.quote_latency)],
+                stdout=subprocess.DEVNULL
+            )
+            seed_state(repo, directory, stocks)
+
+            host, port = "127.0.0.1", free_port()
+            env = dict(
+                os.environ, HEADLESS="1", PORT=str(port), PYTHONUNBUFFERED="1",
+                QUOTE_HOST=f"http://127.0.0.1:{quote_port}", TRADING_PHASE=options.phase,
+                UPSTREAM_RATE=str(options.upstream_rate), MATCH_WORKERS=str(options.match_workers)
+            )
+            # 所有模拟用户共用一个账户，默认不限制下单频率
+            env.setdefault("RISK_MAX_ORDERS_PER_SECOND", "0")
+            engine_socket = os.path.join(directory, "engine.sock")
+            if options.api_nodes:
+                env["ENGINE_LISTEN"] = engine_socket
+            log_path = os.path.join(directory, "app.log")
+            with open(log_path, "w") as log:
+                app = subprocess.Popen([sys.executable, os.path.join(repo, "app.pyw")], cwd=directory,
+                                       env=env, stdout=log, stderr=subprocess.STDOUT)
+            wait_until_ready(host, port, app, log_path)
+
+            # --api-nodes：上面的进程作为引擎服务，再启动若干无状态API节点，模拟用户只连接API节点
+            node_ports = []
+            for i in range(options.api_nodes):
+                node_port = free_port()
+                node_env = dict(env, PORT=str(node_port), ENGINE_ADDRESS=engine_socket)
+                node_log = os.path.join(directory, f"node{i}.log")
+                with open(node_log, "w") as log:
+                    nodes.append(subprocess.Popen([sys.executable, os.path.join(repo, "app.pyw")], cwd=directory,
+                                                  env=node_env, stdout=log, stderr=subprocess.STDOUT))
+                wait_until_ready(host, node_port, nodes[-1], node_log)
+                node_ports.append(node_port)
+
+            stats, before, after = asyncio.run(drive(host, port, options, stocks, node_ports))
+            result.update(summarize(stats, before, after, options))
+        finally:
+            for node in nodes:
+                stop_process(node)
+            stop_process(app)
+            stop_process(quotes)
+    return result
+
+
+def fmt(value, digits=1):
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return "inf"
+    return f"{value:.{digits}f}"
+
+
+def print_report(result):
+    """打印一次压测结果"""
+    config = result["config"]
+    print(f"\n== {result['label']}  用户 {config['clients']}  时长 {config['duration']}s  "
+          f"阶段 {config['phase']}  撮合进程 {config['match_workers']}")
+    print(f"总请求 {result['requests']}  吞吐 {result['throughput']:.1f} 次/秒  "
+          f"错误率 {result['error_rate'] * 100:.2f}%  业务拒绝率 {result['reject_rate'] * 100:.2f}%")
+    print(f"{'接口':<10}{'次数':>8}{'次/秒':>9}{'错误':>7}{'拒绝':>7}"
+          f"{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    rows = list(result["actions"].items()) + [("all", {**result["latency"], "count": result["requests"],
+                                                       "throughput": result["throughput"],
+                                                       "errors": "", "rejected": ""})]
+    for action, row in rows:
+        print(f"{action:<10}{row['count']:>8}{row['throughput']:>9.1f}{row['errors']:>7}{row['rejected']:>7}"
+              f"{fmt(row['p50']):>9}{fmt(row['p90']):>9}{fmt(row['p99']):>9}{fmt(row['max']):>9}")
+    for key, name in (("tick_lag", "撮合节拍延迟"), ("tick_duration", "单轮撮合耗时")):
+        stats = result["engine"].get(key)
+        if stats is None:
+            print(f"{name}: 服务端没有该指标")
+        else:
+            print(f"{name}: {stats['count']} 轮  平均 {fmt(stats['mean'])}ms  "
+                  f"p50≤{fmt(stats['p50'])}ms  p95≤{fmt(stats['p95'])}ms  p99≤{fmt(stats['p99'])}ms")
+    if result["errors"]:
+        print("错误: " + "，".join(f"{message} {count}" for message, count in result["errors"].items()))
+
+
+def comparison_rows(result):
+    """对比时展示的指标：(名称, 值, 越大越好)"""
+    rows = [
+        ("吞吐(次/秒)", result["throughput"], True),
+        ("错误率(%)", result["error_rate"] * 100, False),
+        ("业务拒绝率(%)", result["reject_rate"] * 100, False),
+        ("全部 p50(ms)", result["latency"]["p50"], False),
+        ("全部 p99(ms)", result["latency"]["p99"], False),
+    ]
+    for action in ACTIONS:
+        row = result["actions"].get(action)
+        rows.append((f"{action} p99(ms)", row["p99"] if row else None, False))
+    for key, name in (("tick_lag", "撮合节拍延迟"), ("tick_duration", "单轮撮合耗时")):
+        stats = result["engine"].get(key) or {}
+        rows.append((f"{name} 平均(ms)", stats.get("mean"), False))
+        rows.append((f"{name} p95(ms)", stats.get("p95"), False))
+    return rows
+
+
+def pad(text, width, left=False):
+    """按终端显示宽度（中文占两格）补齐空格"""
+    space = " " * max(0, width - sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in text))
+    return text + space if left else space + text
+
+
+def print_comparison(results):
+    """以第一个结果为基准，逐项列出其他结果的变化"""
+    table = [comparison_rows(result) for result in results]
+    lines = [["指标"] + [result["label"] for result in results]]
+    for i, (name, base, higher_better) in enumerate(table[0]):
+        cells = [name, fmt(base)]
+        for rows in table[1:]:
+            value = rows[i][1]
+            cell = fmt(value)
+            if value is not None and base not in (None, 0) and value != float("inf") and base != float("inf"):
+                change = (value - base) / base * 100
+                better = change > 0 if higher_better else change < 0
+                cell += f" ({change:+.0f}%{'↑' if better else '↓' if change else ''})"
+            cells.append(cell)
+        lines.append(cells)
+    widths = [max(len(pad(line[column], 0)) + 2 for line in lines) for column in range(len(lines[0]))]
+    print()
+    for line in lines:
+        print(pad(line[0], widths[0], left=True) + "".join(pad(cell, width) for cell, width in zip(line[1:], widths[1:])))
+
+
+def save_result(result, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {path}")
+
+
+def command_run(options):
+    result = run_load(options)
+    print_report(result)
+    if options.output:
+        save_result(result, options.output)
+    return 0 if result["requests"] else 1
+
+
+def command_compare(options):
+    results = []
+    for path in options.files:
+        with open(path, encoding="utf-8") as f:
+            results.append(json.load(f))
+    print_comparison(results)
+    return 0
+
+
+def command_versions(options):
+    """检出每个 git 版本到临时 worktree，用同样的参数依次压测并对比"""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="loadtest-versions-") as directory:
+        for index, rev in enumerate(options.revs):
+            worktree = os.path.join(directory, f"v{index}")
+            subprocess.run(["git", "-C", REPO, "worktree", "add", "--detach", worktree, rev],
+                           check=True, capture_output=True)
+            try:
+                print(f"压测 {rev} ...", flush=True)
+                result = run_load(options, repo=worktree, label=rev)
+            finally:
+                subprocess.run(["git", "-C", REPO, "worktree", "remove", "--force", worktree],
+                               capture_output=True)
+            print_report(result)
+            if options.output:
+                os.makedirs(options.output, exist_ok=True)
+                name = re.sub(r"[^\w.-]", "_", rev)
+                save_result(result, os.path.join(options.output, f"loadtest_{name}.json"))
+            results.append(result)
+    print_comparison(results)
+    return 0
+
+
+def main(argv=None):
+    load_options = argparse.ArgumentParser(add_help=False)
+    load_options.add_argument("--clients", type=int, default=200, help="并发模拟用户数")
+    load_options.add_argument("--duration", type=float, default=60, help="统计时长（秒）")
+    load_options.add_argument("--warmup", type=float, default=5, help="预热时长（秒），用户在此期间陆续上线，不计入统计")
+    load_options.add_argument("--think", type=float, default=1.0, help="用户两次请求之间的平均间隔（秒），0 为不间断")
+    load_options.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"请求比例，默认 {DEFAULT_MIX}")
+    load_options.add_argument("--spread", type=float, default=0.01, help="委托价相对最新价的随机偏离幅度")
+    load_options.add_argument("--stocks", type=int, default=20, help="交易的股票数量")
+    load_options.add_argument("--phase", default="continuous_am", help="固定服务端交易阶段（如 pre_open / continuous_am）")
+    load_options.add_argument("--match-workers", type=int, default=0, help="服务端 MATCH_WORKERS")
+    load_options.add_argument("--api-nodes", type=int, default=0, help="无状态API节点数，大于0时被测服务作为引擎服务，模拟用户连接API节点")
+    load_options.add_argument("--quote-latency", type=float, default=0.02, help="模拟行情接口的响应延迟（秒）")
+    load_options.add_argument("--upstream-rate", type=float, default=1000, help="服务端 UPSTREAM_RATE（每秒行情请求数）")
+    load_options.add_argument("--timeout", type=float, default=10, help="单个请求超时（秒）")
+    load_options.add_argument("--seed", type=int, default=0, help="随机种子")
+    load_options.add_argument("--label", help="结果名称，默认为 git 版本")
+
+    parser = argparse.ArgumentParser(description="交易服务压测")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", parents=[load_options], help="压测当前代码或 --url 指定的服务")
+    run.add_argument("--url", help="压测已运行的服务（如 http://127.0.0.1:5000），不启动模拟行情和服务")
+    run.add_argument("-o", "--output", help="保存结果的 JSON 文件")
+    run.set_defaults(func=command_run)
+
+    compare = commands.add_parser("compare", help="对比多次压测结果，第一个为基准")
+    compare.add_argument("files", nargs="+")
+    compare.set_defaults(func=command_compare)
+
+    versions = commands.add_parser("versions", parents=[load_options], help="依次压测多个 git 版本并对比")
+    versions.add_argument("revs", nargs="+", help="git 版本（提交、分支或标签）")
+    versions.add_argument("-o", "--output", help="保存各版本结果的目录")
+    versions.set_defaults(func=command_versions, url=None)
+
+    options = parser.parse_args(argv)
+    return options.func(options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,546 @@
+"""多节点部署：一个引擎服务独占账本和订单簿，任意数量的无状态 API 节点转发命令、从复制的快照读取
+
+    引擎     ENGINE_LISTEN=127.0.0.1:7100 python app.pyw       （路径形式如 /tmp/engine.sock 为 Unix 套接字）
+    API 节点 ENGINE_ADDRESS=127.0.0.1:7100 PORT=5001 HEADLESS=1 python app.pyw
+
+连接使用 multiprocessing.connection（authkey 双向认证，与撮合分片相同）。共享密钥取 ENGINE_AUTHKEY，
+未设置时引擎生成 data/engine.key，同一台机器上的节点直接读取该文件。
+
+引擎只在状态变化（或行情刷新周期到了）时发布一个新版本：投资组合、挂单、绩效、风控等实时部分，加上
+上次发布之后新增的订单和成交记录、结束的挂单（已结束的订单和成交记录不再修改，不需要重复发送）。
+每个版本编码一次，节点长轮询拉取自己缺少的版本并增量更新本地索引，新节点或落后太多的节点拉取完整快照。
+节点的读请求只访问本地副本，读能力随节点数扩展；节点自己提交的命令返回引擎的状态版本，之后的读请求
+会等待副本追上这个版本（同一节点内读到自己的写入）。
+"""
+import os
+import time
+import pickle
+import threading
+from collections import deque
+from multiprocessing.connection import Listener, Client
+from common import get_trading_phase
+from analytics import _new_symbol
+from ledger_index import OrderIndex, TradeIndex, parse_list
+from metrics import Histogram, Gauge
+
+ENGINE_CALL_LATENCY = Histogram("engine_call_seconds", "API节点调用引擎服务的耗时", ("method",))
+REPLICA_AGE = Gauge("replica_snapshot_age_seconds", "API节点本地快照距引擎生成的时间")
+
+# 节点可以调用的引擎方法（其余读请求由快照提供）
+TRADING_COMMANDS = (
+    "buy", "sell", "cancel_order", "place_orders_batch", "cancel_all_orders", "set_risk_limits",
+    "save_state", "load_state", "check_daily_roll", "get_stock_data", "get_equity_history", "get_statement",
+    # 引擎的历史记录尚未加载时，节点把历史查询交给引擎
+    "get_all_orders", "get_trade_history", "query_orders", "query_trades",
+)
+WATCHLIST_COMMANDS = ("get_watchlists", "set_watchlist", "delete_watchlist", "get_watchlist_quotes", "scan")
+
+# 引擎保留最近多少个版本的增量，落后更多的节点改为拉取完整快照
+UPDATE_HISTORY = 64
+
+# 命令等待引擎响应的最长时间（秒），集合竞价时撮合可能持有锁数秒
+CALL_TIMEOUT = 30.0
+
+
+class EngineUnavailable(RuntimeError):
+    """引擎服务连接失败或响应超时"""
+
+
+def parse_address(value):
+    """host:port 为 TCP 地址，其余视为 Unix 套接字路径"""
+    host, sep, port = value.rpartition(":")
+    if sep and port.isdigit() and "/" not in value:
+        return (host or "127.0.0.1", int(port))
+    return value
+
+
+def load_authkey(key_file="data/engine.key", create=False):
+    """共享密钥：优先 ENGINE_AUTHKEY，否则读取（引擎端不存在时创建）密钥文件"""
+    key = os.environ.get("ENGINE_AUTHKEY")
+    if key:
+        return key.encode()
+    if create and not os.path.exists(key_file):
+        os.makedirs(os.path.dirname(key_file) or ".", exist_ok=True)
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(os.urandom(32).hex())
+    try:
+        with open(key_file) as f:
+            return f.read().strip().encode()
+    except OSError:
+        raise EngineUnavailable(f"未设置 ENGINE_AUTHKEY，也找不到引擎密钥文件 {key_file}")
+
+
+class EngineService:
+    """引擎端：执行节点转发的命令，并向节点发布快照
+
+    interval: 无状态变化时刷新快照（行情、持仓市值）的间隔；min_interval: 两次快照之间的最短间隔（合并突发的变化）
+    """
+
+    def __init__(self, trading_api, watchlists, address, authkey, interval=1.0, min_interval=0.05):
+        self.trading_api = trading_api
+        self.targets = {"trading": (trading_api, TRADING_COMMANDS), "watchlists": (watchlists, WATCHLIST_COMMANDS)}
+        self.interval = interval
+        self.min_interval = min_interval
+        if isinstance(address, str) and os.path.exists(address):
+            # 上次退出时遗留的 Unix 套接字文件
+            os.unlink(address)
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        # 版本号带上启动时间，引擎重启后的版本总是大于重启前的，节点不需要额外处理
+        self.started = time.time_ns()
+        self.version = (self.started, 0)  # 最新发布的版本
+        self.updates = deque(maxlen=UPDATE_HISTORY)  # 最近发布的 [(版本, 编码后的增量)]
+        self.full = None  # (版本, 编码后的完整快照)，有节点需要时随下一次发布生成
+        self._full_wanted = False
+        # 上次发布时的订单/成交记录列表（索引重建后是新列表）、已发布的记录数和挂单号
+        self._order_records = None
+        self._trade_records = None
+        self._order_count = 0
+        self._trade_count = 0
+        self._pending_ids = set()
+        self._changed = threading.Event()
+        self._published = threading.Condition()
+        self._running = True
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._publish_loop, daemon=True).start()
+        return self
+
+    def close(self):
+        self._running = False
+        self._changed.set()
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self._running:
+                    # 认证失败等单个连接的错误不影响继续监听
+                    print(f"引擎服务接受连接失败: {str(e)}")
+                    continue
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        """处理一个节点连接：("call", 目标, 方法, args, kwargs) 或 ("snapshot", 已有版本, 最长等待秒数)"""
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == "snapshot":
+                    self._send_updates(conn, message[1], message[2])
+                else:
+                    conn.send(self._call(*message[1:]))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _call(self, target, method, args, kwargs):
+        obj, commands = self.targets.get(target, (None, ()))
+        if obj is None or method not in commands:
+            return ("error", f"不支持的命令: {target}.{method}")
+        try:
+            result = getattr(obj, method)(*args, **kwargs)
+        except ValueError as e:
+            # 参数错误，节点上按400返回
+            return ("invalid", str(e))
+        except Exception as e:
+            print(f"执行命令 {method} 失败: {str(e)}")
+            return ("error", f"执行命令失败: {str(e)}")
+        # 命令可能改变了状态，尽快发布新快照
+        self._changed.set()
+        return ("ok", result, (self.started, self.trading_api.state_version))
+
+    def _updates_since(self, known_version):
+        """known_version 之后的全部增量，节点落后太多或来自上一次启动时返回 None"""
+        if not self.updates or known_version[0] != self.started or known_version[1] < self.updates[0][0][1] - 1:
+            return None
+        return [payload for version, payload in self.updates if version > known_version]
+
+    def _full_ready(self):
+        """完整快照之后的增量都还保留着（节点拿到后可以继续按增量跟上）"""
+        return self.full is not None and bool(self.updates) and self.full[0] >= self.updates[0][0]
+
+    def _send_updates(self, conn, known_version, timeout):
+        """长轮询：有比 known_version 新的版本就立即返回这之后的增量，否则最多等待 timeout 秒
+
+        新节点、引擎重启或节点落后超过 UPDATE_HISTORY 个版本时返回完整快照。
+        先发送 ("updates", 个数) 或 ("unchanged", 版本)，再逐个发送编码后的增量。
+        """
+        with self._published:
+            self._published.wait_for(lambda: self.version > known_version or not self._running, timeout)
+            payloads = self._updates_since(known_version)
+            if payloads is None:
+                if not self._full_ready():
+                    self._full_wanted = True
+                    self._changed.set()
+                    self._published.wait_for(lambda: self._full_ready() or not self._running, timeout)
+                payloads = [self.full[1]] if self._full_ready() else []
+            version = self.version
+        if not payloads:
+            conn.send_bytes(pickle.dumps(("unchanged", version)))
+            return
+        conn.send_bytes(pickle.dumps(("updates", len(payloads))))
+        for payload in payloads:
+            conn.send_bytes(payload)
+
+    def _publish_loop(self):
+        last_state, last_build = None, 0.0
+        while self._running:
+            self._changed.wait(self.interval)
+            self._changed.clear()
+            state_version = self.trading_api.state_version
+            if (state_version == last_state and not self._full_wanted
+                    and time.monotonic() - last_build < self.interval):
+                continue
+            try:
+                update, full = self.build_update(full=self._full_wanted)
+            except Exception as e:
+                print(f"生成快照失败: {str(e)}")
+                time.sleep(self.interval)
+                continue
+            last_state, last_build = update["live"]["state_version"][1], time.monotonic()
+            # 版本号只在本线程递增，编码不占用 _published
+            version = (self.started, self.version[1] + 1)
+            payload = pickle.dumps((version, update), protocol=pickle.HIGHEST_PROTOCOL)
+            if full is update:
+                full = (version, payload)
+            elif full is not None:
+                full = (version, pickle.dumps((version, full), protocol=pickle.HIGHEST_PROTOCOL))
+            with self._published:
+                self.version = version
+                self.updates.append((version, payload))
+                if full is not None:
+                    self.full = full
+                    self._full_wanted = False
+                self._published.notify_all()
+            time.sleep(self.min_interval)
+
+    def build_update(self, full=False):
+        """本次发布的内容：实时部分（资金、持仓、绩效、风控、挂单）和上次发布之后追加或结束的订单、成交记录
+
+        锁内只复制挂单和新增记录的引用，与变化量成正比；已结束的订单和成交记录不再修改，编码在锁外进行。
+        读的是订单/成交索引里的记录，历史延迟加载时不会触发加载。full 为 True 时同时返回从空开始的完整快照。
+        返回 (增量, 完整快照或None)
+        """
+        api = self.trading_api
+        with api.lock:
+            state_version = api.state_version
+            order_index, trade_index = api.order_index, api.trade_index
+            orders, trades = order_index.records, trade_index.records
+            # 加载状态、加载历史和日终压缩会重建索引，之后的第一个版本让节点整体替换
+            reset = orders is not self._order_records or trades is not self._trade_records
+            order_start = 0 if reset else self._order_count
+            trade_start = 0 if reset else self._trade_count
+            new_orders = orders[order_start:]
+            new_trades = trades[trade_start:]
+            pending = {}
+            for position in order_index.by_status.get("pending", ()):
+                order = orders[position]
+                pending[order["order_id"]] = dict(order)
+            # 上次发布时还是挂单、现在已成交/撤销/过期的订单
+            finished = [] if reset else [
+                dict(orders[order_index.positions[order_id]])
+                for order_id in self._pending_ids - pending.keys() if order_id in order_index.positions
+            ]
+            all_orders = list(orders) if full and not reset else None
+            all_trades = list(trades) if full and not reset else None
+            history_loaded = api._history_loader is None
+            analytics = api.analytics.report()
+            risk = {'limits': api.risk.limits(), 'exposures': api.risk.exposures()}
+            self._order_records, self._trade_records = orders, trades
+            self._order_count, self._trade_count = len(orders), len(trades)
+            self._pending_ids = set(pending)
+        live = {
+            "state_version": (self.started, state_version),
+            "generated_at": time.time(),
+            "history_loaded": history_loaded,
+            "portfolio": api.generate_report(),
+            "analytics": analytics,
+            "risk": risk,
+            "statements": api.get_statements(),
+        }
+        # 挂单换成锁内复制的副本，编码时不会读到撮合线程正在修改的订单
+        update = {"live": live, "reset": reset, "order_start": order_start,
+                  "orders": [pending.get(order["order_id"], order) for order in new_orders],
+                  "trade_start": trade_start, "trades": new_trades, "changed": finished + list(pending.values())}
+        if not full or reset:
+            return update, update if full else None
+        return update, {"live": live, "reset": True, "order_start": 0,
+                        "orders": [pending.get(order["order_id"], order) for order in all_orders],
+                        "trade_start": 0, "trades": all_trades, "changed": list(pending.values())}
+
+
+class EngineClient:
+    """节点端：每个线程一条到引擎的连接，断开后下次调用时重连"""
+
+    def __init__(self, address, authkey, timeout=CALL_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self):
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except Exception as e:
+            raise EngineUnavailable(f"无法连接交易引擎: {str(e)}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def call(self, target, method, *args, **kwargs):
+        """调用引擎方法，返回 (结果, 调用后的状态版本)"""
+        with ENGINE_CALL_LATENCY.time(method=method):
+            for attempt in range(2):
+                conn = self._conn()
+                try:
+                    conn.send(("call", target, method, args, kwargs))
+                    if not conn.poll(self.timeout):
+                        self._drop()
+                        raise EngineUnavailable("交易引擎响应超时")
+                    reply = conn.recv()
+                    break
+                except (EOFError, OSError):
+                    # 引擎重启后旧连接失效，重连一次
+                    self._drop()
+                    if attempt:
+                        raise EngineUnavailable("与交易引擎的连接已断开")
+        if reply[0] == "invalid":
+            raise ValueError(reply[1])
+        if reply[0] == "error":
+            raise EngineUnavailable(reply[1])
+        return reply[1], reply[2]
+
+
+class Replica:
+    """节点本地的只读副本，后台线程长轮询引擎获取新版本
+
+    实时部分每个版本整体替换；订单和成交记录保存在本地索引里，按增量追加记录、更新结束的挂单，
+    只有收到完整快照（新节点、引擎重启、引擎重建了索引）时才重新建立索引。
+    """
+
+    def __init__(self, client, poll_timeout=10.0):
+        self.client = client
+        self.poll_timeout = poll_timeout
+        self.version = (0, 0)
+        self.snapshot = None  # 实时部分
+        self.orders = OrderIndex()
+        self.trades = TradeIndex()
+        self._updated = threading.Condition()
+        REPLICA_AGE.set_function(
+            lambda: time.time() - self.snapshot["generated_at"] if self.snapshot else 0)
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    def _sync_loop(self):
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self.client.connect()
+                conn.send(("snapshot", self.version, self.poll_timeout))
+                header = pickle.loads(conn.recv_bytes())
+                updates = [pickle.loads(conn.recv_bytes()) for _ in range(header[1])] if header[0] == "updates" else []
+            except (EngineUnavailable, EOFError, OSError):
+                if conn is not None:
+                    conn.close()
+                conn = None
+                time.sleep(1)
+                continue
+            for version, update in updates:
+                if not self._apply(version, update):
+                    break
+
+    def _apply(self, version, update):
+        """应用一个版本，记录位置对不上时（不应发生）放弃本地副本，下次拉取完整快照"""
+        if update["reset"]:
+            # 完整快照在锁外建立索引，期间读请求继续使用旧副本
+            orders, trades = OrderIndex(update["orders"]), TradeIndex(update["trades"])
+        elif update["order_start"] != len(self.orders) or update["trade_start"] != len(self.trades):
+            print(f"本地副本与引擎版本 {version} 不一致，重新同步")
+            self.version = (0, 0)
+            return False
+        with self._updated:
+            if update["reset"]:
+                self.orders, self.trades = orders, trades
+            else:
+                for order in update["orders"]:
+                    self.orders.add(order)
+                for trade in update["trades"]:
+                    self.trades.add(trade)
+            # 挂单的最新状态（与新增记录同一次编码的是同一个对象，不需要更新）
+            for order in update["changed"]:
+                position = self.orders.positions.get(order["order_id"])
+                if position is None:
+                    continue
+                record = self.orders.records[position]
+                if record is not order:
+                    self.orders.set_status(record, order["status"])
+                    record.update(order)
+            self.version, self.snapshot = version, update["live"]
+            self._updated.notify_all()
+        return True
+
+    def _wait(self, min_state_version, wait):
+        """（持有 _updated 时）等待快照追上 min_state_version，最多 wait 秒，超时使用当前快照"""
+        self._updated.wait_for(
+            lambda: self.snapshot is not None and self.snapshot["state_version"] >= min_state_version, wait)
+        if self.snapshot is None:
+            raise EngineUnavailable("尚未从交易引擎获取到数据")
+
+    def get(self, name, min_state_version=(0, 0), wait=2.0):
+        """实时部分中的一项"""
+        with self._updated:
+            self._wait(min_state_version, wait)
+            return self.snapshot[name]
+
+    def records(self, name, min_state_version=(0, 0), wait=2.0):
+        """全部订单（"orders"）或成交记录（"trades"）"""
+        with self._updated:
+            self._wait(min_state_version, wait)
+            # 与引擎的 get_all_orders 一样返回记录本身
+            return list(getattr(self, name).records)
+
+    def query(self, name, min_state_version=(0, 0), wait=2.0, **filters):
+        """在本地订单/成交索引上分页查询，参数见 RecordIndex.query"""
+        with self._updated:
+            self._wait(min_state_version, wait)
+            page = getattr(self, name).query(**filters)
+            # 同步线程会就地更新挂单，返回副本
+            page["results"] = [dict(record) for record in page["results"]]
+            return page
+
+
+class RemoteTradingAPI:
+    """API 节点上代替 TradingAPI 的对象：app.pyw 调用的方法名保持一致"""
+
+    def __init__(self, client):
+        self.client = client
+        self.replica = Replica(client)
+        self.written = (0, 0)  # 本节点提交的命令之后引擎的状态版本
+
+    def _command(self, method, *args, **kwargs):
+        result, state_version = self.client.call("trading", method, *args, **kwargs)
+        if state_version > self.written:
+            self.written = state_version
+        return result
+
+    def _read(self, name):
+        return self.replica.get(name, self.written)
+
+    # ---- 命令：转发给引擎 ----
+
+    def buy(self, stock_code, price, quantity, trade_dt=None):
+        return self._command("buy", stock_code, price, quantity, trade_dt)
+
+    def sell(self, stock_code, price, quantity, trade_dt=None):
+        return self._command("sell", stock_code, price, quantity, trade_dt)
+
+    def cancel_order(self, order_id, trade_dt):
+        return self._command("cancel_order", order_id, trade_dt)
+
+    def place_orders_batch(self, orders, trade_dt=None):
+        return self._command("place_orders_batch", orders, trade_dt)
+
+    def cancel_all_orders(self, trade_dt, stock_code=None, order_type=None):
+        return self._command("cancel_all_orders", trade_dt, stock_code=stock_code, order_type=order_type)
+
+    def set_risk_limits(self, **limits):
+        return self._command("set_risk_limits", **limits)
+
+    def save_state(self):
+        return self._command("save_state")
+
+    def load_state(self):
+        return self._command("load_state")
+
+    def check_daily_roll(self):
+        return self._command("check_daily_roll")
+
+    def get_stock_data(self, stock_code):
+        # 行情由引擎统一请求（共享限流和缓存）
+        return self._command("get_stock_data", stock_code)
+
+    def get_equity_history(self, resolution="tick", start=None, end=None, limit=None):
+        return self._command("get_equity_history", resolution, start, end, limit)
+
+    def get_statement(self, day):
+        return self._command("get_statement", day)
+
+    # ---- 读取：本地快照 ----
+
+    def _history_loaded(self):
+        """引擎是否已加载历史订单和成交记录（未加载时副本里只有挂单）"""
+        return self._read("history_loaded")
+
+    def generate_report(self):
+        return self._read("portfolio")
+
+    def get_all_orders(self):
+        if not self._history_loaded():
+            # 由引擎返回（同时触发加载，之后的版本带上全部历史）
+            return self._command("get_all_orders")
+        return self.replica.records("orders", self.written)
+
+    def get_trade_history(self):
+        if not self._history_loaded():
+            return self._command("get_trade_history")
+        return self.replica.records("trades", self.written)
+
+    def get_risk_status(self):
+        return self._read("risk")
+
+    def query_orders(self, **filters):
+        statuses = parse_list(filters.get("status"))
+        if not self._history_loaded() and (not statuses or any(status != "pending" for status in statuses)):
+            return self._command("query_orders", **filters)
+        return self.replica.query("orders", self.written, **filters)
+
+    def query_trades(self, **filters):
+        if not self._history_loaded():
+            return self._command("query_trades", **filters)
+        return self.replica.query("trades", self.written, **filters)
+
+    def get_statements(self):
+        return self._read("statements")
+
+    def get_analytics(self, stock_code=None):
+        analytics = self._read("analytics")
+        if stock_code is None:
+            return analytics
+        symbol = analytics["symbols"].get(stock_code) or dict(_new_symbol(), win_rate=None)
+        return dict(analytics, symbols={stock_code: symbol})
+
+    def get_trading_phase(self, dt):
+        return get_trading_phase(dt)
+
+
+class RemoteWatchlists:
+    """API 节点上代替 WatchlistManager 的对象：自选股和行情刷新都在引擎上"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, method):
+        if method not in WATCHLIST_COMMANDS:
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.client.call("watchlists", method, *args, **kwargs)[0]
+
+    def start(self):
+        pass
@@ -1,6 +1,8 @@
 # 更新为白色主题配色方案
 import datetime
-import holidays
+import threading
+import os
+from fees import DEFAULT_FEES, to_fen
 
 # 颜色配置（白色主题）
 BG_COLOR = "#f5f7fa"          # 浅灰色背景
@@ -44,8 +46,33 @@ TRADING_RULES = {
     "closed": {"start": (15, 30), "end": (9, 15), "can_cancel": False}
 }
 
-# 中国节假日
-cn_holidays = holidays.CountryHoliday('CN')
+# 买卖方向（接口参数 -> 订单类型）
+ORDER_SIDES = {
+    "buy": "买入",
+    "sell": "卖出",
+    "买入": "买入",
+    "卖出": "卖出"
+}
+
+# 中国节假日（holidays 导入较慢，首次判断交易日时才加载）
+_cn_holidays = None
+_cn_holidays_lock = threading.Lock()
+
+def get_cn_holidays():
+    """中国节假日日历"""
+    global _cn_holidays
+    if _cn_holidays is None:
+        with _cn_holidays_lock:
+            if _cn_holidays is None:
+                import holidays
+                _cn_holidays = holidays.CountryHoliday('CN')
+    return _cn_holidays
+
+def __getattr__(name):
+    # 兼容直接引用 common.cn_holidays 的代码
+    if name == "cn_holidays":
+        return get_cn_holidays()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # #测试用
 # def is_trading_day(dt):
@@ -63,10 +90,33 @@ def is_trading_day(dt):
         return False
     
     # 检查是否节假日
-    return dt.date() not in cn_holidays
+    return dt.date() not in get_cn_holidays()
+
+def next_trading_day(day):
+    """day 之后的下一个交易日（date）"""
+    day += datetime.timedelta(days=1)
+    while not is_trading_day(datetime.datetime.combine(day, datetime.time())):
+        day += datetime.timedelta(days=1)
+    return day
+
+def last_closed_trading_day(dt):
+    """dt 时刻最近一个已经收盘（盘后交易结束）的交易日（date）"""
+    close = datetime.time(*TRADING_RULES["closed"]["start"])
+    day = dt.date()
+    if is_trading_day(dt) and dt.time() >= close:
+        return day
+    day -= datetime.timedelta(days=1)
+    while not is_trading_day(datetime.datetime.combine(day, datetime.time())):
+        day -= datetime.timedelta(days=1)
+    return day
+
+# 压测/调试用：设置 TRADING_PHASE（如 continuous_am）后固定为该交易阶段
+TRADING_PHASE_OVERRIDE = os.environ.get('TRADING_PHASE') or None
 
 def get_trading_phase(dt):
     """获取当前交易阶段"""
+    if TRADING_PHASE_OVERRIDE:
+        return TRADING_PHASE_OVERRIDE
     if not is_trading_day(dt):
         return "non_trading"
     
@@ -87,16 +137,7 @@ def get_trading_phase(dt):
     
     return "closed"
 
-def calculate_commission(amount, is_buy):
-    """计算交易费用"""
-    # 买入费用：佣金（最低5元）+ 过户费
-    if is_buy:
-        commission = max(amount * 0.00025, 5)  # 佣金万2.5，最低5元
-        transfer_fee = amount * 0.00001  # 过户费万0.1
-        return commission + transfer_fee
-    
-    # 卖出费用：佣金（最低5元）+ 印花税 + 过户费
-    commission = max(amount * 0.00025, 5)  # 佣金万2.5，最低5元
-    stamp_duty = amount * 0.001  # 印花税千1
-    transfer_fee = amount * 0.00001  # 过户费万0.1
-    return commission + stamp_duty + transfer_fee
\ No newline at end of file
+def calculate_commission(amount, is_buy, stock_code=None):
+    """计算交易费用（元），按默认费率表以分计算（交易引擎使用 TradingAPI.fees）"""
+    # 买入：佣金（最低5元）+ 过户费；卖出另加印花税
+    return DEFAULT_FEES.fee(stock_code, is_buy, to_fen(amount)) / 100
\ No newline at end of file
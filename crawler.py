@@ -1,8 +1,34 @@
+import os
 import time
 from datetime import datetime
 import random
 from common import is_trading_day, get_trading_phase
-import requests
+from metrics import (
+    UPSTREAM_LATENCY, UPSTREAM_ERRORS, UPSTREAM_REJECTED,
+    UPSTREAM_STALE, UPSTREAM_CIRCUIT_OPEN
+)
+from upstream import UPSTREAM, UpstreamUnavailable
+
+# 东方财富行情接口（压测时用 QUOTE_HOST 指向本地模拟行情服务）
+QUOTE_HOST = os.environ.get('QUOTE_HOST', 'https://push2.eastmoney.com').rstrip('/')
+QUOTE_URL = QUOTE_HOST + "/api/qt/stock/get"
+BATCH_QUOTE_URL = QUOTE_HOST + "/api/qt/ulist.np/get"
+
+# 历史K线接口（设置了 QUOTE_HOST 时默认同一地址，也可以用 KLINE_HOST 单独指定）
+KLINE_HOST = (os.environ.get('KLINE_HOST') or
+              (QUOTE_HOST if os.environ.get('QUOTE_HOST') else 'https://push2his.eastmoney.com')).rstrip('/')
+KLINE_URL = KLINE_HOST + "/api/qt/stock/kline/get"
+
+# 批量行情每次请求的股票数量
+BATCH_SIZE = 100
+
+# 请求超时（秒），避免上游变慢时线程无限阻塞
+REQUEST_TIMEOUT = 5
+
+# 涨跌停价日内不变，撮合引擎也可以使用缓存的旧值
+STALE_OK_FOR_ENGINE = ("limit_prices",)
+
+UPSTREAM_CIRCUIT_OPEN.set_function(lambda: 0 if UPSTREAM.healthy() else 1)
 
 class StockDataCrawler:
     def __init__(self, stock_code):
@@ -26,8 +52,66 @@ class StockDataCrawler:
             return 0
         return round(value, 2)
 
+    @staticmethod
+    def _fetch(call, params, timeout=REQUEST_TIMEOUT, url=QUOTE_URL):
+        """请求行情接口并返回JSON
+        
+        所有请求共享限流器和熔断器。上游不可用时返回缓存的旧结果（带 _stale_seconds 字段），
+        没有可用缓存时抛出异常
+        """
+        cache_key = (call, params.get("secid") or params.get("secids"))
+        try:
+            UPSTREAM.before_request()
+        except UpstreamUnavailable as e:
+            UPSTREAM_REJECTED.inc(reason=e.reason)
+            return StockDataCrawler._stale_or_raise(call, cache_key, e)
+        
+        start = time.perf_counter()
+        try:
+            # requests 导入较慢，第一次请求行情时才加载
+            import requests
+            response = requests.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            json_data = response.json()
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(call=call)
+            UPSTREAM.breaker.record_failure()
+            return StockDataCrawler._stale_or_raise(call, cache_key, e)
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, call=call)
+        
+        # 上游有响应就视为健康，rc非0多为代码无效
+        UPSTREAM.breaker.record_success()
+        if json_data.get("rc") != 0:
+            UPSTREAM_ERRORS.inc(call=call)
+        else:
+            UPSTREAM.store(cache_key, json_data)
+        return json_data
+
+    @staticmethod
+    def _stale_or_raise(call, cache_key, error):
+        """返回缓存的旧结果，没有则抛出原异常"""
+        stale = UPSTREAM.stale(cache_key, engine_ok=call in STALE_OK_FOR_ENGINE)
+        if stale is None:
+            raise error
+        json_data, age = stale
+        UPSTREAM_STALE.inc(call=call)
+        json_data = dict(json_data)
+        json_data["_stale_seconds"] = age
+        return json_data
+
+    @staticmethod
+    def _secid(stock_code):
+        """东方财富证券ID：上海为1，深圳为0"""
+        market = "1" if stock_code.startswith("sh") else "0"
+        return f"{market}.{stock_code[2:]}"
+
     def get_current_price(self, max_retries=3):
         """获取股票的最新价"""
+        return self.get_price_quote()[0]
+
+    def get_price_quote(self):
+        """(最新价, 过期秒数)：上游不可用时返回缓存的旧行情及其过期秒数，否则过期秒数为None；失败时最新价为0"""
         # 辅助函数：处理价格精度
         def process_price(value, precision_field):
             """根据精度字段处理价格值"""
@@ -42,13 +126,11 @@ class StockDataCrawler:
             return value
 
         # 构造股票代码
-        secid = "0." + self.stock_code[2:]  # A股格式
+        secid = self._secid(self.stock_code)
         
         # 只请求必要字段
         fields = "f43,f59"  # 最新价和精度字段
         
-        # 构造API URL
-        base_url = "https://push2.eastmoney.com/api/qt/stock/get"
         params = {
             "invt": 2,
             "fltt": 1,
@@ -60,28 +142,27 @@ class StockDataCrawler:
         
         # 发送请求
         try:
-            response = requests.get(base_url, params=params, timeout=5)
-            response.raise_for_status()
-            json_data = response.json()
+            json_data = self._fetch("current_price", params)
             
             # 检查API返回的有效性
-            if json_data.get("rc") != 0 or "data" not in json_data:
-                return {}
+            if json_data.get("rc") != 0 or not json_data.get("data"):
+                return 0.0, None
                 
             data = json_data["data"]
         except Exception as e:
-            print(f"获取股票 {secid} 最新价失败: {e}")
-            return {}
+            if not isinstance(e, UpstreamUnavailable):
+                print(f"获取股票 {secid} 最新价失败: {e}")
+            return 0.0, None
         
-        # 确保包含必要字段
-        if "f43" in data and "f59" in data:
-            return float(process_price(data["f43"], data["f59"]))
+        # 确保包含必要字段（停牌等情况下最新价为"-"）
+        if isinstance(data.get("f43"), (int, float)) and "f59" in data:
+            return float(process_price(data["f43"], data["f59"])), json_data.get("_stale_seconds")
+        return 0.0, None
     
     def get_stock_limit_prices(self):
         """获取股票的涨跌停价"""
         # 构造API参数
-        market = "0" if self.stock_code.startswith("sz") else "1"
-        secid = f"{market}.{self.stock_code[2:]}"
+        secid = self._secid(self.stock_code)
         
         params = {
             "invt": 2,
@@ -94,14 +175,7 @@ class StockDataCrawler:
         
         try:
             # 发送请求
-            response = requests.get(
-                "https://push2.eastmoney.com/api/qt/stock/get",
-                params=params,
-            )
-            response.raise_for_status()
-            json_data = response.json()
-
-            print(json_data)
+            json_data = self._fetch("limit_prices", params)
             
             # 解析数据
             if json_data.get("rc") == 0 and "data" in json_data:
@@ -120,8 +194,7 @@ class StockDataCrawler:
     def get_stock_data(self): 
         """获取股票详细信息"""
         # 构造API参数
-        market = "1" if self.stock_code.startswith("sh") else "0"
-        secid = f"{market}.{self.stock_code[2:]}"
+        secid = self._secid(self.stock_code)
         
         # 请求所有必要字段
         fields = "f43,f46,f60,f44,f45,f47,f48,f51,f52,"  # 基础字段
@@ -140,13 +213,7 @@ class StockDataCrawler:
         
         try:
             # 发送请求
-            response = requests.get(
-                "https://push2.eastmoney.com/api/qt/stock/get",
-                params=params,
-            )
-            response.raise_for_status()
-            json_data = response.json()
-            print(json_data)
+            json_data = self._fetch("stock_data", params)
             
             # 解析数据
             if json_data.get("rc") == 0 and "data" in json_data:
@@ -240,12 +307,110 @@ class StockDataCrawler:
                     "ask4": ask_prices[3],
                     "ask4_vol": ask_volumes[3],
                     "ask5": ask_prices[4],
-                    "ask5_vol": ask_volumes[4]
+                    "ask5_vol": ask_volumes[4],
+                    # 上游不可用时返回的是缓存的旧行情
+                    "stale": "_stale_seconds" in json_data,
+                    "stale_seconds": round(json_data.get("_stale_seconds", 0), 1)
                 }
                 
                 return result
         except Exception as e:
-            print(f"获取股票数据失败: {e}")
+            if not isinstance(e, UpstreamUnavailable):
+                print(f"获取股票数据失败: {e}")
         
         # 失败时返回默认结构
-        return None
\ No newline at end of file
+        return None
+
+    def get_klines(self, klt, begin="0"):
+        """获取 begin（YYYYMMDD）以来的K线，klt 为东方财富K线周期（1/5/15/30/60 分钟，101 日线）
+        
+        返回 [(时间戳, 开盘, 最高, 最低, 收盘, 成交量(股), 成交额)]，失败返回None。
+        价格不复权，已保存的K线不会因为除权而变化，可以直接追加
+        """
+        params = {
+            "secid": self._secid(self.stock_code),
+            "fields1": "f1,f2,f3",
+            "fields2": "f51,f52,f53,f54,f55,f56,f57",  # 时间,开盘,收盘,最高,最低,成交量(手),成交额
+            "klt": klt,
+            "fqt": 0,
+            "beg": begin,
+            "end": "20500101",
+            "ut": "fa5fd1943c7b386f172d6893dbfba10b",
+            "_": int(time.time() * 1000)
+        }
+        try:
+            json_data = self._fetch(f"kline_{klt}", params, timeout=REQUEST_TIMEOUT * 2, url=KLINE_URL)
+            if json_data.get("rc") != 0:
+                return None
+            klines = (json_data.get("data") or {}).get("klines") or []
+        except Exception as e:
+            if not isinstance(e, UpstreamUnavailable):
+                print(f"获取股票 {self.stock_code} K线失败: {e}")
+            return None
+        
+        bars = []
+        for line in klines:
+            try:
+                day, open_price, close, high, low, volume, amount = line.split(",")[:7]
+                bar_time = datetime.strptime(day, "%Y-%m-%d %H:%M" if " " in day else "%Y-%m-%d")
+                bars.append((bar_time.timestamp(), float(open_price), float(high), float(low), float(close),
+                             float(volume) * 100, float(amount)))
+            except ValueError:
+                continue
+        return bars
+
+    @classmethod
+    def get_batch_quotes(cls, stock_codes):
+        """批量获取多只股票的基础行情（一次请求最多 BATCH_SIZE 只）
+        
+        返回 {股票代码: {code, name, current, open, prev_close, high, low, volume, amount,
+                        change, change_percent, upper_limit, lower_limit}}
+        """
+        def number(value):
+            """接口缺失值为 "-"，统一转为None"""
+            return float(value) if isinstance(value, (int, float)) else None
+        
+        quotes = {}
+        stock_codes = list(stock_codes)
+        for i in range(0, len(stock_codes), BATCH_SIZE):
+            chunk = stock_codes[i:i + BATCH_SIZE]
+            params = {
+                "fltt": 2,  # 直接返回小数价格
+                "invt": 2,
+                "fields": "f2,f3,f4,f5,f6,f12,f13,f14,f15,f16,f17,f18,f350,f351",
+                "secids": ",".join(cls._secid(code) for code in chunk),
+                "ut": "fa5fd1943c7b386f172d6893dbfba10b",
+                "_": int(time.time() * 1000)
+            }
+            try:
+                json_data = cls._fetch("batch_quotes", params, url=BATCH_QUOTE_URL)
+                diff = (json_data.get("data") or {}).get("diff") or []
+                if isinstance(diff, dict):
+                    diff = list(diff.values())
+            except Exception as e:
+                if not isinstance(e, UpstreamUnavailable):
+                    print(f"批量获取行情失败: {e}")
+                continue
+            
+            stale_seconds = json_data.get("_stale_seconds")
+            for item in diff:
+                code = ("sh" if item.get("f13") == 1 else "sz") + str(item.get("f12", ""))
+                quotes[code] = {
+                    "code": code,
+                    "name": item.get("f14", f"股票{code[-4:]}"),
+                    "current": number(item.get("f2")),
+                    "change_percent": number(item.get("f3")),
+                    "change": number(item.get("f4")),
+                    "volume": number(item.get("f5")) or 0,
+                    "amount": number(item.get("f6")) or 0,
+                    "high": number(item.get("f15")),
+                    "low": number(item.get("f16")),
+                    "open": number(item.get("f17")),
+                    "prev_close": number(item.get("f18")),
+                    "upper_limit": number(item.get("f350")),
+                    "lower_limit": number(item.get("f351"))
+                }
+                if stale_seconds is not None:
+                    # 上游不可用时的旧行情
+                    quotes[code]["stale_seconds"] = stale_seconds
+        return quotes
@@ -0,0 +1,310 @@
+"""行情数据源：实时爬虫、行情录制、离线回放"""
+import os
+import json
+import math
+import mmap
+import time
+import struct
+import datetime
+import threading
+from common import DATETIME_FORMAT
+from crawler import StockDataCrawler
+
+# 行情记录字段（与 StockDataCrawler.get_stock_data 的字段名一致）
+QUOTE_FIELDS = (
+    "current", "open", "prev_close", "high", "low", "volume", "amount",
+    "upper_limit", "lower_limit",
+    "bid1", "bid1_vol", "bid2", "bid2_vol", "bid3", "bid3_vol", "bid4", "bid4_vol", "bid5", "bid5_vol",
+    "ask1", "ask1_vol", "ask2", "ask2_vol", "ask3", "ask3_vol", "ask4", "ask4_vol", "ask5", "ask5_vol",
+)
+
+# 批量行情包含的字段
+BATCH_QUOTE_FIELDS = (
+    "code", "name", "current", "open", "prev_close", "high", "low", "volume", "amount",
+    "change", "change_percent", "upper_limit", "lower_limit",
+)
+
+# 记录类型
+KIND_PRICE = 1   # 最新价
+KIND_LIMITS = 2  # 涨跌停价
+KIND_DEPTH = 3   # 完整行情（含五档）
+
+# 定长记录：时间戳、类型、股票代码、各字段（缺失字段为NaN），定长便于mmap随机访问
+RECORD = struct.Struct("<dB8s%dd" % len(QUOTE_FIELDS))
+_NAN = float("nan")
+_FIELD_INDEX = {name: i for i, name in enumerate(QUOTE_FIELDS)}
+
+
+class MarketDataSource:
+    """行情数据源接口，失败时的返回值与 StockDataCrawler 保持一致"""
+
+    def get_current_price(self, stock_code):
+        """最新价，失败返回0"""
+        raise NotImplementedError
+
+    def get_price_quote(self, stock_code):
+        """(最新价, 过期秒数)，过期秒数不为None表示上游不可用时返回的旧行情"""
+        return self.get_current_price(stock_code), None
+
+    def get_stock_limit_prices(self, stock_code):
+        """(涨停价, 跌停价)，失败返回 (0, 0)"""
+        raise NotImplementedError
+
+    def get_stock_data(self, stock_code):
+        """完整行情字典，失败返回None"""
+        raise NotImplementedError
+
+    def get_klines(self, stock_code, klt, begin="0"):
+        """begin（YYYYMMDD）以来的历史K线，格式同 StockDataCrawler.get_klines；不支持时返回None"""
+        return None
+
+    def get_batch_quotes(self, stock_codes):
+        """批量基础行情 {股票代码: 行情字典}，默认逐只调用 get_stock_data"""
+        quotes = {}
+        for stock_code in stock_codes:
+            data = self.get_stock_data(stock_code)
+            if data:
+                quotes[stock_code] = {name: data.get(name) for name in BATCH_QUOTE_FIELDS}
+        return quotes
+
+
+class LiveDataSource(MarketDataSource):
+    """东方财富实时行情"""
+
+    def get_current_price(self, stock_code):
+        return StockDataCrawler(stock_code).get_current_price()
+
+    def get_price_quote(self, stock_code):
+        return StockDataCrawler(stock_code).get_price_quote()
+
+    def get_stock_limit_prices(self, stock_code):
+        return StockDataCrawler(stock_code).get_stock_limit_prices()
+
+    def get_stock_data(self, stock_code):
+        return StockDataCrawler(stock_code).get_stock_data()
+
+    def get_klines(self, stock_code, klt, begin="0"):
+        return StockDataCrawler(stock_code).get_klines(klt, begin)
+
+    def get_batch_quotes(self, stock_codes):
+        return StockDataCrawler.get_batch_quotes(stock_codes)
+
+
+class RecordingDataSource(MarketDataSource):
+    """透传另一个数据源，同时把观察到的行情追加写入按日分片的二进制文件"""
+
+    def __init__(self, source, directory="data/quotes"):
+        self.source = source
+        self.directory = directory
+        self.names = {}
+        self._file = None
+        self._file_day = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        names_file = os.path.join(directory, "names.json")
+        if os.path.exists(names_file):
+            with open(names_file, encoding="utf-8") as f:
+                self.names = json.load(f)
+
+    def get_current_price(self, stock_code):
+        return self.get_price_quote(stock_code)[0]
+
+    def get_price_quote(self, stock_code):
+        price, stale_seconds = self.source.get_price_quote(stock_code)
+        # 旧行情不录制，回放时不会出现重复的过期价格
+        if isinstance(price, (int, float)) and price > 0 and stale_seconds is None:
+            self.record(KIND_PRICE, stock_code, {"current": price})
+        return price, stale_seconds
+
+    def get_stock_limit_prices(self, stock_code):
+        upper_limit, lower_limit = self.source.get_stock_limit_prices(stock_code)
+        if upper_limit or lower_limit:
+            self.record(KIND_LIMITS, stock_code, {"upper_limit": upper_limit, "lower_limit": lower_limit})
+        return upper_limit, lower_limit
+
+    def get_stock_data(self, stock_code):
+        data = self.source.get_stock_data(stock_code)
+        if data:
+            self.record(KIND_DEPTH, stock_code, data)
+            name = data.get("name")
+            if name and self.names.get(stock_code) != name:
+                self._save_name(stock_code, name)
+        return data
+
+    def get_klines(self, stock_code, klt, begin="0"):
+        return self.source.get_klines(stock_code, klt, begin)
+
+    def get_batch_quotes(self, stock_codes):
+        quotes = self.source.get_batch_quotes(stock_codes)
+        ts = time.time()
+        for stock_code, data in quotes.items():
+            if "stale_seconds" not in data:
+                self.record(KIND_DEPTH, stock_code, data, ts=ts)
+            name = data.get("name")
+            if name and self.names.get(stock_code) != name:
+                self._save_name(stock_code, name)
+        return quotes
+
+    def record(self, kind, stock_code, fields, ts=None):
+        """追加一条记录"""
+        ts = ts or time.time()
+        values = [_NAN] * len(QUOTE_FIELDS)
+        for name, value in fields.items():
+            index = _FIELD_INDEX.get(name)
+            if index is not None and value is not None:
+                values[index] = float(value)
+        data = RECORD.pack(ts, kind, stock_code.encode()[:8], *values)
+        day = datetime.datetime.fromtimestamp(ts).strftime("%Y%m%d")
+        try:
+            with self._lock:
+                if day != self._file_day:
+                    if self._file:
+                        self._file.close()
+                    self._file = open(os.path.join(self.directory, f"quotes_{day}.bin"), "ab")
+                    self._file_day = day
+                self._file.write(data)
+                self._file.flush()
+        except Exception as e:
+            print(f"录制行情失败: {str(e)}")
+
+    def _save_name(self, stock_code, name):
+        """股票名称单独存放在 names.json"""
+        with self._lock:
+            self.names[stock_code] = name
+            try:
+                with open(os.path.join(self.directory, "names.json"), "w", encoding="utf-8") as f:
+                    json.dump(self.names, f, ensure_ascii=False)
+            except Exception as e:
+                print(f"保存股票名称失败: {str(e)}")
+
+
+class ReplayDataSource(MarketDataSource):
+    """通过mmap回放录制的行情文件
+
+    speed: 回放速度倍数（1为实时，60为一分钟回放一小时）；为0时只能手动 advance()
+    loop: 回放结束后是否从头开始
+    """
+
+    def __init__(self, directory="data/quotes", speed=1.0, start=None, loop=False):
+        self.directory = directory
+        self.speed = speed
+        self.loop = loop
+        self.names = {}
+        self.latest = {}  # {股票代码: [各字段最新值]}
+        self._lock = threading.Lock()
+        self._maps = []
+        names_file = os.path.join(directory, "names.json")
+        if os.path.exists(names_file):
+            with open(names_file, encoding="utf-8") as f:
+                self.names = json.load(f)
+        for filename in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            if not (filename.startswith("quotes_") and filename.endswith(".bin")):
+                continue
+            path = os.path.join(directory, filename)
+            if os.path.getsize(path) < RECORD.size:
+                continue
+            with open(path, "rb") as f:
+                self._maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if not self._maps:
+            raise ValueError(f"回放目录中没有行情文件: {directory}")
+
+        self.first_ts = RECORD.unpack_from(self._maps[0], 0)[0]
+        last = self._maps[-1]
+        self.last_ts = RECORD.unpack_from(last, (len(last) // RECORD.size - 1) * RECORD.size)[0]
+        self.start_ts = start if start is not None else self.first_ts
+        self._rewind()
+
+    def _rewind(self):
+        """回到起点"""
+        self.latest = {}
+        self._file_index = 0
+        self._offset = 0
+        self.replay_ts = self.start_ts
+        self._wall_start = time.time()
+        self.advance(self.start_ts)
+
+    def replay_time(self):
+        """当前回放时间（epoch秒）"""
+        if self.speed:
+            return self.start_ts + (time.time() - self._wall_start) * self.speed
+        return self.replay_ts
+
+    def advance(self, until_ts):
+        """把回放游标推进到 until_ts，更新各股票的最新行情"""
+        with self._lock:
+            while self._file_index < len(self._maps):
+                data = self._maps[self._file_index]
+                end = len(data) // RECORD.size * RECORD.size
+                while self._offset < end:
+                    record = RECORD.unpack_from(data, self._offset)
+                    if record[0] > until_ts:
+                        self.replay_ts = until_ts
+                        return
+                    code = record[2].rstrip(b"\0").decode()
+                    state = self.latest.setdefault(code, [_NAN] * len(QUOTE_FIELDS))
+                    for i, value in enumerate(record[3:]):
+                        if not math.isnan(value):
+                            state[i] = value
+                    self._offset += RECORD.size
+                self._file_index += 1
+                self._offset = 0
+            self.replay_ts = until_ts
+
+    def _sync(self):
+        """按回放速度推进游标"""
+        if not self.speed:
+            return
+        now_ts = self.replay_time()
+        if now_ts > self.last_ts and self.loop:
+            self._rewind()
+            return
+        self.advance(now_ts)
+
+    def _field(self, stock_code, name):
+        state = self.latest.get(stock_code)
+        if state is None:
+            return None
+        value = state[_FIELD_INDEX[name]]
+        return None if math.isnan(value) else value
+
+    def get_current_price(self, stock_code):
+        self._sync()
+        return self._field(stock_code, "current") or 0.0
+
+    def get_stock_limit_prices(self, stock_code):
+        self._sync()
+        upper_limit = self._field(stock_code, "upper_limit")
+        lower_limit = self._field(stock_code, "lower_limit")
+        if upper_limit is None and lower_limit is None:
+            return 0, 0
+        return upper_limit or 0, lower_limit or 0
+
+    def get_stock_data(self, stock_code):
+        self._sync()
+        if stock_code not in self.latest:
+            return None
+        result = {name: self._field(stock_code, name) for name in QUOTE_FIELDS}
+        for name in QUOTE_FIELDS:
+            if name.endswith("_vol") or name in ("volume", "amount"):
+                result[name] = result[name] or 0
+        current, prev_close = result["current"], result["prev_close"]
+        change = round(current - prev_close, 2) if current is not None and prev_close is not None else 0
+        result.update({
+            "code": stock_code,
+            "name": self.names.get(stock_code, f"股票{stock_code[-4:]}"),
+            "change": change,
+            "change_percent": round(change / prev_close * 100, 2) if prev_close else 0,
+            "timestamp": datetime.datetime.fromtimestamp(self.replay_time()).strftime(DATETIME_FORMAT)
+        })
+        return result
+
+
+def create_data_source(mode="live", directory="data/quotes", speed=1.0):
+    """按模式创建数据源：live（实时）、record（实时并录制）、replay（回放录制数据）"""
+    if mode == "live":
+        return LiveDataSource()
+    if mode == "record":
+        return RecordingDataSource(LiveDataSource(), directory)
+    if mode == "replay":
+        return ReplayDataSource(directory, speed=speed, loop=True)
+    raise ValueError(f"不支持的行情数据源: {mode}")
@@ -0,0 +1,183 @@
+"""资金曲线时间序列存储：多分辨率环形缓冲区，定长内存，紧凑二进制持久化"""
+import os
+import struct
+import datetime
+import threading
+from array import array
+from common import DATETIME_FORMAT
+
+# 各分辨率：(名称, 容量, 分桶函数)。同一桶内只保留最后一个点
+RESOLUTIONS = (
+    ("tick", 2000, lambda ts: int(ts)),                                                 # 秒级，约最近2000次快照
+    ("minute", 14400, lambda ts: int(ts // 60)),                                        # 分钟级，约60个交易日
+    ("day", 3650, lambda ts: datetime.datetime.fromtimestamp(ts).date().toordinal()),   # 日级，约10年
+)
+
+# 每个点的字段（均为 float64）
+FIELDS = ("timestamp", "total_assets", "cash", "stock_value")
+
+_MAGIC = b"EQTS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHH")
+_SERIES_HEADER = struct.Struct("<16sII")
+
+
+class _Ring:
+    """定长环形缓冲区，按列存储在 array('d') 中"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.columns = [array("d", bytes(8 * capacity)) for _ in FIELDS]
+        self.start = 0
+        self.size = 0
+
+    def _pos(self, index):
+        return (self.start + index) % self.capacity
+
+    def append(self, values):
+        if self.size < self.capacity:
+            pos = self._pos(self.size)
+            self.size += 1
+        else:
+            # 已满，覆盖最旧的点
+            pos = self.start
+            self.start = (self.start + 1) % self.capacity
+        for column, value in zip(self.columns, values):
+            column[pos] = value
+
+    def replace_last(self, values):
+        pos = self._pos(self.size - 1)
+        for column, value in zip(self.columns, values):
+            column[pos] = value
+
+    def timestamp(self, index):
+        return self.columns[0][self._pos(index)]
+
+    def row(self, index):
+        pos = self._pos(index)
+        return [column[pos] for column in self.columns]
+
+    def bisect(self, ts):
+        """返回第一个时间戳 >= ts 的逻辑下标"""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def column_bytes(self, column):
+        """按逻辑顺序导出一列"""
+        data = self.columns[column]
+        end = self.start + self.size
+        if end <= self.capacity:
+            return data[self.start:end].tobytes()
+        return data[self.start:].tobytes() + data[:end - self.capacity].tobytes()
+
+
+class EquityStore:
+    """资金曲线存储，支持 tick / minute / day 三种分辨率的范围查询"""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.series = {name: (_Ring(capacity), bucket) for name, capacity, bucket in RESOLUTIONS}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.series["tick"][0].size
+
+    def record(self, ts, total_assets, cash, stock_value):
+        """记录一个资金快照，同时更新各级汇总"""
+        values = (ts, total_assets, cash, stock_value)
+        with self.lock:
+            for ring, bucket in self.series.values():
+                if ring.size and ts < ring.timestamp(ring.size - 1):
+                    # 时间倒退（如系统时间调整）的点直接丢弃，保证时间戳有序
+                    continue
+                if ring.size and bucket(ring.timestamp(ring.size - 1)) == bucket(ts):
+                    ring.replace_last(values)
+                else:
+                    ring.append(values)
+
+    def query(self, resolution="tick", start=None, end=None, limit=None):
+        """按分辨率查询 [start, end] 区间内的点（时间为epoch秒），limit 取最近的若干条"""
+        if resolution not in self.series:
+            raise ValueError(f"不支持的分辨率: {resolution}")
+        ring, _ = self.series[resolution]
+        with self.lock:
+            lo = ring.bisect(start) if start is not None else 0
+            hi = ring.bisect(end + 1e-6) if end is not None else ring.size
+            if limit is not None:
+                lo = max(lo, hi - limit)
+            rows = [ring.row(i) for i in range(lo, hi)]
+        return [
+            {
+                'timestamp': datetime.datetime.fromtimestamp(ts).strftime(DATETIME_FORMAT),
+                'total_assets': total_assets,
+                'cash': cash,
+                'stock_value': stock_value
+            }
+            for ts, total_assets, cash, stock_value in rows
+        ]
+
+    def import_points(self, points):
+        """导入旧版 equity_history 列表（[{timestamp, total_assets, cash, stock_value}]）"""
+        for point in points:
+            try:
+                ts = datetime.datetime.strptime(point['timestamp'], DATETIME_FORMAT).timestamp()
+                self.record(ts, float(point['total_assets']), float(point['cash']), float(point['stock_value']))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def to_bytes(self):
+        """序列化为紧凑的二进制格式"""
+        with self.lock:
+            parts = [_HEADER.pack(_MAGIC, _VERSION, len(self.series))]
+            for name, (ring, _) in self.series.items():
+                parts.append(_SERIES_HEADER.pack(name.encode(), ring.capacity, ring.size))
+                for column in range(len(FIELDS)):
+                    parts.append(ring.column_bytes(column))
+        return b"".join(parts)
+
+    def from_bytes(self, data):
+        """从二进制数据恢复（容量按当前配置，超出部分只保留最新的点）"""
+        magic, version, count = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("资金曲线文件格式不正确")
+        offset = _HEADER.size
+        with self.lock:
+            for _ in range(count):
+                raw_name, _capacity, size = _SERIES_HEADER.unpack_from(data, offset)
+                offset += _SERIES_HEADER.size
+                columns = []
+                for _column in FIELDS:
+                    column = array("d")
+                    column.frombytes(data[offset:offset + 8 * size])
+                    offset += 8 * size
+                    columns.append(column)
+                name = raw_name.rstrip(b"\0").decode()
+                if name not in self.series:
+                    continue
+                ring, _ = self.series[name]
+                ring.start, ring.size = 0, 0
+                for i in range(max(0, size - ring.capacity), size):
+                    ring.append([column[i] for column in columns])
+
+    def save(self, filename=None):
+        """写入文件（先写临时文件再替换，避免写到一半损坏）"""
+        filename = filename or self.filename
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.to_bytes())
+        os.replace(tmp, filename)
+
+    def load(self, filename=None):
+        """从文件加载，文件不存在返回False"""
+        filename = filename or self.filename
+        if not os.path.exists(filename):
+            return False
+        with open(filename, "rb") as f:
+            self.from_bytes(f.read())
+        return True
@@ -0,0 +1,38 @@
+"""可选的 orjson 响应编码：安装了 orjson 且 Flask>=2.2 时替换 jsonify 的编码器，否则保持默认"""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask<2.2 没有可替换的 JSON provider
+    DefaultJSONProvider = None
+
+
+if orjson is not None and DefaultJSONProvider is not None:
+    # 日期时间交给 Flask 的默认转换，保证输出格式与 json 模块一致
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """用 orjson 编码 JSON 响应，解码仍使用标准库"""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode("utf-8")
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS),
+                mimetype=self.mimetype
+            )
+else:
+    OrjsonProvider = None
+
+
+def install(app):
+    """为 Flask 应用启用 orjson 编码，返回是否启用"""
+    if OrjsonProvider is None:
+        return False
+    app.json = OrjsonProvider(app)
+    return True
@@ -0,0 +1,151 @@
+"""交易费用：按券商和交易所配置佣金、最低佣金、印花税和过户费，全部以整数分计算
+
+费率单位为百万分之一（ppm，万2.5 = 250），每项费用单独按分四舍五入，不会产生浮点误差。
+fee_batch() 用 NumPy 一次计算大量成交的费用（回测、集合竞价批量成交）。
+"""
+import json
+import copy
+
+PPM = 1000000
+
+# 默认费率：佣金万2.5（最低5元），印花税卖出千1，过户费万0.1（沪深北相同）
+DEFAULT_CONFIG = {
+    "broker": "default",
+    "brokers": {
+        "default": {"commission_ppm": 250, "min_commission": 500},
+    },
+    "exchanges": {
+        "sh": {"transfer_ppm": 10, "stamp_duty_buy_ppm": 0, "stamp_duty_sell_ppm": 1000},
+        "sz": {"transfer_ppm": 10, "stamp_duty_buy_ppm": 0, "stamp_duty_sell_ppm": 1000},
+        "bj": {"transfer_ppm": 10, "stamp_duty_buy_ppm": 0, "stamp_duty_sell_ppm": 1000},
+    },
+}
+
+# 每个交易所的费率字段（券商配置可以按交易所覆盖佣金）
+_FIELDS = ("commission_ppm", "min_commission", "transfer_ppm", "stamp_duty_buy_ppm", "stamp_duty_sell_ppm")
+
+
+def to_fen(yuan):
+    """元转为整数分（四舍五入）"""
+    return int(round(yuan * 100))
+
+
+def exchange_of(stock_code):
+    """股票代码前缀对应的交易所，未知前缀按沪市处理"""
+    prefix = (stock_code or "")[:2].lower()
+    return prefix if prefix in ("sh", "sz", "bj") else "sh"
+
+
+def _round_ppm(amount, ppm):
+    """金额（分）乘以费率后按分四舍五入"""
+    return (amount * ppm + PPM // 2) // PPM
+
+
+class FeeSchedule:
+    """一个券商的费率表
+
+    config 结构同 DEFAULT_CONFIG；brokers 下每个券商可以用 "exchanges" 按交易所覆盖佣金费率和最低佣金，
+    最低佣金单位为分
+    """
+
+    def __init__(self, config=None, broker=None):
+        config = copy.deepcopy(config or DEFAULT_CONFIG)
+        self.broker = broker or config.get("broker", "default")
+        brokers = config.get("brokers", {})
+        if self.broker not in brokers:
+            raise ValueError(f"费率表中没有券商: {self.broker}")
+        broker_rates = brokers[self.broker]
+
+        # {交易所: {字段: 整数}}
+        self.rates = {}
+        for exchange, exchange_rates in config.get("exchanges", {}).items():
+            rates = {
+                "commission_ppm": broker_rates.get("commission_ppm", 0),
+                "min_commission": broker_rates.get("min_commission", 0),
+                "transfer_ppm": exchange_rates.get("transfer_ppm", 0),
+                "stamp_duty_buy_ppm": exchange_rates.get("stamp_duty_buy_ppm", 0),
+                "stamp_duty_sell_ppm": exchange_rates.get("stamp_duty_sell_ppm", 0),
+            }
+            rates.update(broker_rates.get("exchanges", {}).get(exchange, {}))
+            for name in _FIELDS:
+                if not isinstance(rates[name], int) or rates[name] < 0:
+                    raise ValueError(f"{exchange}.{name} 必须是非负整数")
+            self.rates[exchange] = rates
+        if "sh" not in self.rates:
+            raise ValueError("费率表至少需要配置 sh 交易所")
+        self._exchanges = sorted(self.rates)
+        self._tables = None
+
+    @classmethod
+    def load(cls, path, broker=None):
+        """从 JSON 文件读取费率表"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), broker)
+
+    def _rates_for(self, stock_code):
+        return self.rates.get(exchange_of(stock_code)) or self.rates["sh"]
+
+    def breakdown(self, stock_code, is_buy, amount):
+        """一笔成交的各项费用（分）：{commission, stamp_duty, transfer_fee, total}"""
+        rates = self._rates_for(stock_code)
+        commission = max(_round_ppm(amount, rates["commission_ppm"]), rates["min_commission"])
+        stamp_duty = _round_ppm(amount, rates["stamp_duty_buy_ppm" if is_buy else "stamp_duty_sell_ppm"])
+        transfer_fee = _round_ppm(amount, rates["transfer_ppm"])
+        return {
+            "commission": commission,
+            "stamp_duty": stamp_duty,
+            "transfer_fee": transfer_fee,
+            "total": commission + stamp_duty + transfer_fee,
+        }
+
+    def fee(self, stock_code, is_buy, amount):
+        """一笔成交的总费用（分），amount 为成交金额（分）"""
+        rates = self._rates_for(stock_code)
+        commission = max(_round_ppm(amount, rates["commission_ppm"]), rates["min_commission"])
+        stamp_duty = _round_ppm(amount, rates["stamp_duty_buy_ppm" if is_buy else "stamp_duty_sell_ppm"])
+        return commission + stamp_duty + _round_ppm(amount, rates["transfer_ppm"])
+
+    def fee_batch(self, stock_codes, is_buy, amounts):
+        """批量计算总费用（分），返回 numpy int64 数组
+
+        stock_codes: 股票代码序列；is_buy: 布尔序列或单个布尔值；amounts: 成交金额（分）序列
+        结果与逐笔调用 fee() 完全一致
+        """
+        import numpy as np
+        if self._tables is None:
+            # 每个交易所一行的费率查找表
+            self._tables = {
+                name: np.array([self.rates[exchange][name] for exchange in self._exchanges], dtype=np.int64)
+                for name in _FIELDS
+            }
+        tables = self._tables
+        index = {exchange: i for i, exchange in enumerate(self._exchanges)}
+        default = index["sh"]
+        exchange_index = np.fromiter(
+            (index.get(exchange_of(code), default) for code in stock_codes), dtype=np.intp
+        )
+        amounts = np.asarray(amounts, dtype=np.int64)
+        is_buy = np.broadcast_to(np.asarray(is_buy, dtype=bool), amounts.shape)
+
+        def round_ppm(ppm):
+            return (amounts * ppm + PPM // 2) // PPM
+
+        commission = np.maximum(round_ppm(tables["commission_ppm"][exchange_index]),
+                                tables["min_commission"][exchange_index])
+        stamp_ppm = np.where(is_buy, tables["stamp_duty_buy_ppm"][exchange_index],
+                             tables["stamp_duty_sell_ppm"][exchange_index])
+        return commission + round_ppm(stamp_ppm) + round_ppm(tables["transfer_ppm"][exchange_index])
+
+
+def allocate(total, weights):
+    """把整数 total 按权重分摊为整数列表，余数给最后一项（分摊到各持仓批次的费用）"""
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        return [total] + [0] * (len(weights) - 1) if weights else []
+    shares = [total * weight // weight_sum for weight in weights]
+    shares[-1] += total - sum(shares)
+    return shares
+
+
+# 默认费率表
+DEFAULT_FEES = FeeSchedule()
@@ -0,0 +1,311 @@
+"""历史K线缓存：日线/分钟线从行情源拉取一次后追加写入本地定长记录文件
+
+每只股票每个周期一个文件（data/kline/<周期>/<股票代码>.bin），查询时用 numpy.memmap 映射，
+各字段是列式视图。之后只请求最后一根K线以来的增量，范围查询和技术指标（MA/EMA/VWAP/波动率）
+都直接基于本地数据向量化计算，不会重复请求上游。
+"""
+import os
+import re
+import math
+import time
+import struct
+import datetime
+import threading
+import numpy as np
+from common import get_trading_phase, last_closed_trading_day
+
+# 支持的周期：名称 -> (东方财富K线周期, 每根K线的分钟数)
+PERIODS = {
+    "1m": (1, 1),
+    "5m": (5, 5),
+    "15m": (15, 15),
+    "30m": (30, 30),
+    "60m": (60, 60),
+    "day": (101, 240),
+}
+
+# 每根K线的字段（成交量单位为股）
+BAR = np.dtype([
+    ("timestamp", "<f8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"),
+    ("close", "<f8"), ("volume", "<f8"), ("amount", "<f8"),
+])
+FIELDS = BAR.names
+
+# 一年的交易分钟数，用于波动率年化
+_MINUTES_PER_YEAR = 252 * 240
+
+# K线不会变化的交易阶段
+_IDLE_PHASES = ("break", "closed", "non_trading")
+
+# 指标写法：ma5、ema12、vwap（分钟线为当日累计，日线为区间累计）、vwap20、vol20（年化波动率）
+_INDICATOR = re.compile(r"^(ma|ema|vwap|vol)(\d*)$")
+DEFAULT_WINDOW = 20
+MAX_WINDOW = 1000
+
+# 股票代码同时用作文件名，只接受 sh/sz/bj 加6位数字
+_STOCK_CODE = re.compile(r"^(sh|sz|bj)\d{6}$")
+
+_MAGIC = b"KLIN"
+_VERSION = 1
+_HEADER = struct.Struct("<4sH10x")
+
+
+def rolling_sum(values, n):
+    """n 期滚动求和，前 n-1 个为NaN"""
+    result = np.full(len(values), np.nan)
+    if len(values) >= n:
+        cumsum = np.cumsum(np.concatenate(([0.0], values)))
+        result[n - 1:] = cumsum[n:] - cumsum[:-n]
+    return result
+
+
+def ma(close, n):
+    """简单移动平均"""
+    return rolling_sum(close, n) / n
+
+
+def ema(close, n):
+    """指数移动平均（alpha = 2/(n+1)，以第一个值为初值）
+
+    块内 ema[i] = decay^(i+1) * 上一块末值 + alpha * decay^(i+1) * sum(x[j] / decay^(j+1))，用 cumsum 向量化；
+    块长保证 decay^-块长 不超过 1e200，不会溢出
+    """
+    result = np.empty(len(close))
+    if not len(close):
+        return result
+    alpha = 2.0 / (n + 1)
+    decay = 1.0 - alpha
+    block = max(1, int(200 / -math.log10(decay)))
+    prev = close[0]
+    for start in range(0, len(close), block):
+        x = close[start:start + block]
+        powers = decay ** np.arange(1, len(x) + 1)
+        result[start:start + len(x)] = powers * prev + alpha * powers * np.cumsum(x / powers)
+        prev = result[start + len(x) - 1]
+    return result
+
+
+def vwap(amount, volume, n=None, days=None):
+    """成交量加权均价：n 期滚动；不传 n 时按 days（每根K线所属日期）分日累计，都不传时整个区间累计"""
+    if n:
+        amount_sum, volume_sum = rolling_sum(amount, n), rolling_sum(volume, n)
+    else:
+        amount_sum, volume_sum = np.cumsum(amount), np.cumsum(volume)
+        if days is not None and len(days):
+            # 减去当日第一根K线之前的累计值
+            first = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+            starts = np.repeat(first, np.diff(np.concatenate((first, [len(days)]))))
+            amount_sum = amount_sum - np.concatenate(([0.0], amount_sum))[starts]
+            volume_sum = volume_sum - np.concatenate(([0.0], volume_sum))[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(volume_sum > 0, amount_sum / volume_sum, np.nan)
+
+
+def volatility(close, n, bars_per_year):
+    """n 期对数收益率的滚动标准差（样本标准差），按 bars_per_year 年化"""
+    result = np.full(len(close), np.nan)
+    if len(close) <= n or n < 2:
+        return result
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.diff(np.log(close))
+    sums = rolling_sum(returns, n)
+    squares = rolling_sum(returns * returns, n)
+    variance = np.maximum(squares - sums * sums / n, 0) / (n - 1)
+    result[1:] = np.sqrt(variance * bars_per_year)
+    return result
+
+
+def parse_indicators(spec):
+    """解析指标列表（逗号分隔，如 "ma5,ema12,vwap,vol20"），返回 [(名称, 类型, 窗口)]"""
+    indicators = []
+    for name in filter(None, (part.strip().lower() for part in (spec or "").split(","))):
+        match = _INDICATOR.match(name)
+        if not match:
+            raise ValueError(f"不支持的指标: {name}")
+        kind, window = match.group(1), int(match.group(2)) if match.group(2) else None
+        if kind != "vwap":
+            window = window or DEFAULT_WINDOW
+        if window is not None and not 1 <= window <= MAX_WINDOW:
+            raise ValueError(f"指标窗口应在 1~{MAX_WINDOW} 之间: {name}")
+        indicators.append((name, kind, window))
+    return indicators
+
+
+def _format_times(timestamps):
+    """epoch秒数组转为本地时间字符串列表（A股所在时区没有夏令时，整列使用同一个UTC偏移）"""
+    utc_offset = time.localtime(float(timestamps[0])).tm_gmtoff
+    local = (timestamps + utc_offset).astype("datetime64[s]")
+    return [text.replace("T", " ") for text in np.datetime_as_string(local, unit="s").tolist()]
+
+
+class _Series:
+    """一只股票一个周期的K线文件：定长记录追加写入，读取时 memmap 映射"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._map = None
+        self.count = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                magic, version = _HEADER.unpack(f.read(_HEADER.size))[:2]
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"K线文件格式不正确: {path}")
+            # 末尾不完整的记录（写到一半中断）忽略，下次写入时覆盖
+            self.count = (os.path.getsize(path) - _HEADER.size) // BAR.itemsize
+
+    def bars(self):
+        """全部K线（结构化数组，只读视图）"""
+        if not self.count:
+            return np.empty(0, dtype=BAR)
+        if self._map is None:
+            self._map = np.memmap(self.path, dtype=BAR, mode="r", offset=_HEADER.size, shape=(self.count,))
+        return self._map
+
+    def last_timestamp(self):
+        return float(self.bars()["timestamp"][-1]) if self.count else None
+
+    def merge(self, bars):
+        """合并新拉取的K线：与最后一根时间相同的覆盖它（盘中未走完的K线），更晚的追加，返回新增数量"""
+        last = self.last_timestamp()
+        if last is not None:
+            bars = [bar for bar in bars if bar[0] >= last]
+        if not bars:
+            return 0
+        data = np.array(bars, dtype=BAR)
+        data = data[np.concatenate((data["timestamp"][1:] > data["timestamp"][:-1], [True]))]
+        position = self.count
+        if last is not None and data["timestamp"][0] == last:
+            position -= 1
+        # 写入前释放映射（Windows 不能修改已映射的区域）
+        self._map = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "r+b" if os.path.exists(self.path) else "w+b") as f:
+            if not self.count:
+                f.write(_HEADER.pack(_MAGIC, _VERSION))
+            f.seek(_HEADER.size + position * BAR.itemsize)
+            f.write(data.tobytes())
+            f.truncate()
+        added = position + len(data) - self.count
+        self.count = position + len(data)
+        return added
+
+
+class KlineStore:
+    """K线缓存和指标计算
+
+    data_source 需要实现 get_klines()；一个序列在本进程第一次被查询时同步一次，
+    之后盘中每 refresh 秒最多同步一次，休市期间同步过就不再请求
+    """
+
+    def __init__(self, data_source, directory="data/kline", refresh=60.0):
+        self.data_source = data_source
+        self.directory = directory
+        self.refresh = refresh
+        self._series = {}
+        self._synced = {}  # {(股票代码, 周期): 上次同步时间}
+        self._lock = threading.Lock()
+
+    def _get_series(self, stock_code, period):
+        if period not in PERIODS:
+            raise ValueError(f"不支持的K线周期: {period}")
+        if not _STOCK_CODE.match(stock_code):
+            raise ValueError(f"股票代码格式错误: {stock_code}")
+        key = (stock_code, period)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                path = os.path.join(self.directory, period, f"{stock_code}.bin")
+                series = self._series[key] = _Series(path)
+            return series
+
+    def _needs_sync(self, key, now):
+        synced = self._synced.get(key)
+        if synced is None:
+            return True
+        if now - synced < self.refresh:
+            return False
+        # 上次同步和现在都在同一段休市时间内，K线不会有变化
+        now_dt, synced_dt = datetime.datetime.fromtimestamp(now), datetime.datetime.fromtimestamp(synced)
+        return not (get_trading_phase(now_dt) in _IDLE_PHASES and get_trading_phase(synced_dt) in _IDLE_PHASES
+                    and last_closed_trading_day(now_dt) == last_closed_trading_day(synced_dt))
+
+    def sync(self, stock_code, period, force=False):
+        """从行情源拉取增量K线并追加到本地，返回新增数量（行情源不可用时返回None）"""
+        series = self._get_series(stock_code, period)
+        key = (stock_code, period)
+        now = time.time()
+        with series.lock:
+            if not force and not self._needs_sync(key, now):
+                return 0
+            last = series.last_timestamp()
+            begin = datetime.datetime.fromtimestamp(last).strftime("%Y%m%d") if last is not None else "0"
+            bars = self.data_source.get_klines(stock_code, PERIODS[period][0], begin)
+            if bars is None:
+                return None
+            try:
+                added = series.merge(bars)
+            except Exception as e:
+                print(f"保存K线失败: {str(e)}")
+                return None
+            self._synced[key] = now
+            return added
+
+    def query(self, stock_code, period="day", start=None, end=None, limit=None, indicators=None):
+        """查询 [start, end] 区间（epoch秒）的K线，limit 取最近的若干根
+
+        indicators 为 parse_indicators 的结果；指标用区间之前的K线预热（分钟线的当日累计 vwap 从当日第一根
+        K线算起），结果与查询整个历史时一致。日线的 vwap 不带窗口时按定义是查询区间内的累计值
+        """
+        self.sync(stock_code, period)
+        indicators = indicators or []
+        series = self._get_series(stock_code, period)
+        with series.lock:
+            bars = series.bars()
+            timestamps = bars["timestamp"]
+            lo = int(np.searchsorted(timestamps, start, "left")) if start is not None else 0
+            hi = int(np.searchsorted(timestamps, end, "right")) if end is not None else len(bars)
+            if limit is not None:
+                lo = max(lo, hi - limit)
+            lo = min(lo, hi)
+            # 指标预热：EMA 取 8 倍窗口（初值的权重小于 1e-6），其余取一个窗口
+            warmup = max([window * (8 if kind == "ema" else 1) for _, kind, window in indicators if window] or [0])
+            begin = max(0, lo - warmup)
+            if lo < hi and period != "day" and any(kind == "vwap" and not window for _, kind, window in indicators):
+                # 分钟线的当日累计 vwap 从区间第一根K线所在交易日的第一根K线开始累计
+                utc_offset = time.localtime(float(timestamps[lo])).tm_gmtoff
+                day_start = (int(timestamps[lo]) + utc_offset) // 86400 * 86400 - utc_offset
+                begin = min(begin, int(np.searchsorted(timestamps, day_start, "left")))
+            data = np.array(bars[begin:hi])
+        columns = self._indicators(data, period, indicators)
+        data = data[lo - begin:]
+        if not len(data):
+            return []
+        # 按列整体转换后再拼成每根K线一个字典
+        names = ["datetime"] + list(FIELDS[1:]) + list(columns)
+        values = [_format_times(data["timestamp"])]
+        values += [np.round(data[name], 4).tolist() for name in FIELDS[1:]]
+        for column in columns.values():
+            column = np.round(column[lo - begin:], 4)
+            values.append([None if value != value else value for value in column.tolist()])
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+    def _indicators(self, data, period, indicators):
+        """计算各指标列"""
+        columns = {}
+        close = data["close"]
+        days = None
+        for name, kind, window in indicators:
+            if kind == "ma":
+                columns[name] = ma(close, window)
+            elif kind == "ema":
+                columns[name] = ema(close, window)
+            elif kind == "vol":
+                columns[name] = volatility(close, window, _MINUTES_PER_YEAR / PERIODS[period][1])
+            else:
+                if days is None and period != "day" and len(data):
+                    # 按本地时间的日期分日
+                    utc_offset = time.localtime(float(data["timestamp"][0])).tm_gmtoff
+                    days = (data["timestamp"] + utc_offset) // 86400
+                columns[name] = vwap(data["amount"], data["volume"], window, days)
+        return columns
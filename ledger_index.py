@@ -0,0 +1,222 @@
+"""订单和成交记录的二级索引与分页查询
+
+记录按创建顺序（即时间顺序）保存位置号，另按状态、股票代码维护位置集合：
+- 时间范围用二分查找定位位置区间
+- 状态、股票代码过滤从最小的索引集合取候选，候选很多时直接从新到旧顺序扫描，取够一页即停止
+- 分页游标是最后一条记录的订单号，与位置号无关，日终压缩历史或在其他API节点上查询时同样有效
+调用方需持有 TradingAPI.lock。
+"""
+import datetime
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from common import ORDER_SIDES, DATETIME_FORMAT
+from state_codec import ORDER_SCHEMA, TRADE_SCHEMA
+
+ORDER_STATUSES = ("pending", "filled", "canceled", "expired")
+ORDER_FIELDS = tuple(name for name, _ in ORDER_SCHEMA)
+TRADE_FIELDS = tuple(name for name, _ in TRADE_SCHEMA)
+
+# 不带交易所前缀的6位股票代码按这些前缀查找
+EXCHANGE_PREFIXES = ("sh", "sz", "bj")
+
+# 每页最多返回的记录数
+MAX_LIMIT = 1000
+
+# 索引候选数不到扫描区间的 1/8 时按索引取，否则顺序扫描
+INDEX_RATIO = 8
+
+
+def parse_list(value):
+    """逗号分隔的参数值，也接受列表"""
+    if value is None or isinstance(value, (list, tuple, set)):
+        return value
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _time_key(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_FORMAT)
+    return value
+
+
+class RecordIndex:
+    """按时间顺序保存的记录及其按股票代码的索引"""
+
+    time_field = None
+    fields = ()
+
+    def __init__(self, records=()):
+        self.rebuild(records)
+
+    def rebuild(self, records):
+        self.records = []
+        self.times = []
+        self.by_stock = defaultdict(set)
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        position = len(self.records)
+        self.records.append(record)
+        self.times.append(record[self.time_field])
+        self.by_stock[record["stock"]].add(position)
+        return position
+
+    def __len__(self):
+        return len(self.records)
+
+    def _cursor(self, position):
+        raise NotImplementedError
+
+    def _position(self, cursor):
+        raise NotImplementedError
+
+    def _candidate_sets(self, filters):
+        """过滤条件对应的索引集合"""
+        stock = filters.get("stock")
+        if not stock:
+            return []
+        if stock.isdigit():
+            return [set().union(*(self.by_stock.get(prefix + stock, ()) for prefix in EXCHANGE_PREFIXES))]
+        return [self.by_stock.get(stock, ())]
+
+    def _matches(self, record, filters):
+        stock = filters.get("stock")
+        if stock and record["stock"] != stock and not (stock.isdigit() and record["stock"][2:] == stock):
+            return False
+        return not filters.get("side") or record["type"] == filters["side"]
+
+    def query(self, stock=None, side=None, start=None, end=None, limit=None, cursor=None, fields=None, **extra):
+        """从新到旧返回一页记录 {'results': [...], 'next_cursor': 下一页游标或None}
+
+        stock 可以不带交易所前缀（如 600000）；start/end 为 datetime 或 "YYYY-MM-DD HH:MM:SS"（闭区间）；
+        fields 只返回指定字段
+        """
+        if side and ORDER_SIDES.get(side) is None:
+            raise ValueError(f"无效的买卖方向: {side}")
+        fields = parse_list(fields)
+        if fields:
+            unknown = [name for name in fields if name not in self.fields]
+            if unknown:
+                raise ValueError(f"未知字段: {','.join(unknown)}")
+        if limit is not None and not 0 < limit <= MAX_LIMIT:
+            raise ValueError(f"limit 必须在 1~{MAX_LIMIT} 之间")
+        filters = dict(extra, stock=stock, side=ORDER_SIDES.get(side) if side else None)
+
+        low = bisect_left(self.times, _time_key(start)) if start else 0
+        high = bisect_right(self.times, _time_key(end)) if end else len(self.records)
+        if cursor:
+            high = min(high, self._position(cursor))
+
+        candidates = self._candidate_sets(filters)
+        smallest = min(candidates, key=len) if candidates else None
+        if smallest is not None and len(smallest) * INDEX_RATIO < high - low:
+            positions = sorted((p for p in smallest if low <= p < high), reverse=True)
+        else:
+            positions = range(high - 1, low - 1, -1)
+
+        page = []
+        next_cursor = None
+        for position in positions:
+            record = self.records[position]
+            if not self._matches(record, filters):
+                continue
+            if limit is not None and len(page) == limit:
+                next_cursor = self._cursor(page_last)
+                break
+            page.append(record)
+            page_last = position
+        if fields:
+            page = [{name: record.get(name) for name in fields} for record in page]
+        return {"results": page, "next_cursor": next_cursor}
+
+
+class OrderIndex(RecordIndex):
+    """订单索引：另按状态索引，游标为订单号"""
+
+    time_field = "created_at"
+    fields = ORDER_FIELDS
+
+    def rebuild(self, records):
+        self.positions = {}
+        self.by_status = defaultdict(set)
+        super().rebuild(records)
+
+    def add(self, order):
+        position = super().add(order)
+        self.positions[order["order_id"]] = position
+        self.by_status[order["status"]].add(position)
+        return position
+
+    def set_status(self, order, status):
+        """修改订单状态并更新索引（未加入订单簿的订单只修改状态）"""
+        position = self.positions.get(order["order_id"])
+        if position is not None:
+            self.by_status[order["status"]].discard(position)
+            self.by_status[status].add(position)
+        order["status"] = status
+
+    def _cursor(self, position):
+        return self.records[position]["order_id"]
+
+    def _position(self, cursor):
+        position = self.positions.get(cursor)
+        if position is None:
+            raise ValueError("游标无效或对应的订单已归档")
+        return position
+
+    def _candidate_sets(self, filters):
+        candidates = super()._candidate_sets(filters)
+        order_id = filters.get("order_id")
+        if order_id in self.positions:
+            # 完整订单号直接定位，前缀只能顺序扫描
+            candidates.append({self.positions[order_id]})
+        statuses = filters.get("status")
+        if statuses:
+            unknown = [status for status in statuses if status not in ORDER_STATUSES]
+            if unknown:
+                raise ValueError(f"无效的订单状态: {','.join(unknown)}")
+            if len(statuses) == 1:
+                candidates.append(self.by_status.get(statuses[0], ()))
+            else:
+                candidates.append(set().union(*(self.by_status.get(status, ()) for status in statuses)))
+        return candidates
+
+    def _matches(self, record, filters):
+        statuses = filters.get("status")
+        if statuses and record["status"] not in statuses:
+            return False
+        if filters.get("order_id") and not record["order_id"].startswith(filters["order_id"]):
+            return False
+        return super()._matches(record, filters)
+
+    def query(self, status=None, order_id=None, **kwargs):
+        """status 可以是多个状态（逗号分隔），order_id 为订单号或其前缀，其余参数见 RecordIndex.query"""
+        return super().query(status=parse_list(status), order_id=order_id, **kwargs)
+
+
+class TradeIndex(RecordIndex):
+    """成交记录索引：同一订单的成交记录（卖出按批次拆分）是连续的，游标为 "订单号:序号\""""
+
+    time_field = "datetime"
+    fields = TRADE_FIELDS
+
+    def rebuild(self, records):
+        self.first = {}  # {订单号: 该订单第一条成交记录的位置}
+        super().rebuild(records)
+
+    def add(self, trade):
+        position = super().add(trade)
+        self.first.setdefault(trade["order_id"], position)
+        return position
+
+    def _cursor(self, position):
+        order_id = self.records[position]["order_id"]
+        return f"{order_id}:{position - self.first[order_id]}"
+
+    def _position(self, cursor):
+        order_id, _, offset = cursor.rpartition(":")
+        position = self.first.get(order_id)
+        if position is None or not offset.isdigit():
+            raise ValueError("游标无效或对应的成交记录已归档")
+        return position + int(offset)
@@ -0,0 +1,206 @@
+"""运行指标：计数器、延迟直方图，以 Prometheus 文本格式导出"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from profiler import PROFILER
+
+# 延迟直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    """格式化标签，如 {call="price",le="0.1"}"""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    """格式化数值（整数不带小数点）"""
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        """计数加一（或加指定值）"""
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """读取当前计数"""
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """固定分桶的延迟直方图（只在观测时做一次二分查找和一次加法）"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # {标签值: [各桶计数, 总和, 总数]}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        """记录一次观测值（秒）"""
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文：with HISTOGRAM.time(): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        """读取观测次数"""
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        series = self._series.get(key)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """瞬时值，可直接设置或在导出时通过回调取值"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._value = 0
+        self._function = None
+        REGISTRY.append(self)
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """导出时调用 function() 取值"""
+        self._function = function
+
+    def value(self):
+        return self._function() if self._function else self._value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(self.value())}"]
+
+
+class InstrumentedLock:
+    """带等待/持有时间统计的互斥锁，用法与 threading.Lock 相同"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            # 锁是互斥的，持有期间只有当前线程会读写 _acquired_at
+            self._acquired_at = time.perf_counter()
+            LOCK_WAIT.observe(self._acquired_at - start, lock=self.name)
+            PROFILER.add_phase_time("lock_wait", self._acquired_at - start)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        LOCK_HOLD.observe(held, lock=self.name)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def render_metrics():
+    """导出所有指标（Prometheus 文本格式）"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = []
+
+# 上游行情接口
+UPSTREAM_LATENCY = Histogram("upstream_request_seconds", "东方财富行情接口请求耗时", ("call",))
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "东方财富行情接口请求失败次数", ("call",))
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "因限流或熔断未发出的请求次数", ("reason",))
+UPSTREAM_STALE = Counter("upstream_stale_served_total", "上游不可用时返回缓存旧行情的次数", ("call",))
+UPSTREAM_CIRCUIT_OPEN = Gauge("upstream_circuit_open", "行情接口是否处于熔断状态（1为熔断）")
+PRICE_CACHE = Counter("price_cache_total", "最新价缓存命中/未命中次数", ("result",))
+
+# 交易引擎
+MATCH_TICK_LATENCY = Histogram("matching_tick_seconds", "单次挂单撮合耗时")
+ENGINE_TICK_LAG = Histogram("engine_tick_lag_seconds", "撮合轮次相对1秒节拍的延迟")
+PERSIST_LATENCY = Histogram("state_save_seconds", "状态持久化写入耗时")
+SETTLEMENT_LATENCY = Histogram("settlement_seconds", "日终结算耗时")
+ORDER_EVENTS = Counter("order_events_total", "订单事件次数（成交/撤单/过期）", ("event",))
+RISK_REJECTED = Counter("risk_rejected_total", "被风控拒绝的委托次数", ("rule",))
+LOCK_WAIT = Histogram("lock_wait_seconds", "等待获取锁的耗时", ("lock",))
+LOCK_HOLD = Histogram("lock_hold_seconds", "持有锁的耗时", ("lock",))
+
+# HTTP 接口
+API_LATENCY = Histogram("api_request_seconds", "API 请求处理耗时", ("route", "method", "status"))
@@ -0,0 +1,234 @@
+"""慢撮合/慢请求追踪：按阶段统计耗时，可选 cProfile 或栈采样"""
+import os
+import sys
+import json
+import time
+import cProfile
+import datetime
+import threading
+import traceback
+from collections import deque, Counter
+from contextlib import contextmanager
+
+# 支持的采集模式：None（只记录阶段耗时）、cprofile、sample（栈采样）
+PROFILE_MODES = (None, "cprofile", "sample")
+
+
+class _Trace:
+    """一次撮合或请求的追踪记录"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.stack = []  # [[阶段名, 本段开始时间]]
+        self.profile = None
+        self.samples = None
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self.stack:
+            # 暂停父阶段，阶段耗时按独占时间统计
+            parent = self.stack[-1]
+            self.phases[parent[0]] = self.phases.get(parent[0], 0.0) + now - parent[1]
+        self.stack.append([phase, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        phase, started = self.stack.pop()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - started
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def add(self, phase, seconds):
+        """直接记入一段已测得的耗时（如等待锁），并从当前阶段中扣除"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if self.stack:
+            self.stack[-1][1] += seconds
+
+
+class TickProfiler:
+    """慢撮合/慢请求追踪器，默认关闭，可在运行时开启"""
+
+    def __init__(self, directory="data/profiles", threshold=1.0, mode=None,
+                 max_files=50, sample_interval=0.005):
+        self.directory = directory
+        self.threshold = threshold  # 超过该耗时（秒）才记录
+        self.mode = mode
+        self.max_files = max_files  # 采集文件目录中最多保留的追踪数
+        self.sample_interval = sample_interval
+        self.enabled = False
+        self.recent = deque(maxlen=50)  # 最近的慢追踪摘要
+        self._local = threading.local()
+        self._active = {}  # {线程ID: _Trace}，供栈采样线程读取
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, threshold=None, mode=False, max_files=None):
+        """运行时修改配置，返回 (是否成功, 提示信息)"""
+        if mode is not False and mode not in PROFILE_MODES:
+            return False, f"不支持的采集模式: {mode}"
+        if threshold is not None and threshold < 0:
+            return False, "阈值不能为负数"
+        if max_files is not None and max_files < 1:
+            return False, "最多保留的追踪数不能小于1"
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if mode is not False:
+                self.mode = mode
+            if max_files is not None:
+                self.max_files = max_files
+            if enabled is not None:
+                self.enabled = enabled
+            if self.enabled and self.mode == "sample":
+                self._start_sampler()
+        return True, "性能追踪已开启" if self.enabled else "性能追踪已关闭"
+
+    def status(self):
+        """当前配置和最近的慢追踪"""
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'mode': self.mode,
+            'directory': self.directory,
+            'max_files': self.max_files,
+            'recent': list(self.recent)
+        }
+
+    def begin(self, name):
+        """开始追踪（未开启或已有追踪时不做任何事）"""
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        if depth or not self.enabled:
+            return
+        trace = _Trace(name)
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                trace.profile = profile
+            except ValueError:
+                # 同一时间只能有一个 cProfile 在运行，其余追踪只记录阶段耗时
+                pass
+        elif self.mode == "sample":
+            trace.samples = Counter()
+            self._active[threading.get_ident()] = trace
+        self._local.trace = trace
+
+    def end(self):
+        """结束追踪，超过阈值时记录"""
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            return
+        self._local.depth = depth - 1
+        if depth > 1:
+            return
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return
+        self._local.trace = None
+        self._active.pop(threading.get_ident(), None)
+        if trace.profile is not None:
+            trace.profile.disable()
+        total = time.perf_counter() - trace.start
+        if total >= self.threshold:
+            self._record(trace, total)
+
+    @contextmanager
+    def trace(self, name):
+        """追踪上下文：with PROFILER.trace("tick"): ..."""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    @contextmanager
+    def phase(self, name):
+        """阶段上下文，没有进行中的追踪时开销只有一次属性读取"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            yield
+            return
+        trace.enter(name)
+        try:
+            yield
+        finally:
+            trace.exit()
+
+    def add_phase_time(self, name, seconds):
+        """记入一段外部测得的耗时（如等待锁）"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.add(name, seconds)
+
+    def _record(self, trace, total):
+        """保存一次慢追踪"""
+        now = datetime.datetime.now()
+        phases = {k: round(v, 6) for k, v in sorted(trace.phases.items(), key=lambda x: -x[1])}
+        phases['other'] = round(max(0.0, total - sum(trace.phases.values())), 6)
+        summary = {
+            'name': trace.name,
+            'time': now.strftime("%Y-%m-%d %H:%M:%S"),
+            'total': round(total, 6),
+            'phases': phases
+        }
+        self.recent.append(summary)
+        print(f"慢追踪 {trace.name}: {total:.3f}s {phases}")
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            safe_name = "".join(c if c.isalnum() else "_" for c in trace.name).strip("_")
+            base = os.path.join(self.directory, f"{now.strftime('%Y%m%d_%H%M%S_%f')}_{safe_name}")
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            if trace.profile is not None:
+                # 可用 python -m pstats 或 snakeviz 查看
+                trace.profile.dump_stats(base + ".prof")
+            if trace.samples:
+                # 折叠栈格式，可直接用 flamegraph.pl 生成火焰图
+                with open(base + ".folded", "w", encoding="utf-8") as f:
+                    for stack, count in trace.samples.most_common():
+                        f.write(f"{stack} {count}\n")
+            self._rotate()
+        except Exception as e:
+            print(f"保存性能追踪失败: {str(e)}")
+
+    def _rotate(self):
+        """只保留最近 max_files 次追踪的文件"""
+        groups = {}
+        for filename in os.listdir(self.directory):
+            stem = os.path.splitext(filename)[0]
+            groups.setdefault(stem, []).append(filename)
+        for stem in sorted(groups)[:-max(self.max_files, 1)]:
+            for filename in groups[stem]:
+                os.remove(os.path.join(self.directory, filename))
+
+    def _start_sampler(self):
+        """启动栈采样线程（只启动一次，模式切换后自动空转）"""
+        if self._sampler is not None and self._sampler.is_alive():
+            return
+
+        def sample_loop():
+            while self.enabled and self.mode == "sample":
+                time.sleep(self.sample_interval)
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, trace in list(self._active.items()):
+                    frame = frames.get(thread_id)
+                    if frame is None or trace.samples is None:
+                        continue
+                    stack = ";".join(
+                        f"{os.path.basename(f.filename)}:{f.name}"
+                        for f in traceback.extract_stack(frame)
+                    )
+                    trace.samples[stack] += 1
+
+        self._sampler = threading.Thread(target=sample_loop, daemon=True)
+        self._sampler.start()
+
+
+# 全局追踪器
+PROFILER = TickProfiler()
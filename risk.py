@@ -0,0 +1,178 @@
+"""下单前风控：单笔金额、单只股票持仓上限、仓位集中度、每秒下单次数
+
+持仓和挂单敞口按股票增量维护（成交、冻结、解冻时更新），每次检查都是 O(1)，
+不需要遍历持仓批次或挂单。调用方需持有 TradingAPI.lock。
+"""
+import time
+from collections import deque, defaultdict
+
+
+class RiskEngine:
+    """一个账户的风控限额和敞口汇总（限额为 None 或 0 表示不限制）"""
+
+    def __init__(self, max_order_value=None, max_position_quantity=None, max_concentration=None,
+                 max_orders_per_second=None):
+        self.max_order_value = None  # 单笔委托金额上限（元）
+        self.max_position_quantity = None  # 单只股票持仓+买入挂单数量上限（股）
+        self.max_concentration = None  # 单只股票成本+买入挂单金额占总资产比例上限（0~1）
+        self.max_orders_per_second = None  # 每秒最多下单次数
+        self.configure(max_order_value=max_order_value, max_position_quantity=max_position_quantity,
+                       max_concentration=max_concentration, max_orders_per_second=max_orders_per_second)
+
+        # 持仓敞口 {股票代码: 数量/成本金额}
+        self.held_quantity = defaultdict(int)
+        self.held_cost = defaultdict(float)
+        self.total_held_cost = 0.0
+        # 挂单敞口 {股票代码: 数量/金额}，以及 {订单ID: (方向, 股票, 数量, 金额)}
+        self.open_buy_quantity = defaultdict(int)
+        self.open_buy_value = defaultdict(float)
+        self.open_sell_quantity = defaultdict(int)
+        self.open_orders = {}
+        # 最近一秒内的下单时间
+        self._recent = deque()
+
+    def configure(self, **limits):
+        """修改限额，返回 (是否成功, 提示信息)；未传入的限额保持不变"""
+        for name, value in limits.items():
+            if not hasattr(self, name) or not name.startswith("max_"):
+                return False, f"未知的风控限额: {name}"
+            if value is not None and value < 0:
+                return False, f"{name} 不能为负数"
+        for name, value in limits.items():
+            setattr(self, name, value or None)
+        return True, "风控限额已更新"
+
+    def limits(self):
+        return {
+            "max_order_value": self.max_order_value,
+            "max_position_quantity": self.max_position_quantity,
+            "max_concentration": self.max_concentration,
+            "max_orders_per_second": self.max_orders_per_second,
+        }
+
+    # ---- 敞口维护 ----
+
+    def rebuild(self, positions, open_orders):
+        """从持仓和全部挂单重新计算敞口（加载状态、日终结算后调用）"""
+        self.held_quantity.clear()
+        self.held_cost.clear()
+        self.total_held_cost = 0.0
+        for stock, lots in positions.items():
+            self.update_position(stock, lots)
+        self.open_buy_quantity.clear()
+        self.open_buy_value.clear()
+        self.open_sell_quantity.clear()
+        self.open_orders.clear()
+        for order in open_orders:
+            self.order_opened(order)
+
+    def update_position(self, stock, lots):
+        """某只股票的持仓批次变化后更新敞口（成交时调用，只遍历这一只股票的批次）"""
+        quantity = sum(lot[0] for lot in lots)
+        cost = sum(lot[0] * lot[1] for lot in lots)
+        self.total_held_cost += cost - self.held_cost.get(stock, 0.0)
+        if quantity:
+            self.held_quantity[stock] = quantity
+            self.held_cost[stock] = cost
+        else:
+            self.held_quantity.pop(stock, None)
+            self.held_cost.pop(stock, None)
+
+    def order_opened(self, order):
+        """挂单冻结资金或持仓"""
+        order_id = order['order_id']
+        if order_id in self.open_orders:
+            return
+        stock = order['stock']
+        quantity = int(order['quantity'])
+        value = float(order['price']) * quantity
+        self.open_orders[order_id] = (order['type'], stock, quantity, value)
+        if order['type'] == '买入':
+            self.open_buy_quantity[stock] += quantity
+            self.open_buy_value[stock] += value
+        else:
+            self.open_sell_quantity[stock] += quantity
+
+    def order_closed(self, order):
+        """挂单成交、撤销或过期（不是挂单时不做任何事）"""
+        entry = self.open_orders.pop(order['order_id'], None)
+        if entry is None:
+            return
+        order_type, stock, quantity, value = entry
+        if order_type == '买入':
+            self.open_buy_quantity[stock] -= quantity
+            self.open_buy_value[stock] -= value
+            if self.open_buy_quantity[stock] <= 0:
+                del self.open_buy_quantity[stock]
+                del self.open_buy_value[stock]
+        else:
+            self.open_sell_quantity[stock] -= quantity
+            if self.open_sell_quantity[stock] <= 0:
+                del self.open_sell_quantity[stock]
+
+    def position_quantity(self, stock):
+        """当前持仓数量"""
+        return self.held_quantity.get(stock, 0)
+
+    def exposures(self):
+        """各股票敞口（查询用）"""
+        stocks = set(self.held_quantity) | set(self.open_buy_quantity) | set(self.open_sell_quantity)
+        return {
+            stock: {
+                "held_quantity": self.held_quantity.get(stock, 0),
+                "held_cost": round(self.held_cost.get(stock, 0.0), 2),
+                "open_buy_quantity": self.open_buy_quantity.get(stock, 0),
+                "open_buy_value": round(self.open_buy_value.get(stock, 0.0), 2),
+                "open_sell_quantity": self.open_sell_quantity.get(stock, 0),
+            }
+            for stock in sorted(stocks)
+        }
+
+    # ---- 下单前检查 ----
+
+    def check_rate(self, now=None):
+        """检查并计入一次下单（批量下单整批只调用一次），通过返回 None，否则返回 (规则名, 提示信息)"""
+        if not self.max_orders_per_second:
+            return None
+        now = time.monotonic() if now is None else now
+        recent = self._recent
+        while recent and now - recent[0] >= 1.0:
+            recent.popleft()
+        if len(recent) >= self.max_orders_per_second:
+            return "order_rate", f"下单过于频繁（每秒最多 {self.max_orders_per_second} 笔）"
+        recent.append(now)
+        return None
+
+    def check(self, order_type, stock, price, quantity, cash, now=None, count_rate=True):
+        """检查一笔委托，通过返回 None，否则返回 (规则名, 提示信息)
+
+        count_rate 为真时检查下单频率，通过时计入；cash 为账户现金（含冻结部分），与持仓成本一起作为集中度的总资产
+        """
+        now = time.monotonic() if now is None else now
+        value = price * quantity
+
+        if count_rate and self.max_orders_per_second:
+            recent = self._recent
+            while recent and now - recent[0] >= 1.0:
+                recent.popleft()
+            if len(recent) >= self.max_orders_per_second:
+                return "order_rate", f"下单过于频繁（每秒最多 {self.max_orders_per_second} 笔）"
+
+        if self.max_order_value and value > self.max_order_value:
+            return "order_value", f"单笔委托金额 ¥{value:.2f} 超过上限 ¥{self.max_order_value:.2f}"
+
+        if order_type == '买入':
+            if self.max_position_quantity:
+                total = self.held_quantity.get(stock, 0) + self.open_buy_quantity.get(stock, 0) + quantity
+                if total > self.max_position_quantity:
+                    return "position", f"{stock} 持仓及买入挂单将达到 {total} 股，超过上限 {self.max_position_quantity} 股"
+
+            if self.max_concentration:
+                exposure = self.held_cost.get(stock, 0.0) + self.open_buy_value.get(stock, 0.0) + value
+                equity = cash + self.total_held_cost
+                if equity <= 0 or exposure / equity > self.max_concentration:
+                    return "concentration", f"{stock} 仓位将超过总资产的 {self.max_concentration * 100:.0f}%"
+
+        if count_rate and self.max_orders_per_second:
+            self._recent.append(now)
+        return None
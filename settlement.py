@@ -0,0 +1,80 @@
+"""日终结算：合并已交收的持仓批次、生成日结单、按日归档成交记录"""
+import os
+import json
+import gzip
+from common import DATE_FORMAT
+
+
+def merge_settled_lots(lots, settle_day, t_plus):
+    """把下一交易日起可卖出的持仓批次合并为一个批次（按数量加权平均成本）
+
+    lots: [[数量, 成本价, 买入日期]]，按买入日期先后排列
+    返回新的批次列表；合并后的批次日期取被合并批次中最晚的买入日期
+    """
+    settled = [lot for lot in lots if (settle_day - lot[2]).days + 1 >= t_plus and lot[0] > 0]
+    if len(settled) <= 1 and len(settled) == len(lots):
+        return lots
+    unsettled = [lot for lot in lots if (settle_day - lot[2]).days + 1 < t_plus]
+    if not settled:
+        return unsettled
+    quantity = sum(lot[0] for lot in settled)
+    cost = sum(lot[0] * lot[1] for lot in settled) / quantity
+    return [[quantity, cost, max(lot[2] for lot in settled)]] + unsettled
+
+
+def day_key(day):
+    """日期分区名：YYYYMMDD"""
+    return day.strftime("%Y%m%d")
+
+
+def write_statement(directory, statement):
+    """写入日结单 statement_YYYYMMDD.json"""
+    os.makedirs(directory, exist_ok=True)
+    day = statement["date"].replace("-", "")
+    path = os.path.join(directory, f"statement_{day}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(statement, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def read_statement(directory, day):
+    """读取某日的日结单，不存在返回None"""
+    path = os.path.join(directory, f"statement_{day_key(day)}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_statements(directory):
+    """已生成日结单的日期列表（YYYY-MM-DD，从新到旧）"""
+    if not os.path.isdir(directory):
+        return []
+    days = []
+    for filename in os.listdir(directory):
+        if filename.startswith("statement_") and filename.endswith(".json"):
+            day = filename[len("statement_"):-len(".json")]
+            days.append(f"{day[:4]}-{day[4:6]}-{day[6:]}")
+    return sorted(days, reverse=True)
+
+
+def write_archive(directory, day, orders, trades):
+    """把某日已结束的订单和成交记录写入压缩分区 fills_YYYYMMDD.json.gz（重复结算时整体覆盖）"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"fills_{day_key(day)}.json.gz")
+    data = json.dumps({"date": day.strftime(DATE_FORMAT), "orders": orders, "trades": trades},
+                      ensure_ascii=False).encode("utf-8")
+    with gzip.open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def read_archive(directory, day):
+    """读取某日的归档分区 {'date', 'orders', 'trades'}，不存在返回None"""
+    path = os.path.join(directory, f"fills_{day_key(day)}.json.gz")
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rb") as f:
+        return json.loads(f.read().decode("utf-8"))
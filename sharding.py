@@ -0,0 +1,157 @@
+"""按股票代码哈希分片的多进程撮合
+
+每个工作进程维护自己分片内挂单的副本，每轮只接收挂单增量和本分片的行情快照，
+返回成交/撤单意图；资金和持仓的变更仍由 TradingAPI（账本）在锁内统一执行。
+
+工作进程以 `python sharding.py <端口> <分片号>` 的方式独立启动，不会重新导入 app.pyw。
+"""
+import os
+import sys
+import zlib
+import threading
+import subprocess
+from collections import defaultdict
+from multiprocessing.connection import Listener, Client
+
+# 挂单超过该撮合次数仍未成交则自动撤单（与单进程撮合一致）
+MAX_ATTEMPTS = 10
+
+
+def shard_of(stock_code, num_shards):
+    """股票所在分片（crc32 在各进程间稳定，不受哈希随机化影响）"""
+    return zlib.crc32(stock_code.encode()) % num_shards
+
+
+class ShardedMatcher:
+    """撮合分片进程池"""
+
+    def __init__(self, num_workers, timeout=10.0):
+        self.num_workers = num_workers
+        self.timeout = timeout  # 等待工作进程启动的最长时间（秒）
+        self.known = {}  # {order_id: 分片号}，已同步给工作进程的挂单
+        self.conns = [None] * num_workers
+        self.procs = []
+
+        authkey = os.urandom(16)
+        listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        env = dict(os.environ, SHARD_AUTHKEY=authkey.hex())
+
+        def accept_all():
+            for _ in range(num_workers):
+                conn = listener.accept()
+                _, shard = conn.recv()
+                self.conns[shard] = conn
+
+        try:
+            for shard in range(num_workers):
+                self.procs.append(subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), str(listener.address[1]), str(shard)],
+                    env=env
+                ))
+            # Listener.accept 不支持超时，放到线程里等待
+            accept_thread = threading.Thread(target=accept_all, daemon=True)
+            accept_thread.start()
+            accept_thread.join(self.timeout)
+            if any(conn is None for conn in self.conns):
+                raise RuntimeError("撮合工作进程启动超时")
+        except Exception:
+            self.close()
+            raise
+        finally:
+            listener.close()
+
+    def sync(self, pending_ids, order_book):
+        """按集合差计算挂单增量（只有新增挂单需要读取订单内容）"""
+        added = [[] for _ in range(self.num_workers)]
+        removed = [[] for _ in range(self.num_workers)]
+        for order_id in self.known.keys() - pending_ids:
+            removed[self.known.pop(order_id)].append(order_id)
+        for order_id in pending_ids - self.known.keys():
+            order = order_book[order_id]
+            shard = shard_of(order['stock'], self.num_workers)
+            self.known[order_id] = shard
+            added[shard].append((order_id, order['stock'], order['type'], float(order['price']), order['attempts']))
+        return added, removed
+
+    def match(self, pending_ids, order_book, prices):
+        """撮合一轮，返回 [(意图, order_id, 撮合次数)]，意图为 fill 或 cancel
+
+        pending_ids: 当前全部挂单ID的集合
+        prices: {股票代码: 最新价}，获取失败的股票为0
+        """
+        added, removed = self.sync(pending_ids, order_book)
+        shard_prices = [{} for _ in range(self.num_workers)]
+        for stock_code, price in prices.items():
+            shard_prices[shard_of(stock_code, self.num_workers)][stock_code] = price
+
+        # 先全部发出再统一接收，各分片并行撮合
+        for shard, conn in enumerate(self.conns):
+            conn.send(("match", added[shard], removed[shard], shard_prices[shard]))
+        intents = []
+        for conn in self.conns:
+            intents.extend(conn.recv())
+        return intents
+
+    def close(self):
+        """停止所有工作进程"""
+        for conn in self.conns:
+            if conn is None:
+                continue
+            try:
+                conn.send(("stop",))
+                conn.close()
+            except Exception:
+                pass
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def _match_shard(book, by_stock, prices):
+    """撮合本分片的所有挂单，逻辑与 TradingAPI 单进程撮合一致"""
+    intents = []
+    for stock_code, order_ids in by_stock.items():
+        current_price = prices.get(stock_code) or 0
+        for order_id in order_ids:
+            order = book[order_id]
+            order_type, price = order[1], order[2]
+            order[3] += 1
+            if current_price > 0 and (
+                    (order_type == "买入" and current_price <= price) or
+                    (order_type == "卖出" and current_price >= price)):
+                intents.append(("fill", order_id, order[3]))
+            elif order[3] > MAX_ATTEMPTS:
+                intents.append(("cancel", order_id, order[3]))
+    return intents
+
+
+def _worker_main(port, shard):
+    """工作进程主循环"""
+    conn = Client(("127.0.0.1", port), authkey=bytes.fromhex(os.environ["SHARD_AUTHKEY"]))
+    conn.send(("hello", shard))
+    book = {}  # {order_id: [股票代码, 订单类型, 委托价, 撮合次数]}
+    by_stock = defaultdict(list)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message[0] == "stop":
+            break
+        _, added, removed, prices = message
+        for order_id in removed:
+            order = book.pop(order_id, None)
+            if order is not None:
+                by_stock[order[0]].remove(order_id)
+                if not by_stock[order[0]]:
+                    del by_stock[order[0]]
+        for order_id, stock_code, order_type, price, attempts in added:
+            book[order_id] = [stock_code, order_type, float(price), int(attempts)]
+            by_stock[stock_code].append(order_id)
+        conn.send(_match_shard(book, by_stock, prices))
+
+
+if __name__ == "__main__":
+    _worker_main(int(sys.argv[1]), int(sys.argv[2]))
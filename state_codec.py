@@ -0,0 +1,411 @@
+"""交易状态的二进制存储格式
+
+按固定结构分段存储，订单和成交记录按列存放（数值列为 array，低基数字符串列做字典编码），
+读取时不会执行任何代码。格式带版本号和校验和，升级格式时在 decode_state 中兼容旧版本。
+
+文件布局：
+    头部   MAGIC(4s) 版本(H) 正文长度(I) 正文crc32(I)，正文依次为
+    实时段 标量、持仓、冻结持仓、挂单队列、挂单订单、绩效汇总（启动时只需解码这一段）
+    历史段 全部订单、成交记录（整段带长度前缀，可以延迟到首次访问时再解码）
+"""
+import gc
+import io
+import json
+import zlib
+import pickle
+import struct
+import datetime
+from array import array
+from itertools import repeat
+
+MAGIC = b"TRST"
+# 版本2：实时段与历史段分开；版本3：订单增加 frozen 列（挂单冻结的资金（分）或股数）；
+# 版本4：实时段增加绩效汇总（JSON）
+VERSION = 4
+
+HEADER = struct.Struct("<4sHII")
+# 现金、冻结资金、初始资金、今日盈亏、T+N、最后交易日（date.toordinal）
+SCALARS = struct.Struct("<ddddii")
+_LENGTH = struct.Struct("<I")
+
+# 列类型：s 字符串，c 低基数字符串（字典编码），d 浮点数，q 整数
+ORDER_SCHEMA = (
+    ("order_id", "s"), ("type", "c"), ("stock", "c"), ("price", "d"), ("quantity", "q"),
+    ("status", "c"), ("created_at", "s"), ("updated_at", "s"), ("attempts", "q"), ("expiry", "s"),
+    ("frozen", "q"),
+)
+ORDER_SCHEMA_V2 = ORDER_SCHEMA[:-1]
+TRADE_SCHEMA = (
+    ("order_id", "s"), ("type", "c"), ("stock", "c"), ("price", "d"), ("quantity", "q"),
+    ("amount", "d"), ("commission", "d"), ("profit", "d"), ("datetime", "s"),
+)
+
+# 记录中缺少的列名保存在附加字段的这个键下
+_MISSING = "\x00missing"
+_SEP = "\x00"
+
+
+class StateFormatError(ValueError):
+    """状态文件损坏或格式不受支持"""
+
+
+def _fits(column_type, value):
+    """值能否直接放入该类型的列"""
+    if column_type in ("s", "c"):
+        return isinstance(value, str)
+    if column_type == "q":
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _pack_blob(out, data):
+    out.write(_LENGTH.pack(len(data)))
+    out.write(data)
+
+
+def _unpack_blob(view, offset):
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    if offset + length > len(view):
+        raise StateFormatError("状态文件被截断")
+    return view[offset:offset + length], offset + length
+
+
+def _pack_strings(out, values):
+    _pack_blob(out, _SEP.join(values).encode("utf-8"))
+
+
+def _unpack_strings(view, offset, count):
+    data, offset = _unpack_blob(view, offset)
+    if not count:
+        return [], offset
+    values = bytes(data).decode("utf-8").split(_SEP)
+    if len(values) != count:
+        raise StateFormatError("字符串列长度不一致")
+    return values, offset
+
+
+def _pack_array(out, typecode, values):
+    _pack_blob(out, array(typecode, values).tobytes())
+
+
+def _unpack_array(view, offset, typecode, count):
+    data, offset = _unpack_blob(view, offset)
+    values = array(typecode)
+    values.frombytes(data)
+    if len(values) != count:
+        raise StateFormatError("数值列长度不一致")
+    return values.tolist(), offset
+
+
+def _record_builder(schema, defaults=None):
+    """生成把各列的值组装为记录字典列表的函数（逐行在C层 dict(zip()) 构造，不经过Python函数调用）
+
+    defaults: 旧版本文件中没有的列及其默认值
+    """
+    names = tuple(name for name, _ in schema)
+    defaults = dict(defaults or {})
+
+    def build(columns):
+        records = list(map(dict, map(zip, repeat(names), zip(*columns))))
+        if defaults:
+            for record in records:
+                record.update(defaults)
+        return records
+    return build
+
+
+def _pack_column(out, column_type, values):
+    """写入一列，类型不符时抛出 TypeError"""
+    if column_type == "s":
+        _pack_strings(out, values)
+    elif column_type == "c":
+        categories = list(dict.fromkeys(values))
+        index = {value: i for i, value in enumerate(categories)}
+        out.write(_LENGTH.pack(len(categories)))
+        _pack_strings(out, categories)
+        _pack_array(out, "I", [index[value] for value in values])
+    else:
+        _pack_array(out, column_type, values)
+
+
+def _pack_table(out, schema, records):
+    """按列写入一组字典记录"""
+    out.write(_LENGTH.pack(len(records)))
+    body = io.BytesIO()
+    try:
+        # 常见情况：所有记录的键与列定义一致，整列一次写入
+        if any(len(record) != len(schema) for record in records):
+            raise TypeError
+        for name, column_type in schema:
+            _pack_column(body, column_type, [record.get(name) for record in records])
+        _pack_strings(body, [""] * len(records))
+    except TypeError:
+        body = io.BytesIO()
+        _pack_table_slow(body, schema, records)
+    out.write(body.getvalue())
+
+
+def _pack_table_slow(out, schema, records):
+    """逐条检查记录，不符合列类型的值和多出的键放入每行的附加JSON"""
+    extras = [""] * len(records)
+    columns = {name: [] for name, _ in schema}
+    names = {name for name, _ in schema}
+    defaults = {"s": "", "c": "", "q": 0, "d": 0.0}
+    for row, record in enumerate(records):
+        extra = None
+        for name, column_type in schema:
+            value = record.get(name)
+            if not _fits(column_type, value):
+                extra = extra or {}
+                if name in record:
+                    extra[name] = value
+                else:
+                    extra.setdefault(_MISSING, []).append(name)
+                value = defaults[column_type]
+            columns[name].append(value)
+        if len(record) > len(names) or extra is not None:
+            for key, value in record.items():
+                if key not in names:
+                    extra = extra or {}
+                    extra[key] = value
+        if extra is not None:
+            extras[row] = json.dumps(extra, ensure_ascii=False)
+
+    for name, column_type in schema:
+        _pack_column(out, column_type, columns[name])
+    _pack_strings(out, extras)
+
+
+def _unpack_table(view, offset, schema, build):
+    (count,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    columns = []
+    for _, column_type in schema:
+        if column_type == "s":
+            values, offset = _unpack_strings(view, offset, count)
+        elif column_type == "c":
+            (num_categories,) = _LENGTH.unpack_from(view, offset)
+            categories, offset = _unpack_strings(view, offset + _LENGTH.size, num_categories)
+            codes, offset = _unpack_array(view, offset, "I", count)
+            values = list(map(categories.__getitem__, codes))
+        else:
+            values, offset = _unpack_array(view, offset, column_type, count)
+        columns.append(values)
+    # 附加字段很少，全部为空时（只有分隔符）跳过逐行处理
+    data, offset = _unpack_blob(view, offset)
+    records = build(columns)
+    if data.nbytes > count - 1:
+        for record, extra in zip(records, bytes(data).decode("utf-8").split(_SEP)):
+            if extra:
+                extra = json.loads(extra)
+                for name in extra.pop(_MISSING, ()):
+                    del record[name]
+                record.update(extra)
+    return records, columns[0], offset
+
+
+def encode_state(state):
+    """把 TradingAPI.save_state 的状态字典编码为字节串
+
+    历史尚未加载时 state 中带 history_segment（decode_state 返回的原始历史段）和 trade_summary：
+    历史段原样写回，order_book 中的订单（加载时的挂单，可能已过期）全部写入实时段，再次加载时覆盖历史段中的旧值。
+    """
+    history_segment = state.get("history_segment")
+    out = io.BytesIO()
+    out.write(SCALARS.pack(
+        float(state["cash"]), float(state["frozen_cash"]), float(state["initial_cash"]),
+        float(state["today_profit"]), int(state["t_plus"]), state["last_trading_day"].toordinal()
+    ))
+
+    # 持仓：股票代码、每只股票的批次数，以及所有批次的数量/成本/买入日期
+    positions = state["positions"]
+    codes = list(positions)
+    lots = [lot for code in codes for lot in positions[code]]
+    out.write(_LENGTH.pack(len(codes)))
+    _pack_strings(out, codes)
+    _pack_array(out, "I", [len(positions[code]) for code in codes])
+    _pack_array(out, "q", [int(lot[0]) for lot in lots])
+    _pack_array(out, "d", [float(lot[1]) for lot in lots])
+    _pack_array(out, "i", [lot[2].toordinal() for lot in lots])
+
+    frozen_positions = state["frozen_positions"]
+    out.write(_LENGTH.pack(len(frozen_positions)))
+    _pack_strings(out, list(frozen_positions))
+    _pack_array(out, "q", list(frozen_positions.values()))
+
+    pending_orders = state["pending_orders"]
+    out.write(_LENGTH.pack(len(pending_orders)))
+    _pack_strings(out, pending_orders)
+
+    # 挂单在实时段中另存一份，启动时不必解码全部历史订单
+    order_book = state["order_book"]
+    if history_segment is None:
+        open_orders = [order_book[order_id] for order_id in dict.fromkeys(pending_orders) if order_id in order_book]
+    else:
+        open_orders = list(order_book.values())
+    _pack_table(out, ORDER_SCHEMA, open_orders)
+    # 成交笔数和最近一笔成交，历史未加载时也能生成投资组合报告
+    if history_segment is None:
+        trade_history = state["trade_history"]
+        trade_count, last_trade = len(trade_history), trade_history[-1:]
+    else:
+        trade_count, last = state["trade_summary"]
+        last_trade = [last] if last else []
+    out.write(_LENGTH.pack(trade_count))
+    _pack_table(out, TRADE_SCHEMA, last_trade)
+    # 绩效汇总（analytics.PerformanceAnalytics.to_dict()），只有几十个数值和各股票的计数器
+    _pack_blob(out, json.dumps(state.get("analytics"), separators=(",", ":")).encode("utf-8"))
+
+    # 历史段：全部订单（保持原有顺序）和成交记录，带长度前缀以便整段跳过
+    if history_segment is None:
+        history = io.BytesIO()
+        _pack_table(history, ORDER_SCHEMA, list(order_book.values()))
+        _pack_table(history, TRADE_SCHEMA, trade_history)
+        history_segment = history.getvalue()
+    _pack_blob(out, history_segment)
+
+    body = out.getvalue()
+    return HEADER.pack(MAGIC, VERSION, len(body), zlib.crc32(body)) + body
+
+
+def _without_gc(func):
+    """一次性创建大量字典时暂停循环垃圾回收"""
+    def wrapper(*args, **kwargs):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    return wrapper
+
+
+@_without_gc
+def decode_state(data, lazy_history=False):
+    """解码 encode_state 生成的字节串
+
+    lazy_history 为True时只解码实时部分（资金、持仓、挂单），order_book 中只有挂单，
+    trade_history 为空，另外返回 trade_summary (成交笔数, 最近一笔成交)、
+    history_loader：调用后得到 (完整订单簿, 成交记录)，其中挂单沿用实时部分中的同一个字典对象，
+    以及 history_segment：未解码的历史段（版本3起与当前格式相同，可以原样传给 encode_state，其余为None）。
+    """
+    if len(data) < HEADER.size:
+        raise StateFormatError("状态文件不完整")
+    magic, version, length, checksum = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise StateFormatError("不是交易状态文件")
+    if version not in (1, 2, 3, VERSION):
+        raise StateFormatError(f"不支持的状态文件版本: {version}")
+    view = memoryview(data)[HEADER.size:]
+    if len(view) != length or zlib.crc32(view) != checksum:
+        raise StateFormatError("状态文件校验失败")
+
+    cash, frozen_cash, initial_cash, today_profit, t_plus, last_day = SCALARS.unpack_from(view, 0)
+    offset = SCALARS.size
+
+    (num_codes,) = _LENGTH.unpack_from(view, offset)
+    codes, offset = _unpack_strings(view, offset + _LENGTH.size, num_codes)
+    counts, offset = _unpack_array(view, offset, "I", num_codes)
+    num_lots = sum(counts)
+    quantities, offset = _unpack_array(view, offset, "q", num_lots)
+    costs, offset = _unpack_array(view, offset, "d", num_lots)
+    buy_days, offset = _unpack_array(view, offset, "i", num_lots)
+    positions = {}
+    start = 0
+    for code, count in zip(codes, counts):
+        positions[code] = [
+            [quantities[i], costs[i], datetime.date.fromordinal(buy_days[i])]
+            for i in range(start, start + count)
+        ]
+        start += count
+
+    (num_frozen,) = _LENGTH.unpack_from(view, offset)
+    frozen_codes, offset = _unpack_strings(view, offset + _LENGTH.size, num_frozen)
+    frozen_quantities, offset = _unpack_array(view, offset, "q", num_frozen)
+
+    (num_pending,) = _LENGTH.unpack_from(view, offset)
+    pending_orders, offset = _unpack_strings(view, offset + _LENGTH.size, num_pending)
+
+    state = {
+        "cash": cash,
+        "positions": positions,
+        "frozen_positions": dict(zip(frozen_codes, frozen_quantities)),
+        "frozen_cash": frozen_cash,
+        "t_plus": t_plus,
+        "pending_orders": pending_orders,
+        "initial_cash": initial_cash,
+        "today_profit": today_profit,
+        "last_trading_day": datetime.date.fromordinal(last_day),
+    }
+
+    if version >= 3:
+        order_schema, build_order = ORDER_SCHEMA, _BUILD_ORDER
+    else:
+        order_schema, build_order = ORDER_SCHEMA_V2, _BUILD_ORDER_V2
+
+    if version == 1:
+        # 版本1没有单独的挂单段，只能整体解码
+        orders, order_ids, offset = _unpack_table(view, offset, order_schema, build_order)
+        trade_history, _, offset = _unpack_table(view, offset, TRADE_SCHEMA, _BUILD_TRADE)
+        state["order_book"] = dict(zip(order_ids, orders))
+        state["trade_history"] = trade_history
+        if lazy_history:
+            state["history_loader"] = None
+            state["trade_summary"] = (len(trade_history), trade_history[-1] if trade_history else None)
+        return state
+
+    open_orders, open_ids, offset = _unpack_table(view, offset, order_schema, build_order)
+    open_book = dict(zip(open_ids, open_orders))
+    (trade_count,) = _LENGTH.unpack_from(view, offset)
+    last_trade, _, offset = _unpack_table(view, offset + _LENGTH.size, TRADE_SCHEMA, _BUILD_TRADE)
+    if version >= 4:
+        analytics, offset = _unpack_blob(view, offset)
+        state["analytics"] = json.loads(bytes(analytics).decode("utf-8"))
+    history, offset = _unpack_blob(view, offset)
+
+    @_without_gc
+    def load_history():
+        orders, order_ids, history_offset = _unpack_table(history, 0, order_schema, build_order)
+        trade_history, _, _ = _unpack_table(history, history_offset, TRADE_SCHEMA, _BUILD_TRADE)
+        order_book = dict(zip(order_ids, orders))
+        # 挂单替换为实时部分的对象（键已存在，顺序不变）
+        order_book.update(open_book)
+        return order_book, trade_history
+
+    if lazy_history:
+        state["order_book"] = open_book
+        state["trade_history"] = []
+        state["history_loader"] = load_history
+        state["history_segment"] = history if version >= 3 else None
+        state["trade_summary"] = (trade_count, last_trade[0] if last_trade else None)
+    else:
+        state["order_book"], state["trade_history"] = load_history()
+    return state
+
+
+_BUILD_ORDER = _record_builder(ORDER_SCHEMA)
+# 旧版本的订单没有 frozen 列：已结束的订单为0，挂单在加载后按订单内容重新计算
+_BUILD_ORDER_V2 = _record_builder(ORDER_SCHEMA_V2, {"frozen": 0})
+_BUILD_TRADE = _record_builder(TRADE_SCHEMA)
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """只允许旧版状态文件中出现的类型，拒绝其他任何全局对象"""
+
+    ALLOWED = {
+        ("collections", "defaultdict"), ("collections", "deque"),
+        ("datetime", "date"), ("datetime", "datetime"),
+        ("builtins", "list"), ("builtins", "int"), ("builtins", "float"),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise StateFormatError(f"旧版状态文件包含不允许的类型: {module}.{name}")
+        return super().find_class(module, name)
+
+
+def load_legacy_pickle(f):
+    """读取旧版pickle状态文件（受限反序列化，仅用于迁移）"""
+    return _LegacyUnpickler(f).load()
@@ -11,6 +11,19 @@ let currentPositionPage = 1;
 const positionsPerPage = 100;
 let currentHistoryPage = 1;
 const historyPerPage = 100;
+// 订单和历史由服务端分页：cursors[i] 为第 i+1 页的游标，第1页为 null
+let orderCursors = [null];
+let historyCursors = [null];
+// 表格用到的字段（只请求这些字段）
+const ORDER_FIELDS = 'order_id,type,stock,price,quantity,status,created_at';
+const HISTORY_FIELDS = 'datetime,type,stock,price,quantity,amount,profit';
+const STATUS_KEYWORDS = {
+    'pending': 'pending', '挂单': 'pending', '未成交': 'pending',
+    'filled': 'filled', '成交': 'filled', '已成交': 'filled',
+    'canceled': 'canceled', '撤单': 'canceled', '已撤单': 'canceled',
+    'expired': 'expired', '过期': 'expired', '已过期': 'expired'
+};
+const SIDE_KEYWORDS = {'buy': 'buy', '买入': 'buy', 'sell': 'sell', '卖出': 'sell'};
 
 // DOM加载完成后执行
 document.addEventListener('DOMContentLoaded', function() {
@@ -62,19 +75,23 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
     document.getElementById('next-page').addEventListener('click', function() {
-        currentPage++;
-        updateOrders();
+        if (orderCursors[currentPage]) {
+            currentPage++;
+            updateOrders();
+        }
     });
     
     // 订单搜索
     document.getElementById('search-orders').addEventListener('click', function() {
         currentPage = 1;
+        orderCursors = [null];
         updateOrders();
     });
     
     document.getElementById('order-search').addEventListener('keypress', function(e) {
         if (e.key === 'Enter') {
             currentPage = 1;
+            orderCursors = [null];
             updateOrders();
         }
     });
@@ -114,19 +131,23 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
     document.getElementById('history-next').addEventListener('click', function() {
-        currentHistoryPage++;
-        updateHistory();
+        if (historyCursors[currentHistoryPage]) {
+            currentHistoryPage++;
+            updateHistory();
+        }
     });
     
     // 历史搜索
     document.getElementById('search-history').addEventListener('click', function() {
         currentHistoryPage = 1;
+        historyCursors = [null];
         updateHistory();
     });
     
     document.getElementById('history-search').addEventListener('keypress', function(e) {
         if (e.key === 'Enter') {
             currentHistoryPage = 1;
+            historyCursors = [null];
             updateHistory();
         }
     });
@@ -559,40 +580,48 @@ function updatePortfolio() {
         });
 }
 
+// 把搜索框内容转换为分页查询参数：股票代码、状态、买卖方向、日期（空格分隔，可组合）
+// allowStatus 为 true 时（订单列表）还可以按状态和订单号（或前缀，如表格中显示的前8位）搜索
+function buildQuery(searchTerm, fields, limit, cursor, allowStatus) {
+    const params = new URLSearchParams({fields: fields, limit: limit});
+    searchTerm.split(/\s+/).filter(term => term).forEach(term => {
+        if (allowStatus && STATUS_KEYWORDS[term]) {
+            params.set('status', STATUS_KEYWORDS[term]);
+        } else if (SIDE_KEYWORDS[term]) {
+            params.set('side', SIDE_KEYWORDS[term]);
+        } else if (/^\d{4}-\d{2}-\d{2}$/.test(term)) {
+            params.set('start', term);
+            params.set('end', term);
+        } else if (allowStatus && !/^(sh|sz|bj)?\d{6}$/.test(term)) {
+            params.set('order_id', term.replace(/\.+$/, ''));
+        } else {
+            params.set('stock', term);
+        }
+    });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    return params.toString();
+}
+
 // 更新订单
 function updateOrders() {
     const searchTerm = document.getElementById('order-search').value.toLowerCase();
+    const query = buildQuery(searchTerm, ORDER_FIELDS, ordersPerPage, orderCursors[currentPage - 1], true);
     
-    fetch('/api/orders')
+    fetch(`/api/orders?${query}`)
         .then(response => response.json())
         .then(data => {
-            ordersData = data;
-            
-            // 应用搜索过滤
-            let filteredOrders = ordersData;
-            if (searchTerm) {
-                filteredOrders = ordersData.filter(order => 
-                    order.order_id.toLowerCase().includes(searchTerm) ||
-                    order.stock.toLowerCase().includes(searchTerm) ||
-                    order.type.includes(searchTerm) ||
-                    order.status.toLowerCase().includes(searchTerm)
-                );
+            if (!data.results) {
+                throw new Error(data.message);
             }
+            ordersData = data.results;
+            orderCursors[currentPage] = data.next_cursor;
             
-            // 计算分页
-            const totalPages = Math.ceil(filteredOrders.length / ordersPerPage);
-            if (currentPage > totalPages && totalPages > 0) {
-                currentPage = totalPages;
-            }
-            
-            // 更新分页信息
-            document.getElementById('page-info').textContent = 
-                `第${Math.max(1, currentPage)}页/共${Math.max(1, totalPages)}页`;
+            // 更新分页信息（服务端从新到旧分页）
+            document.getElementById('page-info').textContent = `第${currentPage}页`;
             
-            // 获取当前页数据
-            const startIndex = (currentPage - 1) * ordersPerPage;
-            const endIndex = Math.min(startIndex + ordersPerPage, filteredOrders.length);
-            const pageOrders = filteredOrders.slice(startIndex, endIndex);
+            const pageOrders = ordersData;
             
             // 渲染订单表格
             const ordersBody = document.getElementById('orders-body');
@@ -645,7 +674,7 @@ function updateOrders() {
             
             // 更新分页按钮状态
             document.getElementById('prev-page').disabled = currentPage <= 1;
-            document.getElementById('next-page').disabled = currentPage >= totalPages;
+            document.getElementById('next-page').disabled = !data.next_cursor;
         })
         .catch(error => {
             console.error('获取订单失败:', error);
@@ -682,37 +711,21 @@ function cancelOrder(orderId) {
 // 更新交易历史
 function updateHistory() {
     const searchTerm = document.getElementById('history-search').value.toLowerCase();
+    const query = buildQuery(searchTerm, HISTORY_FIELDS, historyPerPage, historyCursors[currentHistoryPage - 1], false);
     
-    fetch('/api/history')
+    fetch(`/api/history?${query}`)
         .then(response => response.json())
         .then(data => {
-            historyData = data;
-            
-            // 应用搜索过滤
-            let filteredHistory = historyData;
-            if (searchTerm) {
-                filteredHistory = historyData.filter(trade => 
-                    trade.stock.toLowerCase().includes(searchTerm) ||
-                    trade.type.includes(searchTerm) ||
-                    trade.datetime.toLowerCase().includes(searchTerm) ||
-                    (trade.profit && trade.profit.toString().includes(searchTerm))
-                );
-            }
-            
-            // 计算分页
-            const totalPages = Math.ceil(filteredHistory.length / historyPerPage);
-            if (currentHistoryPage > totalPages && totalPages > 0) {
-                currentHistoryPage = totalPages;
+            if (!data.results) {
+                throw new Error(data.message);
             }
+            historyData = data.results;
+            historyCursors[currentHistoryPage] = data.next_cursor;
             
-            // 更新分页信息
-            document.getElementById('history-page-info').textContent = 
-                `第${Math.max(1, currentHistoryPage)}页/共${Math.max(1, totalPages)}页`;
+            // 更新分页信息（服务端从新到旧分页）
+            document.getElementById('history-page-info').textContent = `第${currentHistoryPage}页`;
             
-            // 获取当前页数据
-            const startIndex = (currentHistoryPage - 1) * historyPerPage;
-            const endIndex = Math.min(startIndex + historyPerPage, filteredHistory.length);
-            const pageHistory = filteredHistory.slice(startIndex, endIndex);
+            const pageHistory = historyData;
             
             // 渲染历史表格
             const historyBody = document.getElementById('history-body');
@@ -749,7 +762,7 @@ function updateHistory() {
             
             // 更新分页按钮状态
             document.getElementById('history-prev').disabled = currentHistoryPage <= 1;
-            document.getElementById('history-next').disabled = currentHistoryPage >= totalPages;
+            document.getElementById('history-next').disabled = !data.next_cursor;
         })
         .catch(error => {
             console.error('获取交易历史失败:', error);
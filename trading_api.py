@@ -1,6 +1,5 @@
 import os
 import json
-import pickle
 import uuid
 import random
 import time
@@ -9,17 +8,45 @@ import threading
 from collections import deque, defaultdict
 from common import (
     DATE_FORMAT, DATETIME_FORMAT, 
-    is_trading_day, get_trading_phase, 
-    calculate_commission, TRADING_RULES
+    get_trading_phase, 
+    next_trading_day, last_closed_trading_day,
+    TRADING_RULES
 )
-from crawler import StockDataCrawler
+from data_source import LiveDataSource
+from metrics import (
+    InstrumentedLock, MATCH_TICK_LATENCY, PERSIST_LATENCY, SETTLEMENT_LATENCY, RISK_REJECTED,
+    ORDER_EVENTS, PRICE_CACHE
+)
+from profiler import PROFILER
+from upstream import UPSTREAM, PRIORITY_ENGINE
+from equity_store import EquityStore
+from analytics import PerformanceAnalytics
+from state_codec import encode_state, decode_state, load_legacy_pickle
+from settlement import (
+    merge_settled_lots, write_statement, write_archive,
+    read_statement, list_statements
+)
+from risk import RiskEngine
+from fees import FeeSchedule, to_fen, allocate
+from ledger_index import OrderIndex, TradeIndex, parse_list
 
 class TradingAPI:
-    def __init__(self, initial_cash=100000.0, t_plus=1, data_source=None, filename="data/trading.pkl"):
+    def __init__(self, initial_cash=100000.0, t_plus=1, data_source=None, filename="data/trading.dat",
+                 match_workers=0, lazy_history=True, risk=None, fees=None):
+        # 历史订单和成交记录延迟加载（见 order_book / trade_history 属性）
+        self.lazy_history = lazy_history
+        self._history_loader = None
+        self._history_segment = None  # 历史未加载时状态文件中未解码的历史段，保存时原样写回
+        self._trade_summary = (0, None)  # 历史未加载时的 (成交笔数, 最近一笔成交)
+        self._equity_loaded = True
+        self._history_lock = threading.Lock()
+        # 订单按状态/股票、成交记录按股票的二级索引（order_book / trade_history 替换时重建）
+        self.order_index = OrderIndex()
+        self.trade_index = TradeIndex()
         self.cash = initial_cash
         self.positions = defaultdict(list)  # {股票代码: [[数量, 成本价, 买入日期]]}
         self.frozen_positions = defaultdict(int)  # 冻结的持仓 {股票代码: 冻结数量}
-        self.frozen_cash = 0.0  # 冻结的资金
+        self.frozen_cash = 0.0  # 冻结的资金（内部以整数分保存，见 frozen_cash 属性）
         self.t_plus = t_plus
         self.trade_history = []  # 已完成交易记录
         self.pending_orders = deque()  # 挂单队列
@@ -27,11 +54,30 @@ class TradingAPI:
         self.initial_cash = initial_cash
         self.today_profit = 0.0
         self.filename = filename
-        self.last_trading_day = datetime.datetime.now().date()
-        self.data_source = data_source
-        self.equity_history = []
+        self.last_trading_day = datetime.datetime.now().date()  # 尚未日终结算的最早交易日
+        # 日终结算：日结单和按日归档的成交记录，实时状态只保留最近 history_days 天的已结束订单
+        data_dir = os.path.dirname(filename)
+        self.statement_dir = os.path.join(data_dir, "statements")
+        self.archive_dir = os.path.join(data_dir, "archive")
+        self.history_days = 30
+        self.settlement_retry_at = 0.0
+        self.data_source = data_source or LiveDataSource()  # 行情数据源（实时/录制/回放）
+        self.risk = risk or RiskEngine()  # 下单前风控（增量维护的持仓/挂单敞口）
+        self.fees = fees or FeeSchedule()  # 费率表（按分计算佣金、印花税、过户费）
+        self.analytics = PerformanceAnalytics(initial_cash)  # 绩效汇总（成交和资金快照时增量更新）
+        # 资金曲线（多分辨率时间序列，单独保存为紧凑二进制文件）
+        self.equity_store = EquityStore(os.path.splitext(filename)[0] + "_equity.bin")
+        self.equity_interval = 60  # 交易时段内定时记录资金快照的间隔（秒）
+        self.last_equity_snapshot = 0.0
+        self.equity_dirty = False
         self.stock_prices = {}  # 股票当前价格缓存
-        self.lock = threading.Lock()  # 线程锁
+        self.lock = InstrumentedLock("trading_api")  # 线程锁（统计等待/持有时间）
+        self.state_version = 0  # 每次保存状态加1，多节点部署时用于判断快照是否需要更新
+        # 撮合工作进程数，为0时在本进程内撮合
+        self.matcher = None
+        if match_workers > 0:
+            from sharding import ShardedMatcher
+            self.matcher = ShardedMatcher(match_workers)
         self.last_save_time = datetime.datetime.now()
         
         # 确保数据目录存在
@@ -43,13 +89,76 @@ class TradingAPI:
         # 启动自动保存线程
         self.start_auto_save()
 
+    @property
+    def frozen_cash(self):
+        """冻结的资金（元），内部以整数分累计，反复冻结/解冻不会产生浮点误差"""
+        return self._frozen_fen / 100
+    
+    @frozen_cash.setter
+    def frozen_cash(self, value):
+        self._frozen_fen = to_fen(value)
+    
+    @property
+    def order_book(self):
+        """订单簿 {order_id: order}，首次访问时加载历史订单"""
+        if self._history_loader is not None:
+            self._load_history()
+        return self._order_book
+    
+    @order_book.setter
+    def order_book(self, value):
+        self._order_book = value
+        self.order_index.rebuild(value.values())
+    
+    @property
+    def trade_history(self):
+        """已完成交易记录，首次访问时加载"""
+        if self._history_loader is not None:
+            self._load_history()
+        return self._trade_history
+    
+    @trade_history.setter
+    def trade_history(self, value):
+        self._trade_history = value
+        self.trade_index.rebuild(value)
+    
+    def _load_history(self):
+        """解码状态文件中的历史段（启动时只加载了资金、持仓和挂单）"""
+        with self._history_lock:
+            if self._history_loader is None:
+                return
+            # 失败时保留 loader 并抛出异常，避免只含挂单的订单簿被保存覆盖历史
+            self._order_book, self._trade_history = self._history_loader()
+            self._history_loader = None
+            self._history_segment = None
+            self.order_index.rebuild(self._order_book.values())
+            self.trade_index.rebuild(self._trade_history)
+    
+    def get_trade_summary(self):
+        """成交笔数和最近一笔成交（历史未加载时使用状态文件中的摘要，不触发加载）"""
+        if self._history_loader is not None:
+            return self._trade_summary
+        trade_history = self._trade_history
+        return len(trade_history), (trade_history[-1] if trade_history else None)
+    
+    def _ensure_equity_loaded(self):
+        """首次使用资金曲线时才读取文件"""
+        if self._equity_loaded:
+            return
+        with self._history_lock:
+            if not self._equity_loaded:
+                self.load_equity_store()
+                self._equity_loaded = True
+    
     def start_auto_save(self):
         """启动自动保存线程"""
         def auto_save_loop():
             while True:
                 # 每10秒检查一次是否需要保存
                 threading.Event().wait(1)
+                self.check_daily_roll()
                 self.auto_save()
+                self.snapshot_equity()
         
         save_thread = threading.Thread(target=auto_save_loop, daemon=True)
         save_thread.start()
@@ -61,6 +170,7 @@ class TradingAPI:
             now = datetime.datetime.now()
             if (now - self.last_save_time).total_seconds() > 30:
                 self.save_state()
+                self.save_equity_store()
                 self.last_save_time = now
 
     def get_trading_phase(self, dt):
@@ -74,10 +184,7 @@ class TradingAPI:
     
     def can_cancel_order(self, dt):
         """检查当前时间是否允许撤单"""
-        # 在非交易时段或集合竞价时段不允许撤单
-        if not is_trading_day(dt):
-            return False
-        
+        # 在非交易时段（非交易日的阶段为 non_trading）或集合竞价时段不允许撤单
         phase = get_trading_phase(dt)
         return TRADING_RULES.get(phase, {}).get("can_cancel", False)
     
@@ -86,38 +193,52 @@ class TradingAPI:
         phase = get_trading_phase(dt)
         return phase not in ["non_trading", "closed"]
     
-    def can_sell(self, stock_code, trade_date):
+    def can_sell(self, stock_code, trade_date, quantity=None):
         """检查是否可以卖出（T+X规则）"""
-        if stock_code not in self.positions:
-            return False
+        sellable = self.get_sellable_quantity(stock_code, trade_date)
+        if quantity is None:
+            return sellable > 0
+        return sellable >= quantity
+    
+    def get_sellable_quantity(self, stock_code, trade_date):
+        """已过T+X限制的持仓数量（不扣除冻结）"""
+        trade_date_dt = trade_date.date()
         
         # 获取该股票的持仓明细（支持多次买入）
-        for position in self.positions[stock_code]:
-            buy_date = position[2]
+        sellable = 0
+        for position in self.positions.get(stock_code, []):
+            quantity, _, buy_date = position
             
-            # 计算交易日差
-            trade_date_dt = trade_date.date()
-            days_diff = (trade_date_dt - buy_date).days
-            
-            # T+X规则：买入后至少X个交易日才能卖出
-            if days_diff > self.t_plus:
-                return False
+            # T+X规则：买入后至少X天才能卖出
+            if (trade_date_dt - buy_date).days >= self.t_plus:
+                sellable += quantity
         
-        return True
+        return sellable
     
     def get_current_price(self, stock_code, max_retries=3):
         """获取股票的最新价"""
+        with PROFILER.phase("quote_fetch"):
+            return self._get_current_price(stock_code)
+    
+    def _get_current_price(self, stock_code):
+        """获取最新价（优先使用1秒内的缓存）"""
         try:
             # 使用缓存，避免频繁请求
             if stock_code in self.stock_prices and time.time() - self.stock_prices[stock_code]['timestamp'] < 1:
+                PRICE_CACHE.inc(result="hit")
                 return self.stock_prices[stock_code]['price']
             
-            crawler = StockDataCrawler(stock_code)
-            price = crawler.get_current_price()
-            self.stock_prices[stock_code] = {
-                'price': price,
-                'timestamp': time.time()
-            }
+            PRICE_CACHE.inc(result="miss")
+            price, stale_seconds = self.data_source.get_price_quote(stock_code)
+            if not isinstance(price, (int, float)):
+                # 数据源失败时统一按0处理，避免调用方比较价格时出错
+                price = 0.0
+            # 上游不可用时界面拿到的是旧行情（被限流、单次失败或熔断），不放入缓存，以免撮合引擎用到
+            if stale_seconds is None:
+                self.stock_prices[stock_code] = {
+                    'price': price,
+                    'timestamp': time.time()
+                }
             return price
         except Exception as e:
             print(f"获取实时价格失败: {str(e)}")
@@ -126,8 +247,7 @@ class TradingAPI:
     def get_stock_data(self, stock_code):
         """获取股票详细信息"""
         try:
-            crawler = StockDataCrawler(stock_code)
-            return crawler.get_stock_data()
+            return self.data_source.get_stock_data(stock_code)
         except Exception as e:
             print(f"获取股票数据失败: {str(e)}")
             return {}
@@ -135,93 +255,257 @@ class TradingAPI:
     def get_stock_limit_prices(self, stock_code):
         """获取股票的涨跌停价"""
         try:
-            crawler = StockDataCrawler(stock_code)
-            return crawler.get_stock_limit_prices()
+            with PROFILER.phase("quote_fetch"):
+                return self.data_source.get_stock_limit_prices(stock_code)
         except Exception as e:
             print(f"获取涨跌停价失败: {str(e)}")
             return (0, 0)
     
+    def get_quote_snapshot(self, stock_codes):
+        """批量获取一组股票的最新价和涨跌停价（每只股票只请求一次）"""
+        snapshot = {}
+        for stock_code in set(stock_codes):
+            if not stock_code or stock_code in snapshot:
+                continue
+            upper_limit, lower_limit = self.get_stock_limit_prices(stock_code)
+            snapshot[stock_code] = {
+                'price': self.get_current_price(stock_code) or 0.0,
+                'upper_limit': upper_limit,
+                'lower_limit': lower_limit
+            }
+        return snapshot
+    
+    def _check_order_fields(self, stock_code, price, quantity):
+        """检查委托的基本字段，返回错误信息（无错误返回None）"""
+        # 股票代码格式检查
+        if not stock_code or len(stock_code) < 2:
+            return "股票代码格式错误"
+        
+        if price <= 0:
+            return "价格必须大于0"
+        
+        if quantity <= 0 or quantity % 100 != 0:
+            return "数量必须是100的整数倍"
+        
+        return None
+    
+    def _check_risk(self, order_type, stock_code, price, quantity, count_rate=True):
+        """下单前风控检查，返回错误信息（通过返回None）；批量下单的频率在整批开始时检查，count_rate 为假"""
+        rejected = self.risk.check(order_type, stock_code, price, quantity, self.cash, count_rate=count_rate)
+        if rejected is None:
+            return None
+        rule, message = rejected
+        RISK_REJECTED.inc(rule=rule)
+        return message
+    
+    def get_risk_status(self):
+        """风控限额和各股票当前敞口"""
+        with self.lock:
+            return {'limits': self.risk.limits(), 'exposures': self.risk.exposures()}
+    
+    def set_risk_limits(self, **limits):
+        """修改风控限额（未传入的保持不变）"""
+        with self.lock:
+            return self.risk.configure(**limits)
+    
     def place_order(self, order_type, stock_code, price, quantity, trade_dt):
         """下单（买入或卖出）"""
-        with self.lock:
-            # 股票代码格式检查
-            if not stock_code or len(stock_code) < 2:
-                return None, "股票代码格式错误"
-            
-            if price <= 0:
-                return None, "价格必须大于0"
+        with UPSTREAM.priority(PRIORITY_ENGINE), self.lock:
+            order_id, message = self._place_order_locked(order_type, stock_code, price, quantity, trade_dt)
+            if order_id:
+                # 保存状态
+                self.save_state()
+            return order_id, message
+    
+    def _place_order_locked(self, order_type, stock_code, price, quantity, trade_dt, quote=None, count_rate=True):
+        """下单的实际逻辑（调用方需持有锁，且负责保存状态）"""
+        error = self._check_order_fields(stock_code, price, quantity)
+        if error:
+            return None, error
+        
+        # 检查交易时间
+        if not self.can_place_order(trade_dt):
+            return None, "当前时段不允许下单"
+        
+        # 检查涨跌停限制
+        if quote is not None:
+            upper_limit, lower_limit = quote['upper_limit'], quote['lower_limit']
+        else:
+            upper_limit, lower_limit = self.get_stock_limit_prices(stock_code)
+        if order_type == "买入" and price > upper_limit:
+            return None, f"委托价格超过涨停价 ¥{upper_limit:.2f}"
+        if order_type == "卖出" and price < lower_limit:
+            return None, f"委托价格低于跌停价 ¥{lower_limit:.2f}"
+        
+        # 卖出时检查可用持仓
+        if order_type == "卖出":
+            # 计算可用持仓 = 总持仓 - 已冻结持仓
+            total_holdings = self.risk.position_quantity(stock_code)
+            available_holdings = total_holdings - self.frozen_positions.get(stock_code, 0)
             
-            if quantity <= 0 or quantity % 100 != 0:
-                return None, "数量必须是100的整数倍"
+            if available_holdings < quantity:
+                return None, "可用持仓数量不足"
             
-            # 检查交易时间
-            if not self.can_place_order(trade_dt):
-                return None, "当前时段不允许下单"
+            # 检查T+1规则（已冻结的持仓也要计入）
+            if not self.can_sell(stock_code, trade_dt, quantity + self.frozen_positions.get(stock_code, 0)):
+                return None, "T+1规则限制，当日买入的股票不可卖出"
+        
+        # 生成唯一订单ID
+        order_id = str(uuid.uuid4())
+        
+        # 创建订单对象
+        order = {
+            'order_id': order_id,
+            'type': order_type,
+            'stock': stock_code,
+            'price': price,
+            'quantity': quantity,
+            'status': 'pending',
+            'created_at': trade_dt.strftime(DATETIME_FORMAT),
+            'updated_at': trade_dt.strftime(DATETIME_FORMAT),
+            'attempts': 0,
+            'expiry': (trade_dt + datetime.timedelta(minutes=30)).strftime(DATETIME_FORMAT),
+            'frozen': 0
+        }
+        
+        # 买入时检查可用资金（成交金额 + 手续费，单位：分）
+        if order_type == "买入":
+            if self._freeze_amount(order) > to_fen(self.cash) - self._frozen_fen:
+                return None, "可用资金不足"
+        
+        # 风控检查
+        error = self._check_risk(order_type, stock_code, price, quantity, count_rate)
+        if error:
+            return None, error
+        
+        # 冻结相应资金或股票，添加到挂单队列和订单簿
+        self._freeze(order)
+        self.pending_orders.append(order_id)
+        self.order_book[order_id] = order
+        self.order_index.add(order)
+        
+        return order_id, "订单已提交"
+    
+    def place_orders_batch(self, orders, trade_dt=None):
+        """批量下单：同一行情快照校验，一次加锁执行，只保存一次状态
+        
+        orders: [{'type': '买入'/'卖出', 'stock': 代码, 'price': 价格, 'quantity': 数量}, ...]
+        返回与orders一一对应的结果列表
+        """
+        trade_dt = trade_dt or datetime.datetime.now()
+        
+        # 在加锁前完成网络请求，每只股票只获取一次行情
+        with UPSTREAM.priority(PRIORITY_ENGINE):
+            snapshot = self.get_quote_snapshot(order.get('stock') for order in orders)
+        
+        results = []
+        with self.lock:
+            # 整批计为一次下单频率
+            rejected = self.risk.check_rate()
+            if rejected is not None:
+                rule, message = rejected
+                RISK_REJECTED.inc(rule=rule)
+                return [{'index': index, 'type': order.get('type'), 'stock': order.get('stock'), 'order_id': None,
+                         'success': False, 'message': message} for index, order in enumerate(orders)]
+            trade_count_before = len(self.trade_history)
+            changed = False
             
-            # 检查涨跌停限制
-            upper_limit, lower_limit = self.get_stock_limit_prices(stock_code)
-            if order_type == "买入" and price > upper_limit:
-                return None, f"委托价格超过涨停价 ¥{upper_limit:.2f}"
-            if order_type == "卖出" and price < lower_limit:
-                return None, f"委托价格低于跌停价 ¥{lower_limit:.2f}"
-            
-            # 卖出时检查可用持仓
-            if order_type == "卖出":
-                # 计算可用持仓 = 总持仓 - 已冻结持仓
-                total_holdings = sum(pos[0] for pos in self.positions.get(stock_code, []))
-                available_holdings = total_holdings - self.frozen_positions.get(stock_code, 0)
-                
-                if available_holdings < quantity:
-                    return None, "可用持仓数量不足"
-                
-                # 检查T+1规则
-                if not self.can_sell(stock_code, trade_dt):
-                    return None, "T+1规则限制，当日买入的股票不可卖出"
+            for index, order in enumerate(orders):
+                order_type = order.get('type')
+                stock_code = order.get('stock')
+                result = {
+                    'index': index,
+                    'type': order_type,
+                    'stock': stock_code,
+                    'order_id': None
+                }
                 
-                # 冻结相应数量的股票
-                self.frozen_positions[stock_code] = self.frozen_positions.get(stock_code, 0) + quantity
-            
-            # 买入时检查可用资金
-            if order_type == "买入":
-                # 计算总成本 = 价格 * 数量 + 手续费
-                total_cost = price * quantity
-                commission_fee = calculate_commission(total_cost, is_buy=True)
-                total_amount = total_cost + commission_fee
+                error = None
+                if order_type not in ("买入", "卖出"):
+                    error = "买卖方向错误"
+                else:
+                    try:
+                        price = float(order.get('price'))
+                        quantity = int(order.get('quantity'))
+                    except (TypeError, ValueError):
+                        error = "价格或数量格式错误"
+                    else:
+                        error = self._check_order_fields(stock_code, price, quantity)
                 
-                # 可用资金 = 现金 - 已冻结资金
-                available_cash = self.cash - self.frozen_cash
+                if error:
+                    result.update({'success': False, 'message': error})
+                    results.append(result)
+                    continue
                 
-                if total_amount > available_cash:
-                    return None, "可用资金不足"
+                quote = snapshot.get(stock_code)
+                if not self.can_place_order(trade_dt):
+                    success, message, order_id = False, "非交易时间", None
+                elif self.is_pre_market(trade_dt):
+                    order_id, message = self._place_order_locked(
+                        order_type, stock_code, price, quantity, trade_dt, quote, count_rate=False)
+                    success = order_id is not None
+                else:
+                    success, message, order_id = self._execute_immediate_trade_locked(
+                        order_type, stock_code, price, quantity, trade_dt, quote, count_rate=False)
                 
-                # 冻结相应资金
-                self.frozen_cash += total_amount
-            
-            # 生成唯一订单ID
-            order_id = str(uuid.uuid4())
-            
-            # 创建订单对象
-            order = {
-                'order_id': order_id,
-                'type': order_type,
-                'stock': stock_code,
-                'price': price,
-                'quantity': quantity,
-                'status': 'pending',
-                'created_at': trade_dt.strftime(DATETIME_FORMAT),
-                'updated_at': trade_dt.strftime(DATETIME_FORMAT),
-                'attempts': 0,
-                'expiry': (trade_dt + datetime.timedelta(minutes=30)).strftime(DATETIME_FORMAT)
-            }
+                changed = changed or success
+                result.update({'success': success, 'message': message, 'order_id': order_id})
+                results.append(result)
             
-            # 添加到挂单队列和订单簿
-            self.pending_orders.append(order_id)
-            self.order_book[order_id] = order
-            
-            # 保存状态
-            self.save_state()
-            
-            return order_id, "订单已提交"
+            # 整批只更新一次资金曲线、保存一次状态
+            if len(self.trade_history) > trade_count_before:
+                self.update_equity_history()
+            if changed:
+                self.save_state()
+        
+        return results
+    
+    def _freeze_amount(self, order):
+        """挂单需要冻结的数量：买单为成交金额加手续费（分），卖单为股数"""
+        quantity = int(order['quantity'])
+        if order['type'] == '买入':
+            amount = to_fen(float(order['price'])) * quantity
+            return amount + self.fees.fee(order['stock'], True, amount)
+        return quantity
+    
+    def _freeze(self, order):
+        """冻结挂单占用的资金或持仓，冻结数量记在订单的 frozen 字段上"""
+        frozen = self._freeze_amount(order)
+        order['frozen'] = frozen
+        if order['type'] == '买入':
+            self._frozen_fen += frozen
+        else:
+            stock_code = order['stock']
+            self.frozen_positions[stock_code] = self.frozen_positions.get(stock_code, 0) + frozen
+        self.risk.order_opened(order)
+    
+    def _release_frozen(self, order):
+        """解冻订单占用的资金或持仓（按订单上记录的冻结数量，不重新计算费用）"""
+        self.risk.order_closed(order)
+        frozen = order.get('frozen', 0)
+        order['frozen'] = 0
+        if order['type'] == '买入':
+            self._frozen_fen -= frozen
+        else:  # 卖出
+            stock_code = order['stock']
+            self.frozen_positions[stock_code] = max(0, self.frozen_positions.get(stock_code, 0) - frozen)
+    
+    def _recompute_frozen(self):
+        """按当前挂单重新计算冻结资金和冻结持仓"""
+        frozen_fen = 0
+        frozen_positions = defaultdict(int)
+        for order_id in self.pending_orders:
+            order = self._order_book[order_id]
+            if not order.get('frozen'):
+                # 旧版本状态文件中的挂单没有记录冻结数量
+                order['frozen'] = self._freeze_amount(order)
+            if order['type'] == '买入':
+                frozen_fen += order['frozen']
+            else:
+                frozen_positions[order['stock']] += order['frozen']
+        self._frozen_fen = frozen_fen
+        self.frozen_positions = frozen_positions
+        self.risk.rebuild(self.positions, (self._order_book[order_id] for order_id in self.pending_orders))
     
     def cancel_order(self, order_id, trade_dt):
         """撤单"""
@@ -239,23 +523,12 @@ class TradingAPI:
                 return False, "当前时段不允许撤单"
             
             # 根据订单类型解冻资金或持仓
-            if order['type'] == '买入':
-                # 计算冻结的资金
-                total_cost = float(order['price']) * int(order['quantity'])
-                commission_fee = calculate_commission(total_cost, is_buy=True)
-                total_amount = total_cost + commission_fee
-                
-                # 解冻资金
-                self.frozen_cash -= total_amount
-            else:  # 卖出
-                # 解冻持仓
-                stock_code = order['stock']
-                quantity = int(order['quantity'])
-                self.frozen_positions[stock_code] = max(0, self.frozen_positions.get(stock_code, 0) - quantity)
+            self._release_frozen(order)
             
             # 更新订单状态
-            order['status'] = 'canceled'
+            self.order_index.set_status(order, 'canceled')
             order['updated_at'] = trade_dt.strftime(DATETIME_FORMAT)
+            ORDER_EVENTS.inc(event="cancel")
             
             # 从挂单队列中移除
             if order_id in self.pending_orders:
@@ -266,29 +539,57 @@ class TradingAPI:
             
             return True, "撤单成功"
     
+    def cancel_all_orders(self, trade_dt, stock_code=None, order_type=None):
+        """一键撤单，可按股票代码或买卖方向过滤
+        
+        返回 (是否成功, 提示信息, 已撤订单ID列表)
+        """
+        with self.lock:
+            # 检查当前时间是否允许撤单
+            if not self.can_cancel_order(trade_dt):
+                return False, "当前时段不允许撤单", []
+            
+            updated_at = trade_dt.strftime(DATETIME_FORMAT)
+            canceled = []
+            remaining = deque()
+            
+            for order_id in self.pending_orders:
+                order = self.order_book[order_id]
+                if (stock_code and order['stock'] != stock_code) or (order_type and order['type'] != order_type):
+                    remaining.append(order_id)
+                    continue
+                
+                self._release_frozen(order)
+                self.order_index.set_status(order, 'canceled')
+                order['updated_at'] = updated_at
+                canceled.append(order_id)
+            
+            if not canceled:
+                return True, "没有可撤销的订单", []
+            ORDER_EVENTS.inc(len(canceled), event="cancel")
+            
+            # 一次性重建挂单队列，避免逐个remove
+            self.pending_orders = remaining
+            self.save_state()
+            
+            return True, f"已撤销{len(canceled)}笔订单", canceled
+    
     def expire_old_orders(self):
         """检查并过期超时订单"""
         current_time = datetime.datetime.now()
         expired = False
         
         for order_id in list(self.pending_orders):
-            order = self.order_book[order_id]
+            order = self._order_book[order_id]
             expiry_time = datetime.datetime.strptime(order['expiry'], DATETIME_FORMAT)
             
             if current_time > expiry_time:
                 # 根据订单类型解冻资金或持仓
-                if order['type'] == '买入':
-                    total_cost = float(order['price']) * int(order['quantity'])
-                    commission_fee = calculate_commission(total_cost, is_buy=True)
-                    total_amount = total_cost + commission_fee
-                    self.frozen_cash -= total_amount
-                else:  # 卖出
-                    stock_code = order['stock']
-                    quantity = int(order['quantity'])
-                    self.frozen_positions[stock_code] = max(0, self.frozen_positions.get(stock_code, 0) - quantity)
+                self._release_frozen(order)
                 
                 # 更新订单状态
-                order['status'] = 'expired'
+                self.order_index.set_status(order, 'expired')
+                ORDER_EVENTS.inc(event="expire")
                 self.pending_orders.remove(order_id)
                 expired = True
         
@@ -297,14 +598,175 @@ class TradingAPI:
         
         return expired
     
+    def check_daily_roll(self, now=None):
+        """收盘（post_market → closed）后执行日终结算，停机错过收盘时在下次检查时补做"""
+        now = now or datetime.datetime.now()
+        if time.time() < self.settlement_retry_at:
+            return None
+        settle_day = last_closed_trading_day(now)
+        if settle_day < self.last_trading_day:
+            return None
+        return self.run_daily_settlement(settle_day)
+    
+    def run_daily_settlement(self, settle_day):
+        """日终结算（结算区间为 last_trading_day 至 settle_day）
+        
+        1. 批量过期区间内的全部当日挂单并解冻
+        2. 区间内已结束的订单和成交记录按日写入压缩归档分区
+        3. 生成日结单
+        4. 交收：次日起可卖的持仓批次合并为一个批次
+        5. 当日盈亏清零
+        6. 压缩实时状态：只保留最近 history_days 天的已结束订单和成交记录
+        """
+        # 行情请求放在锁外
+        with self.lock:
+            stocks = list(self.positions.keys())
+        prices = {stock: self.get_current_price(stock) for stock in stocks}
+        
+        with self.lock, SETTLEMENT_LATENCY.time():
+            try:
+                statement = self._run_daily_settlement_locked(settle_day, prices)
+            except Exception as e:
+                print(f"日终结算失败: {str(e)}")
+                # 一分钟后重试，避免每秒刷屏
+                self.settlement_retry_at = time.time() + 60
+                return None
+            if statement is not None:
+                self.save_state()
+        return statement
+    
+    def _run_daily_settlement_locked(self, settle_day, prices):
+        start_day = self.last_trading_day
+        # 其他线程可能已经完成了这一天的结算
+        if settle_day < start_day:
+            return None
+        first = start_day.strftime(DATE_FORMAT)
+        last = settle_day.strftime(DATE_FORMAT)
+        updated_at = datetime.datetime.now().strftime(DATETIME_FORMAT)
+        
+        # 1. 批量过期：区间内（及更早）创建的挂单都是当日有效，一次性处理
+        expired = 0
+        remaining = deque()
+        for order_id in self.pending_orders:
+            order = self._order_book[order_id]
+            if order['created_at'][:10] <= last:
+                self._release_frozen(order)
+                self.order_index.set_status(order, 'expired')
+                order['updated_at'] = updated_at
+                expired += 1
+            else:
+                remaining.append(order_id)
+        self.pending_orders = remaining
+        if expired:
+            ORDER_EVENTS.inc(expired, event="expire")
+        # 按剩余挂单重新核对冻结资金和持仓，消除日内累计的误差
+        self._recompute_frozen()
+        
+        # 2. 按日归档区间内已结束的订单和成交记录
+        orders_by_day = defaultdict(list)
+        trades_by_day = defaultdict(list)
+        order_status = defaultdict(int)
+        for order in self.order_book.values():
+            day = order['created_at'][:10]
+            if first <= day <= last and order['status'] != 'pending':
+                orders_by_day[day].append(order)
+                order_status[order['status']] += 1
+        for trade in self.trade_history:
+            day = trade['datetime'][:10]
+            if first <= day <= last:
+                trades_by_day[day].append(trade)
+        for day in sorted(set(orders_by_day) | set(trades_by_day)):
+            write_archive(
+                self.archive_dir, datetime.datetime.strptime(day, DATE_FORMAT).date(),
+                orders_by_day[day], trades_by_day[day]
+            )
+        
+        # 3. 日结单（盈亏清零之前生成）
+        trades = [trade for day in sorted(trades_by_day) for trade in trades_by_day[day]]
+        stock_value = self.get_stock_value(prices)
+        statement = {
+            'date': last,
+            'period_start': first,
+            'generated_at': updated_at,
+            'cash': self.cash,
+            'frozen_cash': self.frozen_cash,
+            'stock_value': stock_value,
+            'total_assets': self.cash + stock_value,
+            'today_profit': self.today_profit,
+            'total_profit': self.cash + stock_value - self.initial_cash,
+            'positions': {
+                stock: {
+                    'quantity': sum(lot[0] for lot in lots),
+                    'avg_cost': sum(lot[0] * lot[1] for lot in lots) / max(1, sum(lot[0] for lot in lots)),
+                    'price': prices.get(stock, 0),
+                }
+                for stock, lots in self.positions.items() if lots
+            },
+            'trades': {
+                'count': len(trades),
+                'buy_amount': sum(t['amount'] for t in trades if t['type'] == '买入'),
+                'sell_amount': sum(t['amount'] for t in trades if t['type'] == '卖出'),
+                'commission': sum(t['commission'] for t in trades),
+                'realized_profit': sum(t['profit'] for t in trades if t['type'] == '卖出'),
+            },
+            'orders': dict(order_status),
+        }
+        write_statement(self.statement_dir, statement)
+        
+        # 4. 交收
+        for stock in list(self.positions.keys()):
+            lots = merge_settled_lots(self.positions[stock], settle_day, self.t_plus)
+            if lots:
+                self.positions[stock] = lots
+            else:
+                del self.positions[stock]
+        
+        # 5. 当日盈亏清零
+        self.today_profit = 0.0
+        
+        # 6. 压缩实时状态（更早的记录已在当日结算时归档）
+        cutoff = (settle_day - datetime.timedelta(days=self.history_days)).strftime(DATE_FORMAT)
+        self.order_book = {
+            order_id: order for order_id, order in self.order_book.items()
+            if order['status'] == 'pending' or order['created_at'][:10] > cutoff
+        }
+        self.trade_history = [trade for trade in self.trade_history if trade['datetime'][:10] > cutoff]
+        
+        self.last_trading_day = next_trading_day(settle_day)
+        return statement
+    
+    def get_statements(self):
+        """已生成日结单的日期列表"""
+        return list_statements(self.statement_dir)
+    
+    def get_statement(self, day):
+        """某日的日结单，不存在返回None"""
+        return read_statement(self.statement_dir, day)
+    
     def process_pending_orders(self):
         """处理挂单队列，尝试成交"""
+        # 撮合引擎的行情请求优先于界面查询
+        with UPSTREAM.priority(PRIORITY_ENGINE), PROFILER.trace("tick"), MATCH_TICK_LATENCY.time():
+            return self._process_pending_orders()
+    
+    def _process_pending_orders(self):
+        """撮合一轮挂单"""
+        if self.matcher is not None:
+            try:
+                return self._process_pending_orders_sharded()
+            except Exception as e:
+                # 工作进程异常时退回单进程撮合
+                print(f"分片撮合失败，改为单进程撮合: {str(e)}")
+                self.matcher.close()
+                self.matcher = None
+        
         with self.lock:
             current_time = datetime.datetime.now()
             processed = False
             
             # 先处理过期订单
-            self.expire_old_orders()
+            with PROFILER.phase("expire"):
+                self.expire_old_orders()
             
             # 获取当前交易阶段
             phase = get_trading_phase(current_time)
@@ -313,44 +775,45 @@ class TradingAPI:
             if phase in ["non_trading", "closed", "break"]:
                 return False
             
-            # 获取当前市场价格
-            market_prices = {}
-            for order_id in list(self.pending_orders):
-                order = self.order_book[order_id]
-                stock_code = order['stock']
+            # 获取当前市场价格并撮合（行情请求计入quote_fetch阶段）
+            with PROFILER.phase("match"):
+                market_prices = {}
+                for order_id in list(self.pending_orders):
+                    order = self._order_book[order_id]
+                    stock_code = order['stock']
                 
-                if stock_code not in market_prices:
-                    market_prices[stock_code] = self.get_current_price(stock_code)
+                    if stock_code not in market_prices:
+                        market_prices[stock_code] = self.get_current_price(stock_code)
                 
-                current_price = market_prices[stock_code]
+                    current_price = market_prices[stock_code]
                 
-                # 增加尝试次数
-                order['attempts'] += 1
-                order['updated_at'] = current_time.strftime(DATETIME_FORMAT)
+                    # 增加尝试次数
+                    order['attempts'] += 1
+                    order['updated_at'] = current_time.strftime(DATETIME_FORMAT)
                 
-                # 修复：正确的价格比较逻辑
-                if order['type'] == '买入' and current_price <= float(order['price']) and current_price > 0:
-                    # 尝试执行交易
-                    success, _ = self.execute_trade(order)
-                    if success:
-                        processed = True
-                        # 成交后从挂单队列中移除
+                    # 修复：正确的价格比较逻辑
+                    if order['type'] == '买入' and current_price <= float(order['price']) and current_price > 0:
+                        # 尝试执行交易
+                        success, _ = self.execute_trade(order)
+                        if success:
+                            processed = True
+                            # 成交后从挂单队列中移除
+                            if order_id in self.pending_orders:
+                                self.pending_orders.remove(order_id)
+                    elif order['type'] == '卖出' and current_price >= float(order['price']) and current_price > 0:
+                        # 尝试执行交易
+                        success, _ = self.execute_trade(order)
+                        if success:
+                            processed = True
+                            # 成交后从挂单队列中移除
+                            if order_id in self.pending_orders:
+                                self.pending_orders.remove(order_id)
+                    elif order['attempts'] > 10:
+                        # 尝试超过10次仍未成交，自动取消
+                        self._auto_cancel(order)
                         if order_id in self.pending_orders:
                             self.pending_orders.remove(order_id)
-                elif order['type'] == '卖出' and current_price >= float(order['price']) and current_price > 0:
-                    # 尝试执行交易
-                    success, _ = self.execute_trade(order)
-                    if success:
                         processed = True
-                        # 成交后从挂单队列中移除
-                        if order_id in self.pending_orders:
-                            self.pending_orders.remove(order_id)
-                elif order['attempts'] > 10:
-                    # 尝试超过10次仍未成交，自动取消
-                    order['status'] = 'canceled'
-                    if order_id in self.pending_orders:
-                        self.pending_orders.remove(order_id)
-                    processed = True
             
             # 如果有订单成交或取消，保存状态
             if processed:
@@ -358,8 +821,93 @@ class TradingAPI:
             
             return processed
     
-    def execute_trade(self, order):
-        """执行交易（实际成交）"""
+    def _auto_cancel(self, order):
+        """撮合多次仍未成交的挂单自动撤单，并解冻资金或持仓"""
+        self._release_frozen(order)
+        self.order_index.set_status(order, 'canceled')
+        ORDER_EVENTS.inc(event="auto_cancel")
+    
+    def _process_pending_orders_sharded(self):
+        """分片撮合一轮挂单
+        
+        锁内只做过期处理和读取挂单集合；行情批量获取一次、价格比较在工作进程中完成，
+        最后回到锁内按成交/撤单意图更新账本。
+        """
+        current_time = datetime.datetime.now()
+        with self.lock:
+            with PROFILER.phase("expire"):
+                self.expire_old_orders()
+            
+            if get_trading_phase(current_time) in ["non_trading", "closed", "break"]:
+                return False
+            
+            pending_ids = set(self.pending_orders)
+            stock_codes = {self._order_book[order_id]['stock'] for order_id in pending_ids}
+        
+        # 一次批量请求获取所有挂单股票的行情
+        quotes = {}
+        if stock_codes:
+            with PROFILER.phase("quote_fetch"):
+                try:
+                    quotes = self.data_source.get_batch_quotes(sorted(stock_codes))
+                except Exception as e:
+                    print(f"批量获取行情失败: {str(e)}")
+        prices = {}
+        now = time.time()
+        for stock_code in stock_codes:
+            quote = quotes.get(stock_code) or {}
+            price = quote.get('current')
+            if 'stale_seconds' in quote:
+                # 上游不可用时的旧行情不参与撮合，也不放入缓存
+                prices[stock_code] = 0.0
+                continue
+            prices[stock_code] = price if isinstance(price, (int, float)) and price > 0 else 0.0
+            if quote:
+                self.stock_prices[stock_code] = {'price': prices[stock_code], 'timestamp': now}
+        
+        with PROFILER.phase("match"):
+            intents = self.matcher.match(pending_ids, self._order_book, prices)
+        
+        if not intents:
+            return False
+        
+        with self.lock:
+            processed = False
+            updated_at = current_time.strftime(DATETIME_FORMAT)
+            done = set()
+            for intent, order_id, attempts in intents:
+                order = self._order_book.get(order_id)
+                # 撮合期间已被撤单或过期的挂单忽略
+                if order is None or order['status'] != 'pending':
+                    continue
+                order['attempts'] = attempts
+                order['updated_at'] = updated_at
+                if intent == 'fill':
+                    quote = quotes.get(order['stock']) or {}
+                    if quote.get('upper_limit') is None:
+                        quote = None
+                    success, _ = self.execute_trade(order, quote=quote, persist=False)
+                    if not success:
+                        continue
+                else:
+                    self._auto_cancel(order)
+                done.add(order_id)
+                processed = True
+            
+            if done:
+                self.pending_orders = deque(order_id for order_id in self.pending_orders if order_id not in done)
+            if processed:
+                self.update_equity_history()
+                self.save_state()
+            
+            return processed
+    
+    def execute_trade(self, order, quote=None, persist=True):
+        """执行交易（实际成交）
+        
+        quote: 可选的行情快照，提供时不再单独请求涨跌停价
+        persist: 为False时由调用方负责更新资金曲线和保存状态（批量场景）
+        """
         stock_code = order['stock']
         price = float(order['price'])  # 使用订单价格作为成交价
         quantity = int(order['quantity'])
@@ -367,29 +915,31 @@ class TradingAPI:
         
         if order['type'] == '买入':
             # 获取涨跌停价
-            upper_limit, _ = self.get_stock_limit_prices(stock_code)
+            if quote is not None:
+                upper_limit = quote['upper_limit']
+            else:
+                upper_limit, _ = self.get_stock_limit_prices(stock_code)
             if price > upper_limit:
                 return False, f"价格超过涨停价 ¥{upper_limit:.2f}"
             
-            total_cost = price * quantity
-            
-            # 计算交易费用
-            commission_fee = calculate_commission(total_cost, is_buy=True)
-            total_amount = total_cost + commission_fee
+            # 成交金额和交易费用（分）
+            amount = to_fen(price) * quantity
+            commission_fee = self.fees.fee(stock_code, True, amount)
+            total_amount = amount + commission_fee
             
-            # 检查资金是否充足（此时资金已冻结，理论上应该充足）
-            if total_amount > (self.cash - self.frozen_cash):
+            # 检查资金是否充足（挂单成交时可以使用它自己冻结的资金）
+            if total_amount > to_fen(self.cash) - self._frozen_fen + order.get('frozen', 0):
                 return False, "资金不足"
             
-            # 解冻资金（因为要实际扣款）
-            self.frozen_cash -= total_amount
-            
-            # 执行交易
-            self.cash -= total_amount
+            # 解冻挂单冻结的资金（立即成交的订单没有冻结），再实际扣款
+            self._release_frozen(order)
+            self.cash = (to_fen(self.cash) - total_amount) / 100
             
             # 更新持仓 - 记录每次买入的成本和日期
             buy_date = trade_dt.date()
             self.positions[stock_code].append([quantity, price, buy_date])
+            self.risk.update_position(stock_code, self.positions[stock_code])
+            self.analytics.record_fill(stock_code, True, amount / 100, commission_fee / 100)
             
             # 记录交易
             trade_record = {
@@ -398,19 +948,22 @@ class TradingAPI:
                 'stock': stock_code,
                 'price': price,
                 'quantity': quantity,
-                'amount': total_cost,
-                'commission': commission_fee,
+                'amount': amount / 100,
+                'commission': commission_fee / 100,
                 'datetime': trade_dt.strftime(DATETIME_FORMAT),
                 'profit': 0  # 买入没有利润
             }
             self.trade_history.append(trade_record)
+            self.trade_index.add(trade_record)
             
             # 更新订单状态
-            order['status'] = 'filled'
+            self.order_index.set_status(order, 'filled')
             order['updated_at'] = trade_dt.strftime(DATETIME_FORMAT)
+            ORDER_EVENTS.inc(event="fill")
 
-            self.update_equity_history()
-            self.save_state()
+            if persist:
+                self.update_equity_history()
+                self.save_state()
             
             return True, f"买入成功，成交价: ¥{price:.2f}"
         
@@ -419,45 +972,47 @@ class TradingAPI:
                 return False, "无此股票持仓"
             
             # 检查T+1规则
-            if not self.can_sell(stock_code, trade_dt):
+            if not self.can_sell(stock_code, trade_dt, quantity):
                 return False, f"T+{self.t_plus}规则限制，不能卖出"
             
-            # 解冻持仓
-            self.frozen_positions[stock_code] = max(0, self.frozen_positions.get(stock_code, 0) - quantity)
+            # 不能卖出其他挂单已冻结的股票（挂单成交时可以使用它自己冻结的股数）
+            available = (self.risk.position_quantity(stock_code) - self.frozen_positions.get(stock_code, 0)
+                         + order.get('frozen', 0))
+            if available < quantity:
+                return False, "可用持仓数量不足"
+            
+            # 解冻挂单冻结的持仓（立即成交的订单没有冻结）
+            self._release_frozen(order)
             
-            # 执行卖出 - 使用先进先出(FIFO)原则
+            # 执行卖出 - 使用先进先出(FIFO)原则确定各批次卖出数量
+            lots = self.positions[stock_code]
+            sold = []
             remaining_quantity = quantity
-            total_profit = 0
-            total_amount = 0
+            for position in lots:
+                if remaining_quantity <= 0:
+                    break
+                sell_quantity = min(position[0], remaining_quantity)
+                sold.append((position, sell_quantity))
+                remaining_quantity -= sell_quantity
             
-            while remaining_quantity > 0 and self.positions[stock_code]:
-                position = self.positions[stock_code][0]
-                pos_quantity, cost_price, buy_date = position
-                
-                # 计算本次卖出的数量
-                sell_quantity = min(pos_quantity, remaining_quantity)
-                
-                # 计算本次卖出的金额
-                sell_amount = price * sell_quantity
-                total_amount += sell_amount
-                
-                # 计算交易费用
-                commission_fee = calculate_commission(sell_amount, is_buy=False)
+            # 整笔成交只计算一次费用（最低佣金不按批次重复收取），按数量分摊到各批次
+            price_fen = to_fen(price)
+            commission_fee = self.fees.fee(stock_code, False, price_fen * quantity)
+            lot_fees = allocate(commission_fee, [sell_quantity for _, sell_quantity in sold])
+            
+            total_profit = 0
+            cash = to_fen(self.cash)
+            for (position, sell_quantity), lot_fee in zip(sold, lot_fees):
+                cost_price = position[1]
+                sell_amount = price_fen * sell_quantity
                 
                 # 计算本次卖出的盈亏
-                profit = (price - cost_price) * sell_quantity - commission_fee
+                profit = (price - cost_price) * sell_quantity - lot_fee / 100
                 total_profit += profit
                 
-                # 更新现金
-                self.cash += (sell_amount - commission_fee)
-                
-                # 更新持仓
-                if sell_quantity == pos_quantity:
-                    # 全部卖出该批次
-                    self.positions[stock_code].pop(0)
-                else:
-                    # 部分卖出
-                    self.positions[stock_code][0][0] -= sell_quantity
+                # 更新现金和持仓
+                cash += sell_amount - lot_fee
+                position[0] -= sell_quantity
                 
                 # 记录交易
                 trade_record = {
@@ -466,24 +1021,31 @@ class TradingAPI:
                     'stock': stock_code,
                     'price': price,
                     'quantity': sell_quantity,
-                    'amount': sell_amount,
+                    'amount': sell_amount / 100,
                     'profit': profit,
-                    'commission': commission_fee,
+                    'commission': lot_fee / 100,
                     'datetime': trade_dt.strftime(DATETIME_FORMAT)
                 }
                 self.trade_history.append(trade_record)
-                
-                remaining_quantity -= sell_quantity
+                self.trade_index.add(trade_record)
+            
+            self.cash = cash / 100
+            # 去掉已全部卖出的批次
+            self.positions[stock_code] = [position for position in lots if position[0] > 0]
+            self.risk.update_position(stock_code, self.positions[stock_code])
+            self.analytics.record_fill(stock_code, False, price_fen * quantity / 100, commission_fee / 100, total_profit)
             
             # 更新当日盈亏
             self.today_profit += total_profit
             
             # 更新订单状态
-            order['status'] = 'filled'
+            self.order_index.set_status(order, 'filled')
             order['updated_at'] = trade_dt.strftime(DATETIME_FORMAT)
+            ORDER_EVENTS.inc(event="fill")
 
-            self.update_equity_history()
-            self.save_state()
+            if persist:
+                self.update_equity_history()
+                self.save_state()
             
             return True, f"卖出成功，成交价: ¥{price:.2f}"
     
@@ -516,17 +1078,42 @@ class TradingAPI:
             return self.execute_immediate_trade('卖出', stock_code, price, quantity, trade_dt)
     
     def execute_immediate_trade(self, trade_type, stock_code, price, quantity, trade_dt):
-        """在正常交易时段立即执行交易"""
-        # 获取最新价
-        current_price = self.get_current_price(stock_code)
-        if current_price <= 0:
-            return False, "无法获取当前股价"
+        """在正常交易时段立即执行交易（行情在加锁前获取，风控检查、成交、冻结和保存都在锁内）"""
+        with UPSTREAM.priority(PRIORITY_ENGINE):
+            quote = self.get_quote_snapshot([stock_code]).get(stock_code)
+        if quote is None:
+            quote = {'price': 0.0, 'upper_limit': 0.0, 'lower_limit': 0.0}
+        with UPSTREAM.priority(PRIORITY_ENGINE), self.lock:
+            success, message, order_id = self._execute_immediate_trade_locked(
+                trade_type, stock_code, price, quantity, trade_dt, quote)
+            if success:
+                if order_id is None:
+                    # 已成交，记录资金快照
+                    self.update_equity_history()
+                self.save_state()
+        return success, message
+    
+    def _execute_immediate_trade_locked(self, trade_type, stock_code, price, quantity, trade_dt, quote,
+                                        count_rate=True):
+        """立即成交的实际逻辑，返回 (是否成功, 提示信息, 挂单ID)
+        
+        调用方需持有锁，并在加锁前取好行情快照 quote（见 get_quote_snapshot）；
+        不更新资金曲线、不保存状态（由调用方统一处理）
+        """
+        current_price = quote['price']
+        if not current_price or current_price <= 0:
+            return False, "无法获取当前股价", None
         
         # 检查价格是否符合规则
         if trade_type == "买入" and price < current_price:
-            return False, f"买入价格(¥{price:.2f})低于当前价(¥{current_price:.2f})"
+            return False, f"买入价格(¥{price:.2f})低于当前价(¥{current_price:.2f})", None
         elif trade_type == "卖出" and price > current_price:
-            return False, f"卖出价格(¥{price:.2f})高于当前价(¥{current_price:.2f})"
+            return False, f"卖出价格(¥{price:.2f})高于当前价(¥{current_price:.2f})", None
+        
+        # 风控检查
+        error = self._check_risk(trade_type, stock_code, price, quantity, count_rate)
+        if error:
+            return False, error, None
         
         # 创建临时订单对象
         order = {
@@ -539,45 +1126,42 @@ class TradingAPI:
             'created_at': trade_dt.strftime(DATETIME_FORMAT),
             'updated_at': trade_dt.strftime(DATETIME_FORMAT),
             'attempts': 0,
-            'expiry': (trade_dt + datetime.timedelta(minutes=30)).strftime(DATETIME_FORMAT)
+            'expiry': (trade_dt + datetime.timedelta(minutes=30)).strftime(DATETIME_FORMAT),
+            'frozen': 0
         }
         
         # 尝试立即执行
-        success, message = self.execute_trade(order)
+        success, message = self.execute_trade(order, quote=quote, persist=False)
         if success:
-            return True, message
+            return True, message, None
         else:
-            # 如果无法立即成交，转为挂单
+            # 如果无法立即成交，转为挂单并冻结资金或持仓
+            self._freeze(order)
             self.pending_orders.append(order['order_id'])
             self.order_book[order['order_id']] = order
+            self.order_index.add(order)
             
-            # 冻结资金或持仓
-            if trade_type == '买入':
-                total_cost = price * quantity
-                commission_fee = calculate_commission(total_cost, is_buy=True)
-                total_amount = total_cost + commission_fee
-                self.frozen_cash += total_amount
-            else:
-                self.frozen_positions[stock_code] = self.frozen_positions.get(stock_code, 0) + quantity
-            
-            return True, f"订单已转为挂单，订单号: {order['order_id']}"
+            return True, f"订单已转为挂单，订单号: {order['order_id']}", order['order_id']
     
-    def get_portfolio_value(self):
+    def get_portfolio_value(self, prices=None):
         """计算投资组合价值"""
-        return self.cash + self.get_stock_value()
+        return self.cash + self.get_stock_value(prices)
     
-    def get_total_profit(self):
+    def get_total_profit(self, prices=None):
         """计算总盈亏"""
-        return (self.cash + self.get_stock_value()) - self.initial_cash
+        return (self.cash + self.get_stock_value(prices)) - self.initial_cash
     
-    def get_stock_value(self):
-        """计算股票市值"""
+    def get_stock_value(self, prices=None):
+        """计算股票市值（提供prices时使用该价格快照，不再请求行情）"""
         stock_value = 0.0
         for stock, positions in self.positions.items():
             # 计算该股票的总持仓数量
             total_quantity = sum(pos[0] for pos in positions)
-            current_price = self.get_current_price(stock)
-            stock_value += current_price * total_quantity
+            if prices is not None and stock in prices:
+                current_price = prices[stock]
+            else:
+                current_price = self.get_current_price(stock)
+            stock_value += (current_price or 0.0) * total_quantity
         return stock_value
     
     def get_available_cash(self):
@@ -586,34 +1170,44 @@ class TradingAPI:
     
     def get_available_quantity(self, stock_code):
         """获取可用持仓数量"""
-        total_holdings = sum(pos[0] for pos in self.positions.get(stock_code, []))
+        total_holdings = self.risk.position_quantity(stock_code)
         frozen = self.frozen_positions.get(stock_code, 0)
         return total_holdings - frozen
     
-    def get_total_assets(self):
+    def get_total_assets(self, prices=None):
         """计算总资产"""
-        return self.cash + self.get_stock_value()
+        return self.cash + self.get_stock_value(prices)
     
     def save_state(self, filename=None):
         """保存当前状态到文件"""
         filename = filename or self.filename
+        self.state_version += 1
         state = {
             'cash': self.cash,
             'positions': dict(self.positions),
             'frozen_positions': dict(self.frozen_positions),
             'frozen_cash': self.frozen_cash,
             't_plus': self.t_plus,
-            'trade_history': self.trade_history,
             'pending_orders': list(self.pending_orders),
-            'order_book': self.order_book,
             'initial_cash': self.initial_cash,
             'today_profit': self.today_profit,
             'last_trading_day': self.last_trading_day,
-            'equity_history': self.equity_history
+            'analytics': self.analytics.to_dict()
         }
+        if self._history_loader is not None and self._history_segment is not None:
+            # 历史尚未加载：不解码再编码，原样写回历史段（加载后的订单都在 _order_book 里，写入实时段）
+            state['order_book'] = self._order_book
+            state['history_segment'] = self._history_segment
+            state['trade_summary'] = self._trade_summary
+        else:
+            state['order_book'] = self.order_book
+            state['trade_history'] = self.trade_history
         try:
-            with open(filename, 'wb') as f:
-                pickle.dump(state, f)
+            with PROFILER.phase("persist"), PERSIST_LATENCY.time():
+                # 先写临时文件再替换，避免保存中途退出损坏状态文件
+                with open(filename + ".tmp", 'wb') as f:
+                    f.write(encode_state(state))
+                os.replace(filename + ".tmp", filename)
             return True, "状态保存成功"
         except Exception as e:
             print(f"保存状态失败: {str(e)}")
@@ -622,10 +1216,20 @@ class TradingAPI:
     def load_state(self, filename=None):
         """从文件加载状态"""
         filename = filename or self.filename
+        legacy_filename = os.path.splitext(filename)[0] + ".pkl"
         try:
+            migrated = False
             if os.path.exists(filename):
                 with open(filename, 'rb') as f:
-                    state = pickle.load(f)
+                    state = decode_state(f.read(), lazy_history=self.lazy_history)
+            elif os.path.exists(legacy_filename):
+                # 旧版本的pickle状态文件，读取后转存为新格式
+                with open(legacy_filename, 'rb') as f:
+                    state = load_legacy_pickle(f)
+                migrated = True
+            else:
+                state = None
+            if state is not None:
                 self.cash = state['cash']
                 self.positions = defaultdict(list, state.get('positions', {}))
                 self.frozen_positions = defaultdict(int, state.get('frozen_positions', {}))
@@ -637,15 +1241,53 @@ class TradingAPI:
                 self.initial_cash = state.get('initial_cash', 100000.0)
                 self.today_profit = state.get('today_profit', 0.0)
                 self.last_trading_day = state.get('last_trading_day', datetime.datetime.now().date())
-                self.equity_history = state.get('equity_history', [])
+                self._history_loader = state.get('history_loader')
+                self._history_segment = state.get('history_segment')
+                self._trade_summary = state.get('trade_summary', (0, None))
+                if migrated:
+                    for order in self._order_book.values():
+                        order.setdefault('frozen', 0)
+                # 按挂单上记录的冻结数量核对冻结资金和持仓（同时重建风控敞口）
+                self._recompute_frozen()
+                analytics = state.get('analytics')
+                if migrated or not self.lazy_history or not analytics:
+                    self.load_equity_store(state.get('equity_history'))
+                    self._equity_loaded = True
+                else:
+                    self._equity_loaded = False
+                if analytics:
+                    self.analytics = PerformanceAnalytics.from_dict(analytics)
+                else:
+                    # 旧版本状态文件没有绩效汇总，用成交记录和日级资金曲线重建一次
+                    self.analytics = self._rebuild_analytics()
+                self.state_version += 1
+                if migrated:
+                    self.save_state(filename)
+                    self.save_equity_store()
                 return True, "状态加载成功"
             return False, "状态文件不存在"
         except Exception as e:
             print(f"加载状态失败: {str(e)}")
+            # 保留无法读取的文件以便排查，再创建初始状态
+            if os.path.exists(filename):
+                os.replace(filename, filename + ".corrupt")
             # 创建初始状态
             self.save_state()
             return False, f"加载状态失败: {str(e)}，已创建初始状态"
     
+    def _rebuild_analytics(self):
+        """从实时状态中的成交记录和资金曲线重建绩效汇总（已归档的更早成交不计入）"""
+        equity_points = [
+            (datetime.datetime.strptime(point['timestamp'], DATETIME_FORMAT).timestamp(), point['total_assets'])
+            for point in self.equity_store.query("day")
+        ]
+        return PerformanceAnalytics.rebuild(self.initial_cash, self.trade_history, equity_points)
+    
+    def get_analytics(self, stock_code=None):
+        """绩效指标：收益率、夏普比率、最大回撤、换手率、胜率、各股票已实现盈亏"""
+        with self.lock:
+            return self.analytics.report(stock_code)
+    
     def generate_report(self):
         """生成投资组合报告"""
         # 计算持仓股票的当前价格
@@ -653,8 +1295,8 @@ class TradingAPI:
         for stock in self.positions.keys():
             stock_prices[stock] = self.get_current_price(stock)
         
-        # 计算总资产
-        total_assets = self.get_total_assets()
+        # 计算总资产（复用上面的价格快照）
+        total_assets = self.get_total_assets(stock_prices)
         
         # 计算持仓详情
         position_details = {}
@@ -692,6 +1334,8 @@ class TradingAPI:
                 'buy_date': earliest_buy_date.strftime(DATE_FORMAT) if earliest_buy_date else "未知"
             }
         
+        trade_count, last_trade = self.get_trade_summary()
+        
         return {
             'cash': self.cash,
             'frozen_cash': self.frozen_cash,
@@ -699,14 +1343,14 @@ class TradingAPI:
             'frozen_positions': dict(self.frozen_positions),
             'stock_prices': stock_prices,
             'num_positions': len(self.positions),
-            'trade_count': len(self.trade_history),
+            'trade_count': trade_count,
             'pending_orders': len(self.pending_orders),
-            'last_trade': self.trade_history[-1] if self.trade_history else None,
-            'total_profit': self.get_total_profit(),
+            'last_trade': last_trade,
+            'total_profit': self.get_total_profit(stock_prices),
             'today_profit': self.today_profit,
             'total_assets': total_assets,
-            'stock_value': self.get_stock_value(),
-            'equity_history': self.equity_history
+            'stock_value': self.get_stock_value(stock_prices),
+            'equity_history': self.get_equity_history(limit=100)
         }
     
     def get_all_orders(self):
@@ -716,32 +1360,86 @@ class TradingAPI:
     def get_trade_history(self):
         """获取交易历史"""
         return self.trade_history
-    
-    def update_equity_history(self):
-        """更新资金曲线历史"""
-        now = datetime.datetime.now()
-        total_assets = self.get_total_assets()
-        
-        # 避免重复记录相同时间点的数据
-        if self.equity_history and self.equity_history[-1]['timestamp'] == now.strftime(DATETIME_FORMAT):
-            self.equity_history[-1] = {
-                'timestamp': now.strftime(DATETIME_FORMAT),
-                'total_assets': total_assets,
-                'cash': self.cash,
-                'stock_value': self.get_stock_value()
-            }
-        else:
-            self.equity_history.append({
-                'timestamp': now.strftime(DATETIME_FORMAT),
-                'total_assets': total_assets,
-                'cash': self.cash,
-                'stock_value': self.get_stock_value()
-            })
-        
-        # 只保留最近100条记录
-        if len(self.equity_history) > 100:
-            self.equity_history = self.equity_history[-100:]
 
-    def get_equity_history(self):
-        """获取资金曲线历史"""
-        return self.equity_history
\ No newline at end of file
+    def query_orders(self, **filters):
+        """分页查询订单（从新到旧），参数见 OrderIndex.query
+
+        只查询挂单时不触发历史订单加载
+        """
+        with self.lock:
+            statuses = parse_list(filters.get('status'))
+            if self._history_loader is not None and (not statuses or any(status != 'pending' for status in statuses)):
+                self._load_history()
+            return self.order_index.query(**filters)
+
+    def query_trades(self, **filters):
+        """分页查询成交记录（从新到旧），参数见 RecordIndex.query"""
+        with self.lock:
+            if self._history_loader is not None:
+                self._load_history()
+            return self.trade_index.query(**filters)
+
+    def update_equity_history(self, prices=None):
+        """记录一个资金快照（所有持仓只取一次价格）"""
+        if prices is None:
+            prices = {stock: self.get_current_price(stock) for stock in self.positions}
+        stock_value = self.get_stock_value(prices)
+        now = time.time()
+        self._ensure_equity_loaded()
+        self.equity_store.record(now, self.cash + stock_value, self.cash, stock_value)
+        self.analytics.record_equity(now, self.cash + stock_value)
+        self.equity_dirty = True
+    
+    def snapshot_equity(self):
+        """交易时段内按 equity_interval 定时记录资金快照"""
+        now = time.time()
+        if now - self.last_equity_snapshot < self.equity_interval:
+            return False
+        phase = get_trading_phase(datetime.datetime.now())
+        if phase in ["non_trading", "closed"]:
+            return False
+        self.last_equity_snapshot = now
+        
+        # 行情请求放在锁外，避免阻塞撮合
+        with self.lock:
+            stocks = list(self.positions.keys())
+        prices = {stock: self.get_current_price(stock) for stock in stocks}
+        with self.lock:
+            self.update_equity_history(prices)
+        return True
+    
+    def save_equity_store(self):
+        """保存资金曲线（只在有新数据时写入）"""
+        if not self.equity_dirty:
+            return
+        try:
+            self._ensure_equity_loaded()
+            self.equity_store.save()
+            self.equity_dirty = False
+        except Exception as e:
+            print(f"保存资金曲线失败: {str(e)}")
+    
+    def load_equity_store(self, legacy_history=None):
+        """加载资金曲线，旧版状态文件中的 equity_history 列表会被导入"""
+        try:
+            if self.equity_store.load():
+                return
+        except Exception as e:
+            print(f"加载资金曲线失败: {str(e)}")
+        if legacy_history:
+            self.equity_store.import_points(legacy_history)
+            self.equity_dirty = True
+    
+    def get_equity_history(self, resolution="tick", start=None, end=None, limit=None):
+        """获取资金曲线历史
+        
+        resolution: tick / minute / day
+        start, end: datetime 或 epoch 秒，闭区间
+        limit: 只返回区间内最近的若干条
+        """
+        if isinstance(start, datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end, datetime.datetime):
+            end = end.timestamp()
+        self._ensure_equity_loaded()
+        return self.equity_store.query(resolution, start, end, limit)
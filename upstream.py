@@ -0,0 +1,159 @@
+"""上游行情接口保护：令牌桶限流（撮合引擎优先）、熔断器、过期行情兜底"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# 请求优先级：撮合引擎/下单 > 界面查询
+PRIORITY_ENGINE = "engine"
+PRIORITY_UI = "ui"
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """上游不可用（被限流或已熔断），请求没有真正发出"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class TokenBucket:
+    """令牌桶限流，低优先级请求不能动用为撮合引擎预留的令牌"""
+
+    def __init__(self, rate=10.0, capacity=20, reserve=5):
+        self.rate = rate  # 每秒补充的令牌数
+        self.capacity = capacity
+        self.reserve = reserve  # 预留给撮合引擎的令牌数
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=PRIORITY_UI, timeout=1.0):
+        """取一个令牌，超时返回False"""
+        floor = 0 if priority == PRIORITY_ENGINE else self.reserve
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                self._refill()
+                if self.tokens - 1 >= floor:
+                    self.tokens -= 1
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # 等到刚好补足一个可用令牌
+                self.cond.wait(min(remaining, (floor + 1 - self.tokens) / self.rate))
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期过后放行一个探测请求"""
+
+    def __init__(self, failure_threshold=5, cooldown=10.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """是否允许发出请求"""
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == STATE_OPEN and now - self.opened_at >= self.cooldown:
+                # 冷却结束，只放行一个探测请求
+                self.state = STATE_HALF_OPEN
+                self.probe_at = now
+                return True
+            if self.state == STATE_HALF_OPEN and now - self.probe_at >= self.cooldown:
+                # 探测请求没有结果（如被限流），再放行一个
+                self.probe_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = STATE_CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    print(f"东方财富接口连续失败{self.failures}次，熔断{self.cooldown:.0f}秒")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+
+class UpstreamGuard:
+    """所有爬虫请求共享的限流器、熔断器和最近一次成功结果缓存"""
+
+    def __init__(self, rate=10.0, capacity=20, reserve=5, failure_threshold=5, cooldown=10.0,
+                 engine_wait=2.0, ui_wait=0.2, max_stale=600.0):
+        self.bucket = TokenBucket(rate, capacity, reserve)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.engine_wait = engine_wait  # 撮合引擎等待令牌的最长时间（秒）
+        self.ui_wait = ui_wait  # 界面请求等待令牌的最长时间（秒），超时直接用缓存
+        self.max_stale = max_stale  # 过期行情最多可使用多久（秒）
+        self._cache = {}  # {缓存键: (时间, JSON)}
+        self._local = threading.local()
+
+    @contextmanager
+    def priority(self, priority):
+        """在当前线程内设置请求优先级：with UPSTREAM.priority(PRIORITY_ENGINE): ..."""
+        previous = getattr(self._local, 'priority', PRIORITY_UI)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        return getattr(self._local, 'priority', PRIORITY_UI)
+
+    def before_request(self):
+        """请求前检查熔断和限流，不允许时抛出 UpstreamUnavailable"""
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("circuit_open", "行情接口熔断中")
+        priority = self.current_priority()
+        wait = self.engine_wait if priority == PRIORITY_ENGINE else self.ui_wait
+        if not self.bucket.acquire(priority, wait):
+            raise UpstreamUnavailable("rate_limited", "行情接口请求过于频繁")
+
+    def healthy(self):
+        """熔断器是否处于正常状态"""
+        return self.breaker.state == STATE_CLOSED
+
+    def store(self, key, json_data):
+        """缓存一次成功的结果"""
+        self._cache[key] = (time.time(), json_data)
+
+    def stale(self, key, engine_ok=False):
+        """取缓存的旧结果 (JSON, 已过期秒数)；撮合引擎默认不使用旧行情"""
+        if self.current_priority() == PRIORITY_ENGINE and not engine_ok:
+            return None
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        age = time.time() - cached[0]
+        if age > self.max_stale:
+            return None
+        return cached[1], age
+
+
+# 全局共享实例（UPSTREAM_RATE 为每秒请求数，对接本地模拟行情压测时可调高）
+UPSTREAM = UpstreamGuard(rate=float(os.environ.get('UPSTREAM_RATE', '10')))
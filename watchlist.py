@@ -0,0 +1,235 @@
+"""自选股与行情扫描：后台批量刷新自选股行情，扫描基于列式快照向量化计算"""
+import os
+import json
+import datetime
+import threading
+import numpy as np
+from common import DATETIME_FORMAT, get_trading_phase
+
+# 快照中的数值列
+SNAPSHOT_COLUMNS = (
+    "current", "open", "prev_close", "high", "low", "volume", "amount",
+    "change", "change_percent", "upper_limit", "lower_limit",
+    "interval_volume", "volume_ratio",
+)
+
+# 支持的扫描类型
+SCAN_TYPES = ("gainers", "losers", "movers", "limit_up", "limit_down", "volume_spike")
+
+
+class QuoteSnapshot:
+    """某一时刻所有自选股的列式行情快照（只读，刷新时整体替换）"""
+
+    def __init__(self, codes, names, columns, timestamp):
+        self.codes = codes
+        self.names = names
+        self.columns = columns  # {列名: np.ndarray(float64)}，缺失值为NaN
+        self.timestamp = timestamp
+        self.index = {code: i for i, code in enumerate(codes)}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def rows(self, indices):
+        """把指定下标的行转为字典列表"""
+        result = []
+        for i in indices:
+            row = {"code": self.codes[i], "name": self.names[i]}
+            for name, column in self.columns.items():
+                value = column[i]
+                row[name] = None if np.isnan(value) else round(float(value), 4)
+            result.append(row)
+        return result
+
+
+class WatchlistManager:
+    """服务端自选股：持久化到JSON，后台线程按固定间隔批量刷新所有自选股的并集"""
+
+    def __init__(self, data_source, filename="data/watchlists.json", interval=3.0,
+                 closed_interval=60.0, spike_alpha=0.2):
+        self.data_source = data_source
+        self.filename = filename
+        self.interval = interval  # 交易时段刷新间隔（秒）
+        self.closed_interval = closed_interval  # 非交易时段刷新间隔（秒）
+        self.spike_alpha = spike_alpha  # 成交量均值的指数平滑系数
+        self.watchlists = {}  # {名称: [股票代码]}
+        self.snapshot = QuoteSnapshot([], [], {name: np.empty(0) for name in SNAPSHOT_COLUMNS}, None)
+        self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._prev_volume = {}  # {股票代码: 上次的累计成交量}
+        self._avg_volume = {}  # {股票代码: 每个刷新间隔的平均成交量}
+        self.load()
+
+    def load(self):
+        """加载自选股"""
+        try:
+            if os.path.exists(self.filename):
+                with open(self.filename, encoding="utf-8") as f:
+                    self.watchlists = json.load(f)
+        except Exception as e:
+            print(f"加载自选股失败: {str(e)}")
+
+    def save(self):
+        """保存自选股"""
+        try:
+            with open(self.filename, "w", encoding="utf-8") as f:
+                json.dump(self.watchlists, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存自选股失败: {str(e)}")
+
+    def get_watchlists(self):
+        """所有自选股列表"""
+        with self.lock:
+            return {name: list(codes) for name, codes in self.watchlists.items()}
+
+    def set_watchlist(self, name, stock_codes):
+        """创建或替换自选股列表"""
+        if not name:
+            return False, "自选股名称不能为空"
+        codes = []
+        for code in stock_codes:
+            code = str(code).strip().lower()
+            if len(code) < 3 or code[:2] not in ("sh", "sz"):
+                return False, f"股票代码格式错误: {code}"
+            if code not in codes:
+                codes.append(code)
+        with self.lock:
+            self.watchlists[name] = codes
+            self.save()
+        # 新股票立即刷新，不用等下一个周期
+        self._wakeup.set()
+        return True, "自选股已保存"
+
+    def delete_watchlist(self, name):
+        """删除自选股列表"""
+        with self.lock:
+            if name not in self.watchlists:
+                return False, "自选股不存在"
+            del self.watchlists[name]
+            self.save()
+        return True, "自选股已删除"
+
+    def watched_codes(self):
+        """所有自选股的并集"""
+        with self.lock:
+            codes = set()
+            for stock_codes in self.watchlists.values():
+                codes.update(stock_codes)
+        return sorted(codes)
+
+    def start(self):
+        """启动后台刷新线程"""
+        def refresh_loop():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"刷新自选股行情失败: {str(e)}")
+                phase = get_trading_phase(datetime.datetime.now())
+                interval = self.closed_interval if phase in ["non_trading", "closed"] else self.interval
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+        refresh_thread = threading.Thread(target=refresh_loop, daemon=True)
+        refresh_thread.start()
+
+    def refresh(self):
+        """批量获取所有自选股行情，生成新的列式快照"""
+        codes = self.watched_codes()
+        if not codes:
+            return
+        quotes = self.data_source.get_batch_quotes(codes)
+        codes = [code for code in codes if code in quotes]
+
+        columns = {}
+        for name in SNAPSHOT_COLUMNS[:-2]:
+            columns[name] = np.array(
+                [quotes[code].get(name) for code in codes], dtype=np.float64)
+
+        # 接口未返回涨跌停价时按板块涨跌幅限制估算（创业板/科创板20%，其余10%）
+        limit_pct = np.array(
+            [0.2 if code[2:5] in ("300", "301", "688") else 0.1 for code in codes], dtype=np.float64)
+        prev_close = columns["prev_close"]
+        columns["upper_limit"] = np.where(
+            np.isnan(columns["upper_limit"]), np.round(prev_close * (1 + limit_pct), 2), columns["upper_limit"])
+        columns["lower_limit"] = np.where(
+            np.isnan(columns["lower_limit"]), np.round(prev_close * (1 - limit_pct), 2), columns["lower_limit"])
+
+        # 本次刷新间隔内的成交量及其相对历史均值的倍数
+        volume = columns["volume"]
+        prev_volume = np.array([self._prev_volume.get(code, np.nan) for code in codes], dtype=np.float64)
+        avg_volume = np.array([self._avg_volume.get(code, np.nan) for code in codes], dtype=np.float64)
+        interval_volume = volume - prev_volume
+        # 累计成交量回落说明已经换日，本次间隔量无效
+        interval_volume[interval_volume < 0] = np.nan
+        with np.errstate(divide="ignore", invalid="ignore"):
+            volume_ratio = np.where(avg_volume > 0, interval_volume / avg_volume, np.nan)
+        new_avg = np.where(
+            np.isnan(avg_volume), interval_volume,
+            self.spike_alpha * interval_volume + (1 - self.spike_alpha) * avg_volume)
+        new_avg = np.where(np.isnan(interval_volume), avg_volume, new_avg)
+        columns["interval_volume"] = interval_volume
+        columns["volume_ratio"] = volume_ratio
+
+        for i, code in enumerate(codes):
+            self._prev_volume[code] = volume[i]
+            if not np.isnan(new_avg[i]):
+                self._avg_volume[code] = new_avg[i]
+
+        names = [quotes[code].get("name") or f"股票{code[-4:]}" for code in codes]
+        self.snapshot = QuoteSnapshot(codes, names, columns, datetime.datetime.now().strftime(DATETIME_FORMAT))
+
+    def get_watchlist_quotes(self, name):
+        """某个自选股列表的最新行情（来自共享快照）"""
+        with self.lock:
+            codes = self.watchlists.get(name)
+        if codes is None:
+            return None
+        snapshot = self.snapshot
+        indices = [snapshot.index[code] for code in codes if code in snapshot.index]
+        return {"timestamp": snapshot.timestamp, "quotes": snapshot.rows(indices)}
+
+    def scan(self, scan_type, limit=20, threshold=None):
+        """在快照上做向量化扫描
+
+        gainers/losers/movers: 按涨跌幅排序
+        limit_up/limit_down: 触及涨停/跌停
+        volume_spike: 本次间隔成交量超过均值 threshold 倍（默认3倍）
+        """
+        if scan_type not in SCAN_TYPES:
+            raise ValueError(f"不支持的扫描类型: {scan_type}")
+        if limit < 1:
+            raise ValueError("limit 必须大于0")
+        snapshot = self.snapshot
+        if not len(snapshot):
+            return {"timestamp": snapshot.timestamp, "results": []}
+
+        columns = snapshot.columns
+        change_percent = columns["change_percent"]
+        current = columns["current"]
+        valid = ~np.isnan(change_percent)
+
+        if scan_type == "gainers":
+            order = np.argsort(-np.where(valid, change_percent, -np.inf), kind="stable")
+            indices = order[:min(limit, int(valid.sum()))]
+        elif scan_type == "losers":
+            order = np.argsort(np.where(valid, change_percent, np.inf), kind="stable")
+            indices = order[:min(limit, int(valid.sum()))]
+        elif scan_type == "movers":
+            order = np.argsort(-np.where(valid, np.abs(change_percent), -np.inf), kind="stable")
+            indices = order[:min(limit, int(valid.sum()))]
+        elif scan_type == "limit_up":
+            upper_limit = columns["upper_limit"]
+            hit = (upper_limit > 0) & (current >= upper_limit - 0.005)
+            indices = np.flatnonzero(hit)[:limit]
+        elif scan_type == "limit_down":
+            lower_limit = columns["lower_limit"]
+            hit = (lower_limit > 0) & (current <= lower_limit + 0.005)
+            indices = np.flatnonzero(hit)[:limit]
+        else:
+            threshold = threshold or 3.0
+            ratio = columns["volume_ratio"]
+            hit = np.flatnonzero(np.nan_to_num(ratio, nan=0.0) >= threshold)
+            indices = hit[np.argsort(-ratio[hit], kind="stable")][:limit]
+
+        return {"timestamp": snapshot.timestamp, "results": snapshot.rows(indices.tolist())}